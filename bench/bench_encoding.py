@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""文字コード判定のベンチマーク（変更前の apparent_encoding vs EncodingResolver）
+
+使い方:
+    python bench/bench_encoding.py [繰り返し回数]
+
+bench/fixtures/kakaku_*.html（Shift_JIS）を requests.Response に詰め、Content-Type に charset がある場合・
+<meta charset> だけの場合・どちらもない場合（ホストごとの前回値）について、
+1ページあたりの判定時間を比較する。デコード結果が変更前と一致することも確認する
+（Shift_JIS を cp932 として読むことによる 〜→～ などの差はブラウザと同じ表示なので除く）。
+"""
+import glob
+import os
+import re
+import sys
+import time
+
+# 永続キャッシュを作らない
+os.environ.setdefault('PRICE_CACHE_DB', '')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import requests  # noqa: E402
+
+import scraper  # noqa: E402
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+URL = 'https://kakaku.com/search_results/bench/'
+
+# Shift_JIS と cp932 で異なる文字（cp932 側がブラウザの表示と同じ）
+SJIS_TO_CP932 = str.maketrans('〜‖−¢£¬', '～∥－￠￡￢')
+
+
+def make_response(body, content_type):
+    res = requests.Response()
+    res._content = body
+    res.status_code = 200
+    res.url = URL
+    res.headers['Content-Type'] = content_type
+    return res
+
+
+def legacy_resolve(res):
+    return res.apparent_encoding or 'utf-8'
+
+
+def time_per_page(resolve, body, content_type, repeat):
+    """(1ページあたりの判定時間[ms], 判定した文字コード) を返す"""
+    elapsed = 0.0
+    for _ in range(repeat):
+        # apparent_encoding はレスポンスごとに再計算されるため毎回作り直す
+        res = make_response(body, content_type)
+        start = time.perf_counter()
+        encoding = resolve(res)
+        elapsed += time.perf_counter() - start
+    return elapsed * 1000 / repeat, encoding
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    paths = sorted(glob.glob(os.path.join(FIXTURE_DIR, 'kakaku_*.html')))
+    mismatches = 0
+
+    print(f"{'ページ':<28}{'条件':<10}{'変更前':>12}{'変更後':>12}  文字コード")
+    for path in paths:
+        with open(path, 'rb') as f:
+            body = f.read()
+        no_meta = re.sub(rb'<meta[^>]*charset[^>]*>', b'', body, count=1)
+
+        resolver = scraper.EncodingResolver(scraper.ENCODING_SNIFF_BYTES)
+        cases = [
+            ('header', body, 'text/html; charset=Shift_JIS'),
+            ('meta', body, 'text/html'),
+            # meta の判定でホストの文字コードを覚えた後なので前回値が使われる
+            ('host', no_meta, 'text/html'),
+        ]
+        for label, page, content_type in cases:
+            before_ms, before = time_per_page(legacy_resolve, page, content_type, repeat)
+            after_ms, after = time_per_page(resolver.resolve, page, content_type, repeat)
+            print(f"{os.path.basename(path):<28}{label:<10}{before_ms:>10.2f}ms{after_ms:>10.2f}ms"
+                  f"  {before} → {after}  x{before_ms / after_ms:.0f}")
+            if page.decode(before).translate(SJIS_TO_CP932) != page.decode(after):
+                mismatches += 1
+                print("  ❌ デコード結果が一致しません")
+
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
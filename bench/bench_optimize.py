@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""構成の最適化のベンチマーク（optimize_builds）
+
+使い方:
+    python bench/bench_optimize.py [カテゴリごとの候補数] [予算]
+
+架空の候補（ソケット・TDP・消費電力・電源容量・フォームファクターつき）をカテゴリごとに作り、
+安い構成 top_k 件を探す時間と探索したノード数を表示する。
+小さい候補表では全組み合わせを調べた結果と一致することも確認する。
+組める構成がない・ごく一部の候補でしか組めない難しい例でも、上限に達せずに終わることを確認する。
+"""
+import itertools
+import os
+import random
+import sys
+import time
+
+# 永続キャッシュを作らない
+os.environ.setdefault('PRICE_CACHE_DB', '')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import scraper  # noqa: E402
+
+CATEGORIES = scraper.DEFAULT_BUILD_CATEGORIES
+SOCKETS = ['AM4', 'AM5', 'LGA1700', 'LGA1851', None]
+FORM_FACTORS = list(scraper.FORM_FACTOR_SIZES) + [None]
+TOP_K = 5
+
+
+def make_candidates(category, count, rng):
+    """category の架空の候補を count 件作る"""
+    rows = []
+    for i in range(count):
+        row = {'name': f'{category}-{i}', 'price': rng.randint(3000, 120000)}
+        if category == 'cpu':
+            row.update(socket=rng.choice(SOCKETS), tdp=f'{rng.choice([65, 105, 125, 170])}W')
+        elif category == 'motherboard':
+            row.update(socket=rng.choice(SOCKETS), formFactor=rng.choice(FORM_FACTORS))
+        elif category == 'case':
+            row.update(formFactor=rng.choice(FORM_FACTORS))
+        elif category == 'gpu':
+            row.update(power=f'{rng.choice([115, 200, 285, 320, 450])}W')
+        elif category == 'psu':
+            row.update(wattage=f'{rng.choice([450, 550, 650, 750, 850, 1000, 1200])}W')
+        rows.append(row)
+    return rows
+
+
+def make_tables(count, seed=1, overrides=None):
+    """overrides: {カテゴリ: 候補の辞書を返す関数(i, rng)} で一部のカテゴリの候補を差し替える"""
+    rng = random.Random(seed)
+    tables = {}
+    for category in CATEGORIES:
+        rows = make_candidates(category, count, rng)
+        if overrides and category in overrides:
+            rows = [dict(row, **overrides[category](i, rng)) for i, row in enumerate(rows)]
+        tables[category] = scraper.CandidateTable(category, rows)
+    return tables
+
+
+# 組める構成がない・ごく一部の高い候補でしか組めない候補表（探索が深くまで進んでから行き詰まる例）
+ADVERSARIAL = [
+    ('電源がすべて300W（GPU 450W）', {
+        'psu': lambda i, rng: {'wattage': '300W'},
+        'gpu': lambda i, rng: {'power': '450W'},
+    }),
+    ('足りる電源は最も高い1件だけ', {
+        'psu': lambda i, rng: {'wattage': '1200W', 'price': 200000} if i == 0 else {'wattage': '300W'},
+        'gpu': lambda i, rng: {'power': '450W'},
+    }),
+    ('ケースがすべてMini-ITX（マザーボードはATX）', {
+        'case': lambda i, rng: {'formFactor': 'Mini-ITX'},
+        'motherboard': lambda i, rng: {'formFactor': 'ATX'},
+    }),
+    ('CPUのTDPがすべて異なる', {
+        'cpu': lambda i, rng: {'tdp': f'{rng.uniform(35, 250):.1f}W'},
+        'psu': lambda i, rng: {'wattage': f'{rng.choice([450, 500, 550, 600])}W'},
+    }),
+    ('ソケットが合うマザーボードは1件だけ', {
+        'cpu': lambda i, rng: {'socket': 'AM5'},
+        'motherboard': lambda i, rng: {'socket': 'AM5' if i == 0 else 'LGA1700'},
+    }),
+]
+
+
+def brute_force(tables, budget, top_k):
+    """全組み合わせから互換性のある構成の合計金額を安い順に top_k 件返す"""
+    categories = [category for category in scraper.BUILD_CATEGORIES if category in tables]
+    totals = []
+    for picks in itertools.product(*(range(len(tables[category])) for category in categories)):
+        part = dict(zip(categories, picks))
+        cpu, board, case = tables['cpu'], tables['motherboard'], tables['case']
+        socket, board_socket = cpu.sockets[part['cpu']], board.sockets[part['motherboard']]
+        if socket is not None and board_socket is not None and socket != board_socket:
+            continue
+        size, case_size = board.sizes[part['motherboard']], case.sizes[part['case']]
+        if size is not None and case_size is not None and case_size < size:
+            continue
+        load = scraper.BASE_POWER_W + cpu.watts[part['cpu']] + tables['gpu'].watts[part['gpu']]
+        capacity = tables['psu'].capacities[part['psu']]
+        if capacity is not None and capacity * scraper.PSU_LOAD_RATIO < load:
+            continue
+        total = sum(tables[category].prices[i] for category, i in part.items())
+        if total <= budget:
+            totals.append(total)
+    return sorted(totals)[:top_k]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    budget = int(sys.argv[2]) if len(sys.argv) > 2 else 150000
+
+    # 小さい候補表（難しい例も含む）で全組み合わせと比べる
+    cases = [(None, seed) for seed in range(20)] + [(overrides, seed) for _, overrides in ADVERSARIAL for seed in range(5)]
+    for overrides, seed in cases:
+        small = make_tables(5, seed=seed, overrides=overrides)
+        for small_budget in (60000, 150000, 300000, 600000):
+            expected = brute_force(small, small_budget, TOP_K)
+            actual = [build['total'] for build in scraper.optimize_builds(small, small_budget, TOP_K)['builds']]
+            if actual != expected:
+                print(f"  ❌ 全組み合わせの結果と一致しません（予算 {small_budget}）: {actual} != {expected}")
+                return 1
+    print(f"全組み合わせの結果と一致（候補5件×7カテゴリ・{len(cases)}通りの候補表）")
+
+    start = time.perf_counter()
+    tables = make_tables(count)
+    build_ms = (time.perf_counter() - start) * 1000
+    print(f"候補 {count}件×{len(CATEGORIES)}カテゴリ（組み合わせ {count ** len(CATEGORIES):.1e}通り）"
+          f"・候補表の作成 {build_ms:.0f}ms")
+    print(f"{'予算':>10}{'探索':>10}{'ノード数':>12}{'最安':>10}{'打ち切り':>10}")
+    for target in (budget // 2, budget, budget * 2):
+        start = time.perf_counter()
+        result = scraper.optimize_builds(tables, target, TOP_K)
+        elapsed = (time.perf_counter() - start) * 1000
+        cheapest = result['builds'][0]['total'] if result['builds'] else '-'
+        print(f"{target:>10}{elapsed:>8.1f}ms{result['nodes']:>12}{cheapest:>10}{str(result['truncated']):>10}")
+
+    print(f"\n難しい例（予算 {budget * 2}）")
+    slow = 0
+    for label, overrides in ADVERSARIAL:
+        tables = make_tables(count, overrides=overrides)
+        start = time.perf_counter()
+        result = scraper.optimize_builds(tables, budget * 2, TOP_K)
+        elapsed = (time.perf_counter() - start) * 1000
+        cheapest = result['builds'][0]['total'] if result['builds'] else '-'
+        print(f"  {label:<28}{elapsed:>8.1f}ms{result['nodes']:>10}{cheapest:>10}{str(result['truncated']):>8}")
+        if result['truncated']:
+            slow += 1
+            print("  ❌ 上限に達して打ち切られました")
+    return 1 if slow else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""価格.com検索結果ページの解析ベンチマーク（変更前の全体解析 vs 商品一覧のみの解析）
+
+使い方:
+    python bench/bench_parse.py [繰り返し回数]
+
+bench/fixtures/kakaku_search_*.html を解析し、1ページあたりのCPU時間と
+ピークメモリを比較する。最安値の商品（価格・商品名・画像）が一致することも確認する。
+"""
+import contextlib
+import glob
+import io
+import os
+import re
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bs4 import BeautifulSoup  # noqa: E402
+
+import scraper  # noqa: E402
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def legacy_parse(html, product_name=''):
+    """変更前の search_kakaku と同じ手順で最安値の商品を取り出す"""
+    soup = BeautifulSoup(html, "html.parser")
+
+    items = soup.select(".p-item")
+    if not items:
+        items = soup.select("li.item")
+    if not items:
+        items = soup.select("[data-item]")
+    if not items:
+        items = soup.select(".productlist_item")
+    if not items:
+        return None
+
+    price_list = []
+    for idx, item in enumerate(items):
+        price_elem = item.select_one(".p-item_price")
+        if not price_elem:
+            price_elem = item.select_one(".item_price")
+        if not price_elem:
+            price_elem = item.select_one(".price")
+        if not price_elem:
+            price_elem = item.select_one("span.priceTxt")
+        if not price_elem:
+            price_elem = item.select_one(".pryen")
+
+        if price_elem:
+            try:
+                price_num = int(re.sub(r"[^\d]", "", price_elem.get_text(strip=True)))
+                if 100 <= price_num < 1000000000:
+                    price_list.append({'price': price_num, 'item': item, 'index': idx})
+            except (ValueError, AttributeError):
+                continue
+
+    if not price_list:
+        return None
+
+    price_list.sort(key=lambda x: x['price'])
+    best_item = price_list[0]['item']
+
+    name_elem = best_item.select_one(".p-item_name")
+    if not name_elem:
+        name_elem = best_item.select_one(".item_name")
+    if not name_elem:
+        name_elem = best_item.select_one("h3")
+    if not name_elem:
+        name_elem = best_item.select_one("a")
+    if not name_elem:
+        name_elem = best_item.select_one(".productName")
+    name = name_elem.get_text(strip=True) if name_elem else product_name
+
+    img_tag = best_item.select_one("img.p-item_image")
+    if not img_tag:
+        img_tag = best_item.select_one("img.lazy")
+    if not img_tag:
+        img_tag = best_item.select_one("img[data-original]")
+    if not img_tag:
+        img_tag = best_item.select_one("img")
+
+    image_url = ""
+    if img_tag:
+        image_url = (img_tag.get("data-original") or img_tag.get("data-src") or
+                     img_tag.get("data-lazy-src") or img_tag.get("src") or "")
+        if image_url and not image_url.startswith("http"):
+            if image_url.startswith("//"):
+                image_url = "https:" + image_url
+            elif image_url.startswith("/"):
+                image_url = "https://kakaku.com" + image_url
+        if image_url and any(skip in image_url.lower() for skip in ['noimage', 'placeholder', 'loading', '1x1']):
+            image_url = ""
+    if not image_url or not image_url.startswith("http"):
+        image_url = ""
+
+    return price_list[0]['price'], name, image_url
+
+
+def fast_parse(html, product_name=''):
+    offers = scraper.parse_kakaku_offers(html, product_name)
+    if not offers:
+        return None
+    best = offers[0]
+    return best['price'], best['name'], best['image']
+
+
+def measure(parse, html, repeat):
+    """(1回あたりのCPU時間[ms], ピークメモリ[KB], 結果) を返す"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.process_time()
+        for _ in range(repeat):
+            result = parse(html)
+        cpu_ms = (time.process_time() - start) * 1000 / repeat
+
+        tracemalloc.start()
+        parse(html)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return cpu_ms, peak / 1024, result
+
+
+def load_fixture(path):
+    with open(path, 'rb') as f:
+        return f.read().decode('cp932')
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    paths = sorted(glob.glob(os.path.join(FIXTURE_DIR, 'kakaku_search_*.html')))
+    mismatches = 0
+
+    print(f"{'ページ':<28}{'変更前 CPU':>12}{'変更後 CPU':>12}{'変更前 メモリ':>14}{'変更後 メモリ':>14}")
+    for path in paths:
+        html = load_fixture(path)
+        before_ms, before_kb, before = measure(legacy_parse, html, repeat)
+        after_ms, after_kb, after = measure(fast_parse, html, repeat)
+        print(f"{os.path.basename(path):<28}{before_ms:>10.2f}ms{after_ms:>10.2f}ms"
+              f"{before_kb:>12.0f}KB{after_kb:>12.0f}KB  x{before_ms / after_ms:.1f}")
+        if before != after:
+            mismatches += 1
+            print(f"  ❌ 結果が一致しません: {before} != {after}")
+
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
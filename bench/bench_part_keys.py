@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""キャッシュのキーの比較（変更前の normalize_product_name vs 型番の正規化 PartKeyNormalizer）
+
+使い方:
+    python bench/bench_part_keys.py [検索ログ]
+
+bench/fixtures/query_log.tsv（カテゴリ・検索語・価格.comで見つかった商品名）を先頭から再生し、
+キャッシュの期限が切れない前提で 価格.comへの取得回数とキャッシュのヒット率 を比較する。
+取得のたびに記録した商品名から言い換えを覚える（アプリと同じ）。
+異なる商品名が記録された検索語を同じキーにまとめてしまった場合は失敗とする。
+"""
+import os
+import sys
+import time
+
+# 永続キャッシュを作らない
+os.environ.setdefault('PRICE_CACHE_DB', '')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import scraper  # noqa: E402
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def load_log(path):
+    entries = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.startswith('#') or not line.strip():
+                continue
+            category, query, product = line.rstrip('\n').split('\t')
+            entries.append((category, query, product))
+    return entries
+
+
+def replay(entries, key_func, learn=None):
+    """(取得回数, キー → 記録された商品名の集合) を返す"""
+    cache = {}
+    fetches = 0
+    for category, query, product in entries:
+        key = (key_func(query, category), category)
+        if key not in cache:
+            fetches += 1
+            cache[key] = set()
+            if learn is not None:
+                learn(query, category, product)
+        cache[key].add(product)
+    return fetches, cache
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(FIXTURE_DIR, 'query_log.tsv')
+    entries = load_log(path)
+    products = len({(category, product) for category, _, product in entries})
+
+    before, _ = replay(entries, lambda query, category: scraper.normalize_product_name(query))
+    normalizer = scraper.PartKeyNormalizer(scraper.PART_ALIAS_MAX)
+    after, cache = replay(entries, normalizer.key, normalizer.learn)
+
+    print(f"検索 {len(entries)}件・商品 {products}件")
+    print(f"{'キー':<24}{'取得回数':>10}{'ヒット率':>10}")
+    for label, fetches in (('normalize_product_name', before), ('PartKeyNormalizer', after)):
+        print(f"{label:<24}{fetches:>10}{1 - fetches / len(entries):>10.1%}")
+    print(f"覚えた言い換え: {normalizer.stats()['aliases']}件")
+
+    scraper.parse_part_model.cache_clear()
+    start = time.perf_counter()
+    for category, query, _ in entries:
+        normalizer.resolve(query, category)
+    elapsed = time.perf_counter() - start
+    print(f"キーの計算: {elapsed * 1e6 / len(entries):.1f}µs/件（文法の解析結果のキャッシュを空にしてから）")
+
+    merged = {key: names for key, names in cache.items() if len(names) > 1}
+    for key, names in merged.items():
+        print(f"  ❌ 別の商品を同じキーにまとめました: {key}: {sorted(names)}")
+    return 1 if merged else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""スペック抽出の正解データ照合とスループット計測
+
+使い方:
+    python bench/bench_specs.py [繰り返し回数]
+
+bench/fixtures/spec_golden.json（変更前の extract_*_specs の出力）と
+extract_specs / extract_specs_batch の結果が一致するか確認し、
+カテゴリごとに 変更前の関数・1件ずつ・一括 の titles/sec を比較する。
+"""
+import contextlib
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import scraper  # noqa: E402
+import legacy_extractors  # noqa: E402
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+LEGACY_EXTRACTORS = {
+    'cpu': legacy_extractors.extract_cpu_specs,
+    'motherboard': legacy_extractors.extract_motherboard_specs,
+    'memory': legacy_extractors.extract_memory_specs,
+    'gpu': legacy_extractors.extract_gpu_specs,
+    'storage': legacy_extractors.extract_storage_specs,
+    'psu': legacy_extractors.extract_psu_specs,
+    'case': legacy_extractors.extract_case_specs,
+    'cooler': legacy_extractors.extract_cooler_specs,
+    'os': legacy_extractors.extract_os_specs,
+}
+
+
+def load_golden():
+    with open(os.path.join(FIXTURE_DIR, 'spec_golden.json'), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def check_golden(golden):
+    """正解データと一致しない件数を返す"""
+    mismatches = 0
+    by_category = {}
+    for case in golden:
+        by_category.setdefault(case['category'], []).append(case)
+        actual = scraper.extract_specs(case['category'], case['title'])
+        if actual != case['specs']:
+            mismatches += 1
+            print(f"❌ [{case['category']}] {case['title']!r}: {actual} != {case['specs']}")
+
+    for category, cases in by_category.items():
+        batch = scraper.extract_specs_batch(category, [case['title'] for case in cases])
+        for case, actual in zip(cases, batch):
+            if actual != case['specs']:
+                mismatches += 1
+                print(f"❌ 一括 [{category}] {case['title']!r}: {actual} != {case['specs']}")
+    return mismatches
+
+
+def titles_per_sec(func, titles):
+    start = time.perf_counter()
+    func(titles)
+    return len(titles) / (time.perf_counter() - start)
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    golden = load_golden()
+
+    mismatches = check_golden(golden)
+    print(f"正解データ: {len(golden)}件中 {len(golden) * 2 - mismatches}/{len(golden) * 2} 一致（1件ずつ + 一括）")
+
+    titles_by_category = {}
+    for case in golden:
+        titles_by_category.setdefault(case['category'], []).append(case['title'])
+
+    print(f"\n{'カテゴリ':<14}{'変更前':>14}{'1件ずつ':>14}{'一括':>14}  (titles/sec)")
+    for category, titles in titles_by_category.items():
+        titles = titles * repeat
+        legacy = LEGACY_EXTRACTORS[category]
+        extractor = scraper.SPEC_EXTRACTORS[category]
+
+        with open(os.devnull, 'w', encoding='utf-8') as devnull, contextlib.redirect_stdout(devnull):
+            before = titles_per_sec(lambda ts: [legacy(t) for t in ts], titles)
+        single = titles_per_sec(lambda ts: [extractor.extract(t) for t in ts], titles)
+        batch = titles_per_sec(extractor.extract_batch, titles)
+        print(f"{category:<14}{before:>14,.0f}{single:>14,.0f}{batch:>14,.0f}")
+
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""検索結果の受信ベンチマーク（本文全体の受信 vs 商品要素が揃った時点での打ち切り）
+
+使い方:
+    python bench/bench_stream.py [繰り返し回数] [帯域 KB/秒]
+
+bench/fixtures の価格.comのページを、帯域を絞ったローカルサーバーから少しずつ返し、
+1ページあたりの 受信時間・受信バイト数・解析のCPU時間・ピークメモリ を比較する。
+最安値の商品（検索結果）とサジェストの候補が全体を受信した場合と一致することも確認する。
+"""
+import asyncio
+import os
+import sys
+import time
+import tracemalloc
+
+# 永続キャッシュを作らず、送信レートの制限も外す
+os.environ.setdefault('PRICE_CACHE_DB', '')
+os.environ.setdefault('HTTP_HOST_RATE', '0')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from aiohttp import web  # noqa: E402
+
+import scraper  # noqa: E402
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+PORT = 8979
+CHUNK_BYTES = 8192
+
+
+def best_offer(html):
+    offers = scraper.parse_kakaku_offers(html)
+    return (offers[0]['price'], offers[0]['name'], offers[0]['image']) if offers else None
+
+
+# (ページ, 受信する商品要素の数, 解析関数)
+PAGES = [
+    ('kakaku_search_cpu.html', scraper.KAKAKU_STREAM_ITEMS, best_offer),
+    ('kakaku_search_gpu.html', scraper.KAKAKU_STREAM_ITEMS, best_offer),
+    ('kakaku_suggest_memory.html', scraper.SUGGEST_STREAM_ITEMS,
+     lambda html: scraper.parse_kakaku_suggestions(html, 'memory')),
+]
+
+
+async def start_server(pages, kb_per_sec):
+    """帯域を kb_per_sec に絞ってページを返すサーバー"""
+    async def handle(request):
+        body = pages[request.match_info['name']]
+        response = web.StreamResponse(headers={'Content-Type': 'text/html; charset=Shift_JIS'})
+        await response.prepare(request)
+        try:
+            for start in range(0, len(body), CHUNK_BYTES):
+                await response.write(body[start:start + CHUNK_BYTES])
+                await asyncio.sleep(CHUNK_BYTES / 1024 / kb_per_sec)
+            await response.write_eof()
+        except ConnectionResetError:
+            # 打ち切った側が接続を閉じた
+            pass
+        return response
+
+    app = web.Application()
+    app.router.add_get('/{name}', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', PORT).start()
+    return runner
+
+
+def fetch_and_parse(url, reader, parse):
+    """(受信時間[ms], 受信バイト数, 解析のCPU時間[ms], 結果) を返す"""
+    start = time.perf_counter()
+    res = scraper.async_upstream.run(scraper.async_upstream.get(url, reader=reader))
+    fetch_ms = (time.perf_counter() - start) * 1000
+    size = len(res.content)
+
+    cpu_start = time.process_time()
+    result = scraper._parse_response(res, parse)
+    cpu_ms = (time.process_time() - cpu_start) * 1000
+    return fetch_ms, size, cpu_ms, result
+
+
+def measure(url, reader, parse, repeat):
+    totals = [0.0, 0, 0.0]
+    for _ in range(repeat):
+        fetch_ms, size, cpu_ms, result = fetch_and_parse(url, reader, parse)
+        totals[0] += fetch_ms
+        totals[1] = size
+        totals[2] += cpu_ms
+
+    tracemalloc.start()
+    fetch_and_parse(url, reader, parse)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return totals[0] / repeat, totals[1], totals[2] / repeat, peak / 1024, result
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    kb_per_sec = float(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    pages = {}
+    for filename, _, _ in PAGES:
+        with open(os.path.join(FIXTURE_DIR, filename), 'rb') as f:
+            pages[filename] = f.read()
+    runner = scraper.async_upstream.run(start_server(pages, kb_per_sec))
+
+    mismatches = 0
+    print(f"帯域 {kb_per_sec:.0f}KB/秒（{CHUNK_BYTES // 1024}KBずつ送信）")
+    print(f"{'ページ':<28}{'方式':<8}{'受信':>10}{'受信量':>10}{'解析CPU':>10}{'ピークメモリ':>12}")
+    try:
+        for filename, max_items, parse in PAGES:
+            url = f'http://127.0.0.1:{PORT}/{filename}'
+            rows = [
+                ('全体', measure(url, None, parse, repeat)),
+                ('打ち切り', measure(url, scraper.stream_reader.reader(max_items), parse, repeat)),
+            ]
+            for label, (fetch_ms, size, cpu_ms, peak_kb, _) in rows:
+                print(f"{filename:<28}{label:<8}{fetch_ms:>8.1f}ms{size / 1024:>8.0f}KB"
+                      f"{cpu_ms:>8.2f}ms{peak_kb:>10.0f}KB")
+            if rows[0][1][4] != rows[1][1][4]:
+                mismatches += 1
+                print(f"  ❌ 結果が一致しません: {rows[0][1][4]} != {rows[1][1][4]}")
+    finally:
+        scraper.async_upstream.run(runner.cleanup())
+
+    print(f"\n{scraper.stream_reader.stats()}")
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+"""変更前のスペック抽出関数（ベンチマークの比較用にそのまま残したもの）"""
+
+
+def extract_cpu_specs(product_name):
+    """CPUの商品名からソケット情報を抽出"""
+    specs = {}
+    import re
+
+    # ソケット情報のパターン
+    socket_patterns = {
+        'LGA1700': ['LGA1700', 'LGA 1700'],
+        'LGA1200': ['LGA1200', 'LGA 1200'],
+        'LGA1151': ['LGA1151', 'LGA 1151'],
+        'AM5': ['AM5', 'Socket AM5'],
+        'AM4': ['AM4', 'Socket AM4'],
+        'sTRX4': ['sTRX4', 'TRX4'],
+        'sTR4': ['sTR4', 'TR4'],
+    }
+
+    # CPUモデルからソケットを推定
+    product_lower = product_name.lower()
+
+    # TDP情報を抽出
+    tdp_patterns = [
+        r'tdp\s*(\d{2,3})\s*w',
+        r'(\d{2,3})\s*w\s*tdp',
+    ]
+    for pattern in tdp_patterns:
+        match = re.search(pattern, product_lower)
+        if match:
+            specs['tdp'] = match.group(1) + 'W'
+            print(f"  ⚡ 検出したTDP: {specs['tdp']}")
+            break
+
+    # Intel 12th-14th Gen (Alder Lake, Raptor Lake) -> LGA1700
+    if any(cpu in product_lower for cpu in ['12th', '13th', '14th', 'i3-12', 'i3-13', 'i3-14',
+                                               'i5-12', 'i5-13', 'i5-14',
+                                               'i7-12', 'i7-13', 'i7-14',
+                                               'i9-12', 'i9-13', 'i9-14']):
+        specs['socket'] = 'LGA1700'
+
+    # Intel 10th-11th Gen (Comet Lake, Rocket Lake) -> LGA1200
+    elif any(cpu in product_lower for cpu in ['10th', '11th', 'i3-10', 'i3-11',
+                                                'i5-10', 'i5-11',
+                                                'i7-10', 'i7-11',
+                                                'i9-10', 'i9-11']):
+        specs['socket'] = 'LGA1200'
+
+    # AMD Ryzen 7000 series -> AM5
+    elif any(cpu in product_lower for cpu in ['ryzen 7 7', 'ryzen 5 7', 'ryzen 9 7',
+                                                'ryzen 3 7', '7950x', '7900x', '7800x3d',
+                                                '7700x', '7600x', '7600']):
+        specs['socket'] = 'AM5'
+
+    # AMD Ryzen 5000, 3000, 2000, 1000 series -> AM4
+    elif any(cpu in product_lower for cpu in ['ryzen 7 5', 'ryzen 5 5', 'ryzen 9 5',
+                                                'ryzen 7 3', 'ryzen 5 3', 'ryzen 9 3',
+                                                'ryzen 7 2', 'ryzen 5 2',
+                                                'ryzen 7 1', 'ryzen 5 1',
+                                                '5950x', '5900x', '5800x3d', '5800x', '5700x', '5600x', '5600',
+                                                '3950x', '3900x', '3800x', '3700x', '3600x', '3600']):
+        specs['socket'] = 'AM4'
+
+    # AMD Threadripper -> sTRX4 or sTR4
+    elif 'threadripper' in product_lower:
+        if any(model in product_lower for model in ['3990x', '3970x', '3960x']):
+            specs['socket'] = 'sTRX4'
+        else:
+            specs['socket'] = 'sTR4'
+
+    # 商品名に直接ソケット情報が含まれている場合
+    for socket_name, patterns in socket_patterns.items():
+        for pattern in patterns:
+            if pattern.lower() in product_lower:
+                specs['socket'] = socket_name
+                break
+
+    return specs
+
+
+def extract_psu_specs(product_name):
+    """電源ユニットの商品名から容量と認証を抽出"""
+    specs = {}
+    product_lower = product_name.lower()
+
+    # ワット数を抽出（例: 850W, 850ワット, 850watt）
+    import re
+    wattage_patterns = [
+        r'(\d{3,4})\s*w(?:att)?(?:\s|$)',  # 850W, 850watt
+        r'(\d{3,4})\s*ワット',              # 850ワット
+    ]
+
+    for pattern in wattage_patterns:
+        match = re.search(pattern, product_lower)
+        if match:
+            specs['wattage'] = match.group(1) + 'W'
+            print(f"  🔋 検出したワット数: {specs['wattage']}")
+            break
+
+    # 80 PLUS認証を抽出
+    certifications = {
+        '80 PLUS Titanium': ['titanium', 'チタン'],
+        '80 PLUS Platinum': ['platinum', 'プラチナ'],
+        '80 PLUS Gold': ['gold', 'ゴールド'],
+        '80 PLUS Silver': ['silver', 'シルバー'],
+        '80 PLUS Bronze': ['bronze', 'ブロンズ'],
+        '80 PLUS Standard': ['80 plus standard', '80plus standard'],
+    }
+
+    for cert_name, keywords in certifications.items():
+        if any(keyword in product_lower for keyword in keywords):
+            specs['certification'] = cert_name
+            print(f"  🏅 検出した認証: {specs['certification']}")
+            break
+
+    # 80 PLUSのみの記載があるか
+    if 'certification' not in specs and '80 plus' in product_lower:
+        specs['certification'] = '80 PLUS'
+        print(f"  🏅 検出した認証: {specs['certification']}")
+
+    return specs
+
+
+def extract_motherboard_specs(product_name):
+    """マザーボードの商品名からスペックを抽出"""
+    specs = {}
+    product_lower = product_name.lower()
+
+    # ソケット情報
+    socket_patterns = {
+        'LGA1700': ['lga1700', 'lga 1700'],
+        'LGA1200': ['lga1200', 'lga 1200'],
+        'AM5': ['am5', 'socket am5'],
+        'AM4': ['am4', 'socket am4'],
+    }
+    for socket_name, patterns in socket_patterns.items():
+        if any(p in product_lower for p in patterns):
+            specs['socket'] = socket_name
+            print(f"  🔌 検出したソケット: {specs['socket']}")
+            break
+
+    # チップセット
+    chipsets = ['Z790', 'Z690', 'B760', 'B660', 'H770', 'H670', 'X670E', 'X670', 'B650E', 'B650', 'A620', 'X570', 'B550', 'A520']
+    for chipset in chipsets:
+        if chipset.lower() in product_lower:
+            specs['chipset'] = chipset
+            print(f"  🔧 検出したチップセット: {specs['chipset']}")
+            break
+
+    # フォームファクター
+    form_factors = {
+        'E-ATX': ['e-atx', 'eatx', 'extended atx'],
+        'ATX': ['atx'],
+        'Micro-ATX': ['micro-atx', 'matx', 'micro atx'],
+        'Mini-ITX': ['mini-itx', 'mini itx', 'mitx'],
+    }
+    for ff_name, patterns in form_factors.items():
+        if any(p in product_lower for p in patterns):
+            specs['formFactor'] = ff_name
+            print(f"  📐 検出したフォームファクター: {specs['formFactor']}")
+            break
+
+    return specs
+
+
+def extract_memory_specs(product_name):
+    """メモリの商品名からスペックを抽出"""
+    specs = {}
+    product_lower = product_name.lower()
+    import re
+
+    # メモリタイプ
+    if 'ddr5' in product_lower:
+        specs['type'] = 'DDR5'
+    elif 'ddr4' in product_lower:
+        specs['type'] = 'DDR4'
+    if specs.get('type'):
+        print(f"  💾 検出したメモリタイプ: {specs['type']}")
+
+    # メモリ速度
+    speed_patterns = [
+        r'(\d{4,5})\s*mhz',
+        r'ddr[45]-(\d{4,5})',
+    ]
+    for pattern in speed_patterns:
+        match = re.search(pattern, product_lower)
+        if match:
+            specs['speed'] = match.group(1) + 'MHz'
+            print(f"  ⚡ 検出したメモリ速度: {specs['speed']}")
+            break
+
+    # 容量
+    capacity_patterns = [
+        r'(\d+)\s*gb',
+        r'(\d+)gb',
+    ]
+    for pattern in capacity_patterns:
+        matches = re.findall(pattern, product_lower)
+        if matches:
+            total = sum(int(m) for m in matches)
+            specs['capacity'] = f"{total}GB"
+            print(f"  📊 検出したメモリ容量: {specs['capacity']}")
+            break
+
+    return specs
+
+
+def extract_gpu_specs(product_name):
+    """GPUの商品名からスペックを抽出"""
+    specs = {}
+    product_lower = product_name.lower()
+    import re
+
+    # 消費電力（TDP/TGP）
+    power_patterns = [
+        r'(\d{2,3})\s*w(?:att)?(?:\s|$)',
+        r'tdp\s*(\d{2,3})',
+        r'tgp\s*(\d{2,3})',
+    ]
+    for pattern in power_patterns:
+        match = re.search(pattern, product_lower)
+        if match:
+            specs['power'] = match.group(1) + 'W'
+            print(f"  ⚡ 検出した消費電力: {specs['power']}")
+            break
+
+    return specs
+
+
+def extract_storage_specs(product_name):
+    """ストレージの商品名からスペックを抽出"""
+    specs = {}
+    product_lower = product_name.lower()
+    import re
+
+    # ストレージタイプ
+    if 'nvme' in product_lower or 'm.2' in product_lower:
+        specs['type'] = 'NVMe SSD'
+    elif 'ssd' in product_lower and 'sata' in product_lower:
+        specs['type'] = 'SATA SSD'
+    elif 'ssd' in product_lower:
+        specs['type'] = 'SSD'
+    elif 'hdd' in product_lower:
+        specs['type'] = 'HDD'
+    if specs.get('type'):
+        print(f"  💿 検出したストレージタイプ: {specs['type']}")
+
+    # 容量
+    capacity_patterns = [
+        r'(\d+)\s*tb',
+        r'(\d+)tb',
+        r'(\d+)\s*gb',
+        r'(\d+)gb',
+    ]
+    for pattern in capacity_patterns:
+        match = re.search(pattern, product_lower)
+        if match:
+            capacity = match.group(1)
+            if 'tb' in match.group(0):
+                specs['capacity'] = capacity + 'TB'
+            else:
+                specs['capacity'] = capacity + 'GB'
+            print(f"  📊 検出した容量: {specs['capacity']}")
+            break
+
+    return specs
+
+
+def extract_case_specs(product_name):
+    """PCケースの商品名からスペックを抽出"""
+    specs = {}
+    product_lower = product_name.lower()
+
+    # フォームファクター
+    form_factors = {
+        'E-ATX': ['e-atx', 'eatx'],
+        'ATX': ['atx'],
+        'Micro-ATX': ['micro-atx', 'matx'],
+        'Mini-ITX': ['mini-itx', 'mitx'],
+    }
+    for ff_name, patterns in form_factors.items():
+        if any(p in product_lower for p in patterns):
+            specs['formFactor'] = ff_name
+            print(f"  📐 検出したフォームファクター: {specs['formFactor']}")
+            break
+
+    return specs
+
+
+def extract_cooler_specs(product_name):
+    """CPUクーラーの商品名からスペックを抽出"""
+    specs = {}
+    product_lower = product_name.lower()
+
+    # クーラータイプ
+    if '簡易水冷' in product_lower or 'aio' in product_lower or '水冷' in product_lower:
+        specs['type'] = '簡易水冷'
+    elif '空冷' in product_lower or 'air' in product_lower:
+        specs['type'] = '空冷'
+    if specs.get('type'):
+        print(f"  ❄️ 検出したクーラータイプ: {specs['type']}")
+
+    return specs
+
+
+def extract_os_specs(product_name):
+    """OSの商品名からスペックを抽出"""
+    specs = {}
+    product_lower = product_name.lower()
+
+    # エディション
+    if 'pro' in product_lower:
+        specs['edition'] = 'Pro'
+    elif 'home' in product_lower:
+        specs['edition'] = 'Home'
+    if specs.get('edition'):
+        print(f"  🏷️ 検出したエディション: {specs['edition']}")
+
+    # ライセンスタイプ
+    if 'dsp' in product_lower:
+        specs['license'] = 'DSP版'
+    elif 'パッケージ' in product_lower or 'package' in product_lower:
+        specs['license'] = 'パッケージ版'
+    elif 'oem' in product_lower:
+        specs['license'] = 'OEM版'
+    if specs.get('license'):
+        print(f"  📜 検出したライセンス: {specs['license']}")
+
+    return specs
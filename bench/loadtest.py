@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+"""負荷試験: 記録済みページを返すスタブサーバーと、APIに負荷をかける負荷生成
+
+使い方:
+    # 1. 取得先の代わりになるスタブサーバー（遅延・エラー率を指定）
+    python bench/loadtest.py stub --port 8900 --latency 0.3 --jitter 0.1 --error-rate 0.02
+
+    # 2. アプリを取得先=スタブで起動（開発サーバーまたは gunicorn）
+    KAKAKU_BASE_URL=http://127.0.0.1:8900 RAKUTEN_BASE_URL=http://127.0.0.1:8900 \\
+    AMAZON_BASE_URL=http://127.0.0.1:8900 GOOGLE_BASE_URL=http://127.0.0.1:8900 \\
+    PRICE_CACHE_DB= PREWARM_ENABLED=0 gunicorn -w 4 -b 127.0.0.1:5000 scraper:app
+
+    # 3. 負荷をかける（同時実行数を固定 / 秒間リクエスト数を固定）
+    python bench/loadtest.py run --target http://127.0.0.1:5000 --concurrency 50 --duration 30
+    python bench/loadtest.py run --target http://127.0.0.1:5000 --rps 100 --duration 30
+
+負荷生成はエンドポイントごとに スループット・p50/p95/p99・エラー率 を表示する。
+--rps では予定時刻から応答までを計測するため、サーバーが詰まったときの待ち時間も遅延に含まれる。
+"""
+import argparse
+import asyncio
+import bisect
+import hashlib
+import itertools
+import json
+import math
+import os
+import random
+import sys
+import time
+
+import aiohttp
+from aiohttp import web
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_DIR = os.path.join(BENCH_DIR, 'fixtures')
+
+
+# ==========================
+# 🧪 スタブサーバー
+# ==========================
+# パスの先頭 → (記録済みページ, Content-Type)。価格.comの検索結果は2種類を交互に返す
+# 先頭から順に調べるため、長い接頭辞を先に置く（/search は /s より前）
+STUB_ROUTES = [
+    ('/search_results/', None),
+    ('/search/mall/', ('rakuten_search_memory.html', 'text/html; charset=UTF-8')),
+    ('/search', ('google_shopping_gpu.html', 'text/html; charset=UTF-8')),
+    ('/s', ('amazon_search_ssd.html', 'text/html;charset=UTF-8')),
+]
+KAKAKU_SEARCH_PAGES = ['kakaku_search_cpu.html', 'kakaku_search_gpu.html']
+KAKAKU_SUGGEST_PAGE = 'kakaku_suggest_memory.html'
+KAKAKU_CONTENT_TYPE = 'text/html; charset=Shift_JIS'
+
+
+def _load_fixture(filename):
+    with open(os.path.join(FIXTURE_DIR, filename), 'rb') as f:
+        return f.read()
+
+
+class StubUpstream:
+    """記録済みページを遅延・エラー付きで返す取得先の代わり"""
+
+    def __init__(self, latency=0.2, jitter=0.05, error_rate=0.0, hang_rate=0.0, hang_seconds=30.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self.pages = {name: _load_fixture(name)
+                      for name in KAKAKU_SEARCH_PAGES + [KAKAKU_SUGGEST_PAGE] +
+                      [route[0] for _, route in STUB_ROUTES if route]}
+        # 条件付きリクエスト（If-None-Match）に 304 を返すための ETag
+        self.etags = {name: '"' + hashlib.sha1(body).hexdigest()[:16] + '"' for name, body in self.pages.items()}
+        self.counts = {'requests': 0, 'errors': 0, 'hangs': 0, 'not_modified': 0}
+        self._kakaku_pages = itertools.cycle(KAKAKU_SEARCH_PAGES)
+
+    def _page_for(self, request):
+        path = request.path
+        for prefix, route in STUB_ROUTES:
+            if not path.startswith(prefix):
+                continue
+            if route is not None:
+                return route
+            # 価格.com: カテゴリ絞り込み（サジェスト）と通常の検索結果
+            if 'category' in request.query:
+                return KAKAKU_SUGGEST_PAGE, KAKAKU_CONTENT_TYPE
+            return next(self._kakaku_pages), KAKAKU_CONTENT_TYPE
+        return None
+
+    async def handle(self, request):
+        self.counts['requests'] += 1
+        route = self._page_for(request)
+        if route is None:
+            return web.Response(status=404, text='not found')
+
+        roll = random.random()
+        if roll < self.hang_rate:
+            # 応答しない取得先（アプリ側のタイムアウトを確認する）
+            self.counts['hangs'] += 1
+            await asyncio.sleep(self.hang_seconds)
+        delay = max(0.0, random.gauss(self.latency, self.jitter)) if self.jitter else self.latency
+        await asyncio.sleep(delay)
+        if roll >= 1 - self.error_rate:
+            self.counts['errors'] += 1
+            return web.Response(status=503, text='service unavailable')
+
+        filename, content_type = route
+        etag = self.etags[filename]
+        if request.headers.get('If-None-Match') == etag:
+            self.counts['not_modified'] += 1
+            return web.Response(status=304, headers={'ETag': etag})
+        return web.Response(body=self.pages[filename], headers={'Content-Type': content_type, 'ETag': etag})
+
+    def app(self):
+        stub_app = web.Application()
+        stub_app.router.add_route('GET', '/{tail:.*}', self.handle)
+        return stub_app
+
+
+def run_stub(args):
+    stub = StubUpstream(args.latency, args.jitter, args.error_rate, args.hang_rate, args.hang_seconds)
+    base_url = f'http://{args.host}:{args.port}'
+    print(f"🧪 スタブサーバー: {base_url}  (遅延 {args.latency}s±{args.jitter}s, "
+          f"エラー率 {args.error_rate:.0%}, 無応答 {args.hang_rate:.0%})")
+    print(f"   アプリは KAKAKU_BASE_URL / RAKUTEN_BASE_URL / AMAZON_BASE_URL / GOOGLE_BASE_URL={base_url} で起動")
+    try:
+        web.run_app(stub.app(), host=args.host, port=args.port, print=None, access_log=None)
+    finally:
+        print(f"\n📊 受信 {stub.counts['requests']}件 / エラー応答 {stub.counts['errors']}件 / "
+              f"無応答 {stub.counts['hangs']}件 / 変更なし(304) {stub.counts['not_modified']}件")
+    return 0
+
+
+# ==========================
+# 🚚 負荷生成
+# ==========================
+def load_queries():
+    """spec_golden.json の商品名を検索語として使う: [(カテゴリ, 商品名), ...]"""
+    with open(os.path.join(FIXTURE_DIR, 'spec_golden.json'), encoding='utf-8') as f:
+        return [(case['category'], case['title']) for case in json.load(f) if case['title'].strip()]
+
+
+class Scenario:
+    """エンドポイントの比率に従ってリクエストを作る"""
+
+    def __init__(self, mix, unique, queries):
+        self.endpoints = list(mix)
+        self.cumulative = list(itertools.accumulate(mix.values()))
+        self.unique = unique
+        self.queries = queries
+        self.serial = itertools.count()
+
+    def next_request(self):
+        """(エンドポイント名, メソッド, パス, JSON本文) を返す"""
+        endpoint = self.endpoints[bisect.bisect_right(self.cumulative, random.random() * self.cumulative[-1])]
+        category, title = random.choice(self.queries)
+        if endpoint == 'search':
+            if random.random() < self.unique:
+                # キャッシュに乗らない検索（取得先まで届く）
+                title = f'{title} lt{next(self.serial)}'
+            return endpoint, 'POST', '/api/search', {'productName': title, 'category': category}
+        if endpoint == 'suggest':
+            words = title.split()
+            query = ' '.join(words[:random.randint(1, min(3, len(words)))])
+            return endpoint, 'POST', '/api/suggestions', {'category': category, 'query': query}
+        return endpoint, 'GET', '/', None
+
+
+class Recorder:
+    """エンドポイントごとの遅延と結果を集計する"""
+
+    def __init__(self):
+        self.latencies = {}
+        self.statuses = {}
+        self.errors = {}
+        self.started = None
+        self.finished = None
+
+    def record(self, endpoint, seconds, status):
+        if self.started is None:
+            return
+        self.latencies.setdefault(endpoint, []).append(seconds)
+        self.statuses.setdefault(endpoint, {})
+        self.statuses[endpoint][status] = self.statuses[endpoint].get(status, 0) + 1
+        # 例外・タイムアウトと 5xx をエラーとして数える（404 は「価格が見つからない」応答）
+        if not isinstance(status, int) or status >= 500:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def summary(self):
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        rows = {}
+        everything = []
+        for endpoint in sorted(self.latencies):
+            latencies = sorted(self.latencies[endpoint])
+            everything.extend(latencies)
+            rows[endpoint] = self._row(latencies, self.errors.get(endpoint, 0), elapsed)
+            rows[endpoint]['statuses'] = {str(k): v for k, v in sorted(self.statuses[endpoint].items(), key=str)}
+        everything.sort()
+        rows['total'] = self._row(everything, sum(self.errors.values()), elapsed)
+        return {'elapsed': elapsed, 'endpoints': rows}
+
+    @staticmethod
+    def _row(latencies, errors, elapsed):
+        count = len(latencies)
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return latencies[max(0, math.ceil(p * count) - 1)] * 1000
+
+        return {
+            'requests': count,
+            'rps': count / elapsed if elapsed else 0.0,
+            'error_rate': errors / count if count else 0.0,
+            'p50_ms': percentile(0.50),
+            'p95_ms': percentile(0.95),
+            'p99_ms': percentile(0.99),
+            'max_ms': latencies[-1] * 1000 if latencies else None,
+        }
+
+
+async def send(session, target, scenario, recorder, scheduled=None):
+    endpoint, method, path, body = scenario.next_request()
+    start = scheduled if scheduled is not None else time.perf_counter()
+    try:
+        async with session.request(method, target + path, json=body) as res:
+            await res.read()
+            status = res.status
+    except asyncio.TimeoutError:
+        status = 'timeout'
+    except aiohttp.ClientError as e:
+        status = type(e).__name__
+    recorder.record(endpoint, time.perf_counter() - start, status)
+
+
+async def closed_loop(session, args, scenario, recorder, deadline):
+    """同時実行数を固定: 各ワーカーは応答を受け取ったらすぐ次を送る"""
+    async def worker():
+        while time.perf_counter() < deadline:
+            await send(session, args.target, scenario, recorder)
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+
+
+async def open_loop(session, args, scenario, recorder, deadline):
+    """秒間リクエスト数を固定: 応答を待たずに予定時刻どおり送る（同時実行数は --concurrency まで）"""
+    interval = 1.0 / args.rps
+    limit = asyncio.Semaphore(args.concurrency)
+    tasks = set()
+
+    async def fire(scheduled):
+        async with limit:
+            await send(session, args.target, scenario, recorder, scheduled)
+
+    scheduled = time.perf_counter()
+    while scheduled < deadline:
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        task = asyncio.create_task(fire(scheduled))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        scheduled += random.expovariate(1.0 / interval) if args.poisson else interval
+    if tasks:
+        await asyncio.wait(tasks)
+
+
+async def generate_load(args):
+    scenario = Scenario(args.mix, args.unique, load_queries())
+    recorder = Recorder()
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        now = time.perf_counter()
+        deadline = now + args.warmup + args.duration
+        loop = asyncio.get_running_loop()
+
+        def begin():
+            recorder.started = time.perf_counter()
+        # 助走期間の結果は集計しない
+        loop.call_later(args.warmup, begin)
+        if args.rps:
+            await open_loop(session, args, scenario, recorder, deadline)
+        else:
+            await closed_loop(session, args, scenario, recorder, deadline)
+        recorder.finished = time.perf_counter()
+    return recorder
+
+
+def parse_mix(text):
+    """'search=6,suggest=3,index=1' → {'search': 6.0, ...}"""
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in ('search', 'suggest', 'index'):
+            raise argparse.ArgumentTypeError(f'不明なエンドポイント: {name}')
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def print_report(summary, args):
+    mode = f'{args.rps} rps' if args.rps else f'同時 {args.concurrency}'
+    print(f"\n🚚 {args.target}  ({mode}, {summary['elapsed']:.1f}秒)")
+    print(f"{'エンドポイント':<12}{'件数':>8}{'req/s':>9}{'エラー':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'最大':>10}")
+
+    def ms(value):
+        return f'{value:.0f}ms' if value is not None else '-'
+
+    for endpoint, row in summary['endpoints'].items():
+        print(f"{endpoint:<12}{row['requests']:>8}{row['rps']:>9.1f}{row['error_rate']:>8.1%}"
+              f"{ms(row['p50_ms']):>10}{ms(row['p95_ms']):>10}{ms(row['p99_ms']):>10}{ms(row['max_ms']):>10}")
+    for endpoint, row in summary['endpoints'].items():
+        if 'statuses' in row:
+            statuses = ', '.join(f'{status}: {count}' for status, count in row['statuses'].items())
+            print(f"  {endpoint}: {statuses}")
+
+
+def run_load(args):
+    recorder = asyncio.run(generate_load(args))
+    if recorder.started is None:
+        print("❌ 計測期間に入る前に終了しました（--duration を確認してください）")
+        return 1
+    summary = recorder.summary()
+    print_report(summary, args)
+    if args.json:
+        summary['config'] = {k: v for k, v in vars(args).items() if k not in ('func', 'json')}
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=1)
+            f.write('\n')
+        print(f"📝 結果を保存しました: {args.json}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    stub = commands.add_parser('stub', help='記録済みページを返すスタブサーバーを起動')
+    stub.add_argument('--host', default='127.0.0.1')
+    stub.add_argument('--port', type=int, default=8900)
+    stub.add_argument('--latency', type=float, default=0.2, help='応答までの平均秒数')
+    stub.add_argument('--jitter', type=float, default=0.05, help='遅延の標準偏差（秒）')
+    stub.add_argument('--error-rate', type=float, default=0.0, help='503を返す割合')
+    stub.add_argument('--hang-rate', type=float, default=0.0, help='--hang-seconds の間応答しない割合')
+    stub.add_argument('--hang-seconds', type=float, default=30.0)
+    stub.set_defaults(func=run_stub)
+
+    run = commands.add_parser('run', help='アプリに負荷をかけて結果を表示')
+    run.add_argument('--target', default='http://127.0.0.1:5000', help='アプリのURL')
+    run.add_argument('--concurrency', type=int, default=20, help='同時実行数（--rps 指定時は上限）')
+    run.add_argument('--rps', type=float, default=0, help='秒間リクエスト数（指定すると予定時刻どおりに送る）')
+    run.add_argument('--poisson', action='store_true', help='--rps の送信間隔を指数分布にする')
+    run.add_argument('--duration', type=float, default=30, help='計測する秒数')
+    run.add_argument('--warmup', type=float, default=5, help='集計しない助走の秒数')
+    run.add_argument('--mix', type=parse_mix, default='search=6,suggest=3,index=1', help='エンドポイントの比率')
+    run.add_argument('--unique', type=float, default=0.2, help='キャッシュに乗らない検索の割合')
+    run.add_argument('--timeout', type=float, default=30, help='1リクエストのタイムアウト（秒）')
+    run.add_argument('--json', help='結果をJSONで保存するパス（構成の比較用）')
+    run.set_defaults(func=run_load)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""解析・スペック抽出のベンチマーク一式（オフライン）と基準値との比較
+
+使い方:
+    python bench/run_bench.py                     # 計測して bench/baseline.json と比較
+    python bench/run_bench.py --update-baseline   # 今回の計測値を基準値として保存
+    python bench/run_bench.py --update-expected   # 解析結果の正解データを作り直す（意図して結果を変えた場合）
+
+bench/fixtures の記録済みページを使い、次を計測する。
+  - page_time    ページごとの解析時間（HTML → 結果）
+  - items_rate   価格.comの商品要素から価格・商品名を取り出す速度
+  - titles_rate  extract_*_specs の処理速度（spec_golden.json の商品名）
+どの計測も直前に同じ純Pythonの処理（calibration）を実行し、その時間を1とした値で表す
+（rate は calibration 1回分の時間に処理できる件数）。繰り返した計測の中央値を基準値と比べ、
+許容範囲（--threshold と、ばらつきの SPREAD_FACTOR 倍の大きい方）より遅くなった項目と、
+正解データと結果が異なるページ・商品名があれば終了コード1を返す。
+"""
+import argparse
+import gc
+import json
+import os
+import statistics
+import sys
+import time
+
+# 永続キャッシュを作らない
+os.environ.setdefault('PRICE_CACHE_DB', '')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bs4 import BeautifulSoup  # noqa: E402
+
+import scraper  # noqa: E402
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_DIR = os.path.join(BENCH_DIR, 'fixtures')
+BASELINE_PATH = os.path.join(BENCH_DIR, 'baseline.json')
+EXPECTED_PATH = os.path.join(FIXTURE_DIR, 'expected.json')
+
+# 記録済みページ: (ファイル名, 文字コード, 解析関数)
+PAGES = [
+    ('kakaku_search_cpu.html', 'cp932', lambda html: scraper.parse_kakaku_offers(html)),
+    ('kakaku_search_gpu.html', 'cp932', lambda html: scraper.parse_kakaku_offers(html)),
+    ('kakaku_suggest_memory.html', 'cp932', lambda html: scraper.parse_kakaku_suggestions(html, 'memory')),
+    ('rakuten_search_memory.html', 'utf-8', scraper.parse_rakuten_offer),
+    ('amazon_search_ssd.html', 'utf-8', scraper.parse_amazon_offer),
+    ('google_shopping_gpu.html', 'utf-8', scraper.parse_google_shopping_offer),
+]
+
+SPEC_FUNCTIONS = {
+    'cpu': scraper.extract_cpu_specs,
+    'motherboard': scraper.extract_motherboard_specs,
+    'memory': scraper.extract_memory_specs,
+    'gpu': scraper.extract_gpu_specs,
+    'storage': scraper.extract_storage_specs,
+    'psu': scraper.extract_psu_specs,
+    'case': scraper.extract_case_specs,
+    'cooler': scraper.extract_cooler_specs,
+    'os': scraper.extract_os_specs,
+}
+
+
+def load_page(filename, encoding):
+    with open(os.path.join(FIXTURE_DIR, filename), 'rb') as f:
+        return f.read().decode(encoding)
+
+
+# 1回の計測の最短時間（秒）。これに届くまで実行回数を増やす
+MIN_ROUND_SECONDS = 0.1
+
+
+def _round_time(func, number):
+    # timeit と同じく、計測中はGCを止めて回ごとの揺れを減らす
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        return time.perf_counter() - start
+    finally:
+        gc.enable()
+
+
+def _loop_count(func):
+    """1回の計測が MIN_ROUND_SECONDS 以上かかる実行回数"""
+    number = 1
+    while _round_time(func, number) < MIN_ROUND_SECONDS:
+        number *= 2
+    return number
+
+
+def calibration_workload():
+    """マシンの速さの目安（文字列処理と辞書操作を混ぜた純Pythonの処理）"""
+    table = {}
+    for i in range(20000):
+        key = f'item-{i % 997}'
+        table[key] = table.get(key, 0) + len(key.upper())
+    return table
+
+
+class Calibrator:
+    """計測の直前に calibration_workload を実行し、その時間を単位にして計測値を表す
+
+    同じタイミングの実行時間で割るため、マシンの速さの違いや一時的な負荷の影響が小さくなる。
+    """
+
+    def __init__(self):
+        self.number = _loop_count(calibration_workload)
+        self.seconds = []
+
+    def ratios(self, func, rounds):
+        """func 1回の時間が calibration_workload 何回分かを rounds 回計測して返す"""
+        number = _loop_count(func)
+        ratios = []
+        for _ in range(rounds):
+            calibration = _round_time(calibration_workload, self.number) / self.number
+            self.seconds.append(calibration)
+            ratios.append(_round_time(func, number) / number / calibration)
+        return ratios
+
+    def calibration_ms(self):
+        return statistics.median(self.seconds) * 1000
+
+
+# 許容範囲をばらつき（四分位範囲 / 中央値）の何倍まで広げるか
+SPREAD_FACTOR = 2
+
+
+def summarize(samples):
+    """中央値と、ばらつき（四分位範囲 / 中央値。まれに大きく外れる回の影響を受けにくい）"""
+    median = statistics.median(samples)
+    q1, _, q3 = statistics.quantiles(samples, n=4)
+    return {'median': median, 'spread': (q3 - q1) / median}
+
+
+def measure_pages(calibrator, rounds):
+    metrics = {}
+    results = {}
+    for filename, encoding, parse in PAGES:
+        html = load_page(filename, encoding)
+        results[filename] = parse(html)
+        metrics[f'page_time/{filename}'] = summarize(calibrator.ratios(lambda: parse(html), rounds))
+    return metrics, results
+
+
+def measure_items(calibrator, rounds):
+    """価格.comの商品要素から価格・商品名を取り出す速度（木の構築は含めない）"""
+    metrics = {}
+    for filename, encoding, _ in PAGES:
+        if not filename.startswith('kakaku_search_'):
+            continue
+        soup = BeautifulSoup(load_page(filename, encoding), scraper.KAKAKU_PARSER,
+                             parse_only=scraper.RESULT_ITEM_STRAINER)
+        items = []
+        for selector in scraper.ITEM_SELECTORS:
+            items = soup.select(selector)
+            if items:
+                break
+
+        def extract():
+            for item in items:
+                price_elem, name_elem, _ = scraper._extract_item_fields(item)
+                if price_elem is not None:
+                    scraper.parse_price(price_elem.get_text(strip=True))
+                if name_elem is not None:
+                    name_elem.get_text(strip=True)
+
+        ratios = calibrator.ratios(extract, rounds)
+        metrics[f'items_rate/{filename}'] = summarize([len(items) / ratio for ratio in ratios])
+        soup.decompose()
+    return metrics
+
+
+def measure_specs(calibrator, golden, rounds):
+    metrics = {}
+    mismatches = []
+    titles_by_category = {}
+    for case in golden:
+        titles_by_category.setdefault(case['category'], []).append(case['title'])
+        actual = scraper.extract_specs(case['category'], case['title'])
+        if actual != case['specs']:
+            mismatches.append(f"[{case['category']}] {case['title']!r}: {actual} != {case['specs']}")
+
+    for category, titles in titles_by_category.items():
+        extract = SPEC_FUNCTIONS[category]
+        ratios = calibrator.ratios(lambda: [extract(title) for title in titles], rounds)
+        metrics[f'titles_rate/{category}'] = summarize([len(titles) / ratio for ratio in ratios])
+    return metrics, mismatches
+
+
+def higher_is_better(name):
+    return name.split('/')[0].endswith('_rate')
+
+
+def compare(current, baseline, threshold):
+    """(表の行, 遅くなった項目数) を返す
+
+    中央値どうしを比べる。許容範囲は threshold と、基準値・今回のばらつきの大きい方の SPREAD_FACTOR 倍のうち大きい値。
+    """
+    rows = []
+    regressions = 0
+    for name in sorted(current['metrics']):
+        value = current['metrics'][name]
+        base = baseline['metrics'].get(name)
+        if not isinstance(base, dict):
+            rows.append((name, None, value['median'], None, None, '新規'))
+            continue
+
+        # 何割遅くなったか（2倍の時間がかかれば +100%。速くなればマイナス）
+        if higher_is_better(name):
+            slowdown = base['median'] / value['median'] - 1
+        else:
+            slowdown = value['median'] / base['median'] - 1
+        tolerance = max(threshold, SPREAD_FACTOR * max(base['spread'], value['spread']))
+        flag = ''
+        if slowdown > tolerance:
+            flag = '⚠️ 低下'
+            regressions += 1
+        rows.append((name, base['median'], value['median'], slowdown, tolerance, flag))
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=7, help='各計測の繰り返し回数（中央値を採用）')
+    parser.add_argument('--threshold', type=float, default=0.3,
+                        help='基準値からの低下をどこまで許すか（0.3 = 30%%）。ばらつきの方が大きい項目はばらつきまで許す')
+    parser.add_argument('--update-baseline', action='store_true', help='今回の計測値を基準値として保存')
+    parser.add_argument('--update-expected', action='store_true', help='解析結果の正解データを作り直す')
+    args = parser.parse_args()
+    if args.repeat < 3:
+        parser.error('--repeat は3以上を指定してください（中央値とばらつきを求めるため）')
+
+    with open(os.path.join(FIXTURE_DIR, 'spec_golden.json'), encoding='utf-8') as f:
+        golden = json.load(f)
+
+    calibrator = Calibrator()
+    current = {'repeat': args.repeat, 'metrics': {}}
+    page_metrics, page_results = measure_pages(calibrator, args.repeat)
+    spec_metrics, failures = measure_specs(calibrator, golden, args.repeat)
+    current['metrics'].update(page_metrics)
+    current['metrics'].update(measure_items(calibrator, args.repeat))
+    current['metrics'].update(spec_metrics)
+    current['calibration_ms'] = calibrator.calibration_ms()
+
+    # 解析結果を正解データと照合（JSONを通して比較する）
+    page_results = json.loads(json.dumps(page_results, ensure_ascii=False))
+    if args.update_expected or not os.path.exists(EXPECTED_PATH):
+        with open(EXPECTED_PATH, 'w', encoding='utf-8') as f:
+            json.dump(page_results, f, ensure_ascii=False, indent=1, sort_keys=True)
+            f.write('\n')
+        print(f"📝 正解データを保存しました: {EXPECTED_PATH}")
+    else:
+        with open(EXPECTED_PATH, encoding='utf-8') as f:
+            expected = json.load(f)
+        for filename, result in page_results.items():
+            if expected.get(filename) != result:
+                failures.append(f"{filename}: 解析結果が正解データと一致しません")
+
+    print(f"calibration: {current['calibration_ms']:.2f}ms")
+    regressions = 0
+    if args.update_baseline or not os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH, 'w', encoding='utf-8') as f:
+            json.dump(current, f, ensure_ascii=False, indent=1, sort_keys=True)
+            f.write('\n')
+        print(f"📝 基準値を保存しました: {BASELINE_PATH}")
+        for name, value in sorted(current['metrics'].items()):
+            print(f"  {name:<42}{value['median']:>14,.3f}{value['spread']:>9.0%}")
+    else:
+        with open(BASELINE_PATH, encoding='utf-8') as f:
+            baseline = json.load(f)
+        rows, regressions = compare(current, baseline, args.threshold)
+        print(f"\n{'項目':<42}{'基準値':>14}{'今回':>14}{'低下':>9}{'許容':>7}")
+        for name, base, value, slowdown, tolerance, flag in rows:
+            base_text = f'{base:,.3f}' if base is not None else '-'
+            change_text = f'{slowdown:+.0%}' if slowdown is not None else '-'
+            tolerance_text = f'{tolerance:.0%}' if tolerance is not None else '-'
+            print(f"{name:<42}{base_text:>14}{value:>14,.3f}{change_text:>9}{tolerance_text:>7}  {flag}")
+
+    for failure in failures:
+        print(f"❌ {failure}")
+    if regressions:
+        print(f"⚠️ {regressions}項目が基準値より許容範囲を超えて遅くなっています")
+    return 1 if failures or regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
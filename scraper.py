@@ -6,874 +6,4788 @@ import io
 # sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
 # sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, g, Response
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import os
+import logging
+import asyncio
+import atexit
+import contextvars
+import aiohttp
 import requests
-from bs4 import BeautifulSoup
+from requests.structures import CaseInsensitiveDict
+from bs4 import BeautifulSoup, SoupStrainer, Tag
 import re
 import json
-from urllib.parse import quote
+import math
+import random
+import bisect
+import codecs
+import hashlib
+import heapq
+import unicodedata
+import sqlite3
+import zlib
+import functools
+import threading
+import time
+from collections import OrderedDict, deque
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from urllib.parse import quote, urlsplit
 
 app = Flask(__name__)
 CORS(app)
 
+# ==========================
+# 📝 ログ出力
+# ==========================
+# 本番では WARNING 以上のみ出力する（詳細ログは LOG_LEVEL=DEBUG で有効化）
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'WARNING').upper()
+
+logger = logging.getLogger('scraper')
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter('%(message)s'))
+logger.addHandler(_log_handler)
+logger.setLevel(LOG_LEVEL)
+logger.propagate = False
+
+# ==========================
+# ⏱️ 処理段階ごとの計測（Prometheus形式で /metrics に出力）
+# ==========================
+# ヒストグラムのバケット上限（秒）
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRIC_HELP = {
+    'pcparts_stage_seconds': ('histogram', '処理段階ごとの所要時間'),
+    'pcparts_upstream_seconds': ('histogram', '取得先ごとの取得・解析の所要時間'),
+    'pcparts_upstream_requests_total': ('counter', '取得先ごとの取得回数'),
+    'pcparts_upstream_queue_seconds': ('histogram', 'ホスト・優先度ごとの送信待ち時間'),
+    'pcparts_upstream_shed_total': ('counter', 'ホスト・優先度ごとの取りやめた取得の数'),
+    'pcparts_upstream_hedges_total': ('counter', '取得先ごとの追加リクエスト（ヘッジ）の数'),
+    'pcparts_upstream_hedge_wins_total': ('counter', '追加リクエストの方が先に返った数'),
+    'pcparts_circuit_rejections_total': ('counter', '遮断中のため送らなかった取得の数'),
+    'pcparts_layout_switches_total': ('counter', '価格.comのページのレイアウトが変わった回数'),
+    'pcparts_request_seconds': ('histogram', 'エンドポイントごとの応答時間'),
+    'pcparts_requests_total': ('counter', 'エンドポイントごとのリクエスト数'),
+}
+
+
+class Metrics:
+    """ラベル付きのヒストグラムとカウンターを保持し、Prometheusのテキスト形式で出力する"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def observe(self, name, seconds, **labels):
+        index = bisect.bisect_left(self.buckets, seconds)
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # [バケットごとの件数..., +Inf の件数, 合計秒数]
+                histogram = self._histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            histogram[index] += 1
+            histogram[-1] += seconds
+
+    def inc(self, name, amount=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    @staticmethod
+    def _format_labels(labels):
+        if not labels:
+            return ''
+        pairs = ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels)
+        return '{' + pairs + '}'
+
+    def render(self, gauges=()):
+        """(名前, ラベル, 値) の追加ゲージとあわせてテキスト形式に変換"""
+        with self._lock:
+            histograms = {key: list(value) for key, value in self._histograms.items()}
+            counters = dict(self._counters)
+
+        lines = []
+        described = set()
+
+        def describe(name, default_type):
+            if name in described:
+                return
+            described.add(name)
+            metric_type, help_text = METRIC_HELP.get(name, (default_type, name))
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric_type}')
+
+        for (name, labels), histogram in sorted(histograms.items()):
+            describe(name, 'histogram')
+            cumulative = 0
+            for upper, count in zip(self.buckets + ('+Inf',), histogram[:-1]):
+                cumulative += count
+                bucket_labels = labels + (('le', upper if upper == '+Inf' else repr(upper)),)
+                lines.append(f'{name}_bucket{self._format_labels(bucket_labels)} {cumulative}')
+            lines.append(f'{name}_sum{self._format_labels(labels)} {histogram[-1]:.6f}')
+            lines.append(f'{name}_count{self._format_labels(labels)} {cumulative}')
+
+        for (name, labels), value in sorted(counters.items()):
+            describe(name, 'counter')
+            lines.append(f'{name}{self._format_labels(labels)} {value}')
+
+        for name, labels, value in gauges:
+            describe(name, 'gauge')
+            lines.append(f'{name}{self._format_labels(tuple(sorted(labels.items())))} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics(LATENCY_BUCKETS)
+
+# 現在のスレッド・タスクが処理している取得先（段階ごとの計測のラベルに使う）
+_metric_source = contextvars.ContextVar('metric_source', default=None)
+
+
+def current_source():
+    return _metric_source.get() or 'none'
+
+
+@contextmanager
+def timed(stage, source=None):
+    """with ブロックの所要時間を pcparts_stage_seconds{stage, source} に記録"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.observe('pcparts_stage_seconds', time.perf_counter() - start,
+                        stage=stage, source=source or current_source())
+
+
+class _TimedJSONProvider(DefaultJSONProvider):
+    """レスポンスのJSON変換時間を serialize 段階として記録"""
+
+    def dumps(self, obj, **kwargs):
+        with timed('serialize'):
+            return super().dumps(obj, **kwargs)
+
+
+app.json = _TimedJSONProvider(app)
+
+# ==========================
+# 🌐 非同期の取得基盤（asyncio + aiohttp）
+# ==========================
+HTTP_CONNECT_RETRIES = int(os.environ.get('HTTP_CONNECT_RETRIES', 2))
+HTTP_RETRY_BACKOFF = float(os.environ.get('HTTP_RETRY_BACKOFF', 0.3))
+# 全ホスト合計の同時接続数と、ホストごとの同時リクエスト数
+HTTP_MAX_CONNECTIONS = int(os.environ.get('HTTP_MAX_CONNECTIONS', 512))
+HTTP_HOST_CONCURRENCY = int(os.environ.get('HTTP_HOST_CONCURRENCY', 64))
+# 取得したHTMLを解析するスレッド数（解析中もイベントループは止まらない）
+PARSE_WORKERS = int(os.environ.get('PARSE_WORKERS', 8))
+# ホストごとの送信レート（トークンバケット: 毎秒 HTTP_HOST_RATE 件、最大 HTTP_HOST_BURST 件まで連続。0 で無制限）
+HTTP_HOST_RATE = float(os.environ.get('HTTP_HOST_RATE', 10))
+HTTP_HOST_BURST = int(os.environ.get('HTTP_HOST_BURST', 20))
+# ホストごとの送信待ちの上限（超えると優先度の低いものから取りやめる）
+HTTP_QUEUE_MAX = int(os.environ.get('HTTP_QUEUE_MAX', 256))
+
+# すべての取得先に送る共通ヘッダー
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
+    "Accept-Language": "ja,en-US;q=0.7,en;q=0.3",
+    "Accept-Encoding": "gzip, deflate",
+    "Connection": "keep-alive",
+    "Upgrade-Insecure-Requests": "1"
+}
+
+# 取得先のベースURL（負荷試験ではローカルのスタブサーバーに向ける: bench/loadtest.py）
+KAKAKU_BASE_URL = os.environ.get('KAKAKU_BASE_URL', 'https://kakaku.com').rstrip('/')
+RAKUTEN_BASE_URL = os.environ.get('RAKUTEN_BASE_URL', 'https://search.rakuten.co.jp').rstrip('/')
+AMAZON_BASE_URL = os.environ.get('AMAZON_BASE_URL', 'https://www.amazon.co.jp').rstrip('/')
+GOOGLE_BASE_URL = os.environ.get('GOOGLE_BASE_URL', 'https://www.google.com').rstrip('/')
+
+
+def _bind_context(coro):
+    """呼び出し元の contextvars（計測ラベルなど）を引き継いで coro を実行するコルーチン"""
+    context = contextvars.copy_context()
+
+    async def bound():
+        for var, value in context.items():
+            var.set(value)
+        return await coro
+    return bound()
+
+
+def _build_response(url, status_code, headers, body):
+    """解析側のコードがそのまま使えるよう requests.Response に詰める"""
+    res = requests.Response()
+    res.url = url
+    res.status_code = status_code
+    res.headers = CaseInsensitiveDict(headers)
+    res._content = body
+    return res
+
+
+# 送信の優先度（先頭ほど優先）: 画面からの検索 > サジェスト > 裏での再取得・事前取得
+UPSTREAM_PRIORITIES = ('interactive', 'suggest', 'background')
+
+# 現在のスレッド・タスクが送るリクエストの優先度（未設定なら取得先ごとの既定値）
+_upstream_priority = contextvars.ContextVar('upstream_priority', default=None)
+
+
+@contextmanager
+def upstream_priority(priority):
+    """with ブロック内で送る取得リクエストの優先度を指定"""
+    token = _upstream_priority.set(priority)
+    try:
+        yield
+    finally:
+        _upstream_priority.reset(token)
+
+
+class UpstreamUnavailable(Exception):
+    """取得先から一時的に結果を得られなかった（空の結果としてキャッシュしない）"""
+
+
+class UpstreamBusy(UpstreamUnavailable):
+    """取得先に送らずに取りやめた（送信待ちがあふれた・待ち時間が長すぎた）"""
+
+
+class HostScheduler:
+    """1ホスト分の送信スケジューラー（取得用イベントループ内で使う）
+
+    トークンバケットで送信レートを、in_flight で同時リクエスト数を抑え、
+    送れないリクエストは優先度ごとの待ち行列に入れて優先度の高いものから送る。
+    待ち行列が queue_max に達したら、より低い優先度の最も新しい待ちを取りやめて空ける。
+    """
+
+    def __init__(self, host, rate, burst, concurrency, queue_max):
+        self.host = host
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self.queue_max = queue_max
+        self.loop = asyncio.get_running_loop()
+        self.tokens = float(burst)
+        self.updated = self.loop.time()
+        self.in_flight = 0
+        self._queues = {priority: deque() for priority in UPSTREAM_PRIORITIES}
+        self._timer = None
+        self._counters = {
+            key: dict.fromkeys(UPSTREAM_PRIORITIES, 0)
+            for key in ('sent', 'shed', 'timeouts', 'wait_count')
+        }
+        self._wait_seconds = dict.fromkeys(UPSTREAM_PRIORITIES, 0.0)
+        self._wait_max = dict.fromkeys(UPSTREAM_PRIORITIES, 0.0)
+
+    def queued(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _take_token(self):
+        if self.rate <= 0:
+            return True
+        now = self.loop.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    async def acquire(self, priority, timeout):
+        """送信してよくなるまで待つ（終わったら release() を呼ぶ）。取りやめた場合は UpstreamBusy"""
+        if not self.queued() and self.in_flight < self.concurrency and self._take_token():
+            self._grant(priority, 0.0)
+            return
+
+        if self.queued() >= self.queue_max and not self._shed_below(priority):
+            self._shed(priority, 'queue_full')
+            raise UpstreamBusy(f'{self.host}: 送信待ちが上限（{self.queue_max}件）に達しています')
+
+        future = self.loop.create_future()
+        entry = (future, self.loop.time())
+        self._queues[priority].append(entry)
+        self._dispatch()
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self._discard(priority, entry)
+            self._shed(priority, 'timeout')
+            raise UpstreamBusy(f'{self.host}: 送信待ちが {timeout} 秒を超えました') from None
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                # 送信枠を受け取った直後に取り消された
+                self.release()
+            else:
+                self._discard(priority, entry)
+            raise
+
+    def release(self):
+        self.in_flight -= 1
+        self._dispatch()
+
+    def _grant(self, priority, waited):
+        self.in_flight += 1
+        self._counters['sent'][priority] += 1
+        self._counters['wait_count'][priority] += 1
+        self._wait_seconds[priority] += waited
+        self._wait_max[priority] = max(self._wait_max[priority], waited)
+        metrics.observe('pcparts_upstream_queue_seconds', waited, host=self.host, priority=priority)
+
+    def _discard(self, priority, entry):
+        try:
+            self._queues[priority].remove(entry)
+        except ValueError:
+            pass
+
+    def _shed(self, priority, reason):
+        key = 'shed' if reason == 'queue_full' else 'timeouts'
+        self._counters[key][priority] += 1
+        metrics.inc('pcparts_upstream_shed_total', host=self.host, priority=priority, reason=reason)
+
+    def _shed_below(self, priority):
+        """priority より低い優先度の最も新しい待ちを取りやめる。取りやめられたら True"""
+        for lower in reversed(UPSTREAM_PRIORITIES[UPSTREAM_PRIORITIES.index(priority) + 1:]):
+            queue = self._queues[lower]
+            while queue:
+                future, _ = queue.pop()
+                if future.done():
+                    continue
+                self._shed(lower, 'queue_full')
+                future.set_exception(UpstreamBusy(f'{self.host}: 優先度の高いリクエストのため取りやめました'))
+                return True
+        return False
+
+    def _next_entry(self):
+        for priority in UPSTREAM_PRIORITIES:
+            queue = self._queues[priority]
+            while queue:
+                if not queue[0][0].done():
+                    return priority, queue
+                # 待ち時間切れで取り消された待ち
+                queue.popleft()
+        return None, None
+
+    def _on_timer(self):
+        self._timer = None
+        self._dispatch()
+
+    def _dispatch(self):
+        while self.in_flight < self.concurrency:
+            priority, queue = self._next_entry()
+            if queue is None:
+                return
+            if not self._take_token():
+                if self._timer is None:
+                    self._timer = self.loop.call_later((1 - self.tokens) / self.rate, self._on_timer)
+                return
+            future, enqueued = queue.popleft()
+            self._grant(priority, self.loop.time() - enqueued)
+            future.set_result(None)
+
+    def stats(self):
+        stats = {
+            'in_flight': self.in_flight,
+            'queued': {priority: len(queue) for priority, queue in self._queues.items()},
+            'tokens': round(self.tokens, 2) if self.rate > 0 else None,
+        }
+        stats.update({key: dict(counts) for key, counts in self._counters.items() if key != 'wait_count'})
+        stats['wait_seconds_avg'] = {
+            priority: round(self._wait_seconds[priority] / count, 4) if count else 0.0
+            for priority, count in self._counters['wait_count'].items()
+        }
+        stats['wait_seconds_max'] = {priority: round(value, 4) for priority, value in self._wait_max.items()}
+        return stats
+
+
+class AsyncUpstream:
+    """専用スレッドのイベントループで取得先へのリクエストを非同期に処理する
+
+    ホストごとの HostScheduler で送信レート・同時リクエスト数・優先度を制御しつつ、
+    1プロセスで数百件の取得を同時に待てる。
+    同期コードからは run()、非同期ビューなど別のイベントループからは call() で呼び出す。
+    キャッシュなども読み書きするコルーチンの同期版は run_in_caller() で呼び出し元のスレッドで実行する。
+    """
+
+    def __init__(self, max_connections, host_concurrency, connect_retries, backoff_factor, parse_workers,
+                 host_rate=0, host_burst=1, queue_max=256):
+        self.max_connections = max_connections
+        self.host_concurrency = host_concurrency
+        self.host_rate = host_rate
+        self.host_burst = host_burst
+        self.queue_max = queue_max
+        self.connect_retries = connect_retries
+        self.backoff_factor = backoff_factor
+        self.parse_workers = parse_workers
+        self._loop = None
+        self._pid = None
+        self._session = None
+        self._schedulers = {}
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self):
+        pid = os.getpid()
+        with self._lock:
+            if self._pid != pid:
+                # fork 前に作ったループは子プロセスでは動いていないので作り直す
+                self._loop = asyncio.new_event_loop()
+                self._loop.set_default_executor(
+                    ThreadPoolExecutor(max_workers=self.parse_workers, thread_name_prefix='parse'))
+                self._session = None
+                self._schedulers = {}
+                self._pid = pid
+                threading.Thread(target=self._loop.run_forever, name='upstream-loop', daemon=True).start()
+            return self._loop
+
+    def run(self, coro, timeout=None):
+        """同期コードからコルーチンを実行して結果を返す"""
+        future = asyncio.run_coroutine_threadsafe(_bind_context(coro), self.loop)
+        try:
+            return future.result(timeout)
+        except BaseException:
+            future.cancel()
+            raise
+
+    def iterate(self, agen):
+        """非同期ジェネレーターを取得用イベントループで進め、値を順に返す（途中で閉じると agen も閉じる）"""
+        async def step():
+            return await agen.__anext__()
+
+        try:
+            while True:
+                try:
+                    yield self.run(step())
+                except StopAsyncIteration:
+                    return
+        finally:
+            self.run(agen.aclose())
+
+    async def call(self, coro):
+        """任意のイベントループからコルーチンを実行する（待っている側が取り消されると取得も取り消す）"""
+        loop = self.loop
+        if asyncio.get_running_loop() is loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(_bind_context(coro), loop))
+
+    def _host_counters(self, host):
+        counters = self._hosts.get(host)
+        if counters is None:
+            with self._lock:
+                counters = self._hosts.setdefault(host, {
+                    'requests': 0,
+                    'connections_opened': 0,
+                    'connections_reused': 0,
+                })
+        return counters
+
+    async def _on_connect_start(self, session, ctx, params):
+        ctx.connect_started = time.perf_counter()
+
+    async def _on_connect_end(self, session, ctx, params):
+        # TLSハンドシェイクを含む
+        metrics.observe('pcparts_stage_seconds', time.perf_counter() - ctx.connect_started,
+                        stage='upstream_connect', source=current_source())
+        self._host_counters(ctx.trace_request_ctx['host'])['connections_opened'] += 1
+
+    async def _on_connection_reused(self, session, ctx, params):
+        self._host_counters(ctx.trace_request_ctx['host'])['connections_reused'] += 1
+
+    def _get_session(self):
+        # イベントループのスレッドからのみ呼ぶ
+        if self._session is None:
+            trace = aiohttp.TraceConfig()
+            trace.on_connection_create_start.append(self._on_connect_start)
+            trace.on_connection_create_end.append(self._on_connect_end)
+            trace.on_connection_reuseconn.append(self._on_connection_reused)
+            connector = aiohttp.TCPConnector(limit=self.max_connections, limit_per_host=0, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(
+                connector=connector, headers=DEFAULT_HEADERS, trace_configs=[trace])
+        return self._session
+
+    def _scheduler(self, host):
+        scheduler = self._schedulers.get(host)
+        if scheduler is None:
+            scheduler = self._schedulers[host] = HostScheduler(
+                host, self.host_rate, self.host_burst, self.host_concurrency, self.queue_max)
+        return scheduler
+
+    async def get(self, url, timeout=10, priority=None, reader=None, headers=None):
+        """GETリクエストを送信し、本文を読み込んだ requests.Response を返す
+
+        priority を省略した場合は upstream_priority() で指定された優先度（なければ interactive）で送る。
+        送信待ちと取得を合わせて timeout 秒まで（送信待ちの時間は取得のタイムアウトから差し引く）。
+        送信待ちが timeout 秒を超えるか待ち行列からあふれた場合は UpstreamBusy を送出する。
+        reader を指定すると本文は await reader(response) の結果になる（途中で受信を打ち切る場合など）。
+        headers は既定のヘッダーに追加して送る（条件付きリクエストなど）。
+        """
+        priority = priority or _upstream_priority.get() or UPSTREAM_PRIORITIES[0]
+        if asyncio.get_running_loop() is not self.loop:
+            return await self.call(self.get(url, timeout, priority, reader, headers))
+
+        host = urlsplit(url).hostname or ''
+        self._host_counters(host)['requests'] += 1
+        scheduler = self._scheduler(host)
+        deadline = self.loop.time() + timeout
+        await scheduler.acquire(priority, timeout)
+        try:
+            if deadline <= self.loop.time():
+                raise UpstreamBusy(f'{host}: 送信待ちが {timeout} 秒を超えました')
+            return await self._fetch(url, host, deadline, reader, headers)
+        finally:
+            scheduler.release()
+
+    async def _fetch(self, url, host, deadline, reader=None, headers=None):
+        """deadline（イベントループの時刻）までに本文の受信まで終える。接続の再試行も同じ期限内で行う"""
+        session = self._get_session()
+        for attempt in range(self.connect_retries + 1):
+            try:
+                with timed('upstream_ttfb'):
+                    response = await session.get(
+                        url, headers=headers, timeout=aiohttp.ClientTimeout(total=deadline - self.loop.time()),
+                        trace_request_ctx={'host': host})
+                break
+            except aiohttp.ClientConnectorError:
+                # 接続エラーのみバックオフ付きで再試行（読み込みタイムアウトやHTTPエラーは再試行しない）
+                delay = self.backoff_factor * (2 ** attempt)
+                if attempt >= self.connect_retries or self.loop.time() + delay >= deadline:
+                    raise
+                await asyncio.sleep(delay)
+
+        async with response:
+            with timed('download'):
+                body = await (reader(response) if reader is not None else response.read())
+        return _build_response(str(response.url), response.status, response.headers, body)
+
+    def close(self):
+        if self._session is not None and self._pid == os.getpid():
+            self.run(self._session.close(), timeout=5)
+
+    def stats(self):
+        """ホストごとのリクエスト数・接続の再利用数・処理中の数と、優先度ごとの待ち・取りやめ・待ち時間"""
+        with self._lock:
+            hosts = {host: dict(counters) for host, counters in self._hosts.items()}
+        schedulers = dict(self._schedulers)
+        for host, host_stats in hosts.items():
+            scheduler = schedulers.get(host)
+            if scheduler is not None:
+                host_stats.update(scheduler.stats())
+            host_stats['host_concurrency'] = self.host_concurrency
+            host_stats['rate'] = self.host_rate
+            host_stats['queue_max'] = self.queue_max
+        return hosts
+
+
+async_upstream = AsyncUpstream(
+    max_connections=HTTP_MAX_CONNECTIONS,
+    host_concurrency=HTTP_HOST_CONCURRENCY,
+    connect_retries=HTTP_CONNECT_RETRIES,
+    backoff_factor=HTTP_RETRY_BACKOFF,
+    parse_workers=PARSE_WORKERS,
+    host_rate=HTTP_HOST_RATE,
+    host_burst=HTTP_HOST_BURST,
+    queue_max=HTTP_QUEUE_MAX,
+)
+atexit.register(async_upstream.close)
+
+
+def run_in_caller(coro):
+    """同期コードからコルーチンを呼び出し元のスレッドの専用ループで実行して結果を返す
+
+    キャッシュ・検索履歴（SQLite）を読み書きするコルーチンの同期版で使う。
+    取得先へのリクエストは http_get_async などが取得用イベントループに送るため、
+    そちらのループではキャッシュなどの読み書きを待たずに取得だけを進められる。
+    """
+    return asyncio.run(coro)
+
+# ==========================
+# 🛡️ 取得先ごとの遮断（サーキットブレーカー）と追加リクエスト（ヘッジ）
+# ==========================
+# 連続でこの回数失敗（接続エラー・タイムアウト・5xx・429）すると取得先を遮断する
+BREAKER_FAILURES = int(os.environ.get('BREAKER_FAILURES', 5))
+# 遮断してから試しに1件送るまでの秒数（試しが失敗するたびに倍にし、BREAKER_MAX_COOLDOWN まで延ばす）
+BREAKER_COOLDOWN = float(os.environ.get('BREAKER_COOLDOWN', 30))
+BREAKER_MAX_COOLDOWN = float(os.environ.get('BREAKER_MAX_COOLDOWN', 300))
+# 応答が取得先の p95 を過ぎても返らない場合に同じリクエストをもう1件送る
+HEDGE_ENABLED = os.environ.get('HEDGE_ENABLED', '1') != '0'
+# 追加リクエストを送るまでの最短秒数と、取得先ごとの追加リクエストの割合の上限
+HEDGE_MIN_DELAY = float(os.environ.get('HEDGE_MIN_DELAY', 0.3))
+HEDGE_MAX_RATIO = float(os.environ.get('HEDGE_MAX_RATIO', 0.1))
+# p95 を求める直近の応答数と、追加リクエストを始めるのに必要な応答数
+HEDGE_WINDOW = int(os.environ.get('HEDGE_WINDOW', 200))
+HEDGE_MIN_SAMPLES = int(os.environ.get('HEDGE_MIN_SAMPLES', 20))
+
+
+class CircuitOpen(UpstreamBusy):
+    """取得先を遮断中のため送らなかった"""
+
+
+class CircuitBreaker:
+    """1取得先分のサーキットブレーカー
+
+    closed: 通常どおり送る。連続 failures 回失敗すると open にする。
+    open: cooldown 秒の間は送らずに CircuitOpen を送出する。
+    half_open: cooldown 後に1件だけ試しに送り、成功すれば closed、失敗すれば cooldown を倍にして open に戻す。
+    """
+
+    def __init__(self, source, failures, cooldown, max_cooldown):
+        self.source = source
+        self.failures = failures
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.cooldown = cooldown
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._counters = {'opened': 0, 'rejected': 0, 'probes': 0}
+        self._lock = threading.Lock()
+
+    def before_request(self):
+        """送ってよいかを確認する。送った場合は試しの送信かどうかを返す"""
+        with self._lock:
+            if self.state == 'closed':
+                return False
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self._probing:
+                self._probing = True
+                self._counters['probes'] += 1
+                return True
+            self._counters['rejected'] += 1
+        metrics.inc('pcparts_circuit_rejections_total', source=self.source)
+        raise CircuitOpen(f'{self.source}: 取得先を遮断中です（{self.cooldown:.0f}秒ごとに再試行）')
+
+    def record(self, success, probe):
+        with self._lock:
+            if probe:
+                self._probing = False
+            if success:
+                self.consecutive_failures = 0
+                if self.state != 'closed':
+                    logger.warning("✅ %s の遮断を解除しました", self.source)
+                self.state = 'closed'
+                self.cooldown = self.base_cooldown
+                return
+
+            self.consecutive_failures += 1
+            if probe:
+                self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+            elif self.state != 'closed' or self.consecutive_failures < self.failures:
+                return
+            self.state = 'open'
+            self.opened_at = time.monotonic()
+            self._counters['opened'] += 1
+        logger.warning("🛑 %s を %.0f 秒間遮断します（連続 %d 回失敗）",
+                       self.source, self.cooldown, self.consecutive_failures)
+
+    def release_probe(self, probe):
+        """結果を判定しなかった試しの送信（取り消し・送信待ちのあふれ）の枠を返す"""
+        if probe:
+            with self._lock:
+                self._probing = False
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['state'] = self.state
+            stats['consecutive_failures'] = self.consecutive_failures
+            stats['cooldown'] = self.cooldown
+        return stats
+
+
+class SourceHealth:
+    """取得先ごとにサーキットブレーカーで失敗中の取得先を素早く諦め、遅い応答にはヘッジで備える
+
+    取得に成功した応答時間を取得先ごとに直近 window 件保持し、その p95（最短 hedge_min_delay）を
+    過ぎても応答がなければ同じリクエストをもう1件送って、先に返った方を使う。
+    追加リクエストは取得先の全リクエストの hedge_max_ratio までに抑える。
+    """
+
+    def __init__(self, failures, cooldown, max_cooldown, hedge_enabled, hedge_min_delay,
+                 hedge_max_ratio, window, min_samples):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.hedge_enabled = hedge_enabled
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_max_ratio = hedge_max_ratio
+        self.window = window
+        self.min_samples = min_samples
+        self._breakers = {}
+        self._latencies = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, source):
+        breaker = self._breakers.get(source)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(
+                    source, CircuitBreaker(source, self.failures, self.cooldown, self.max_cooldown))
+        return breaker
+
+    def _source_state(self, source):
+        counters = self._counters.get(source)
+        if counters is None:
+            with self._lock:
+                self._latencies.setdefault(source, deque(maxlen=self.window))
+                counters = self._counters.setdefault(source, {'requests': 0, 'hedges': 0, 'hedge_wins': 0})
+        return counters, self._latencies[source]
+
+    def p95(self, source):
+        _, latencies = self._source_state(source)
+        if len(latencies) < self.min_samples:
+            return None
+        ordered = sorted(latencies)
+        return ordered[max(0, math.ceil(len(ordered) * 0.95) - 1)]
+
+    def _hedge_delay(self, source, counters):
+        if not self.hedge_enabled or counters['hedges'] >= counters['requests'] * self.hedge_max_ratio:
+            return None
+        p95 = self.p95(source)
+        return None if p95 is None else max(p95, self.hedge_min_delay)
+
+    @staticmethod
+    def _is_failure(res):
+        return res.status_code >= 500 or res.status_code == 429
+
+    async def get(self, url, timeout=10, reader=None, headers=None):
+        """取得先（計測ラベルの source）のサーキットブレーカーを通してGETリクエストを送信"""
+        source = current_source()
+        if source == 'none':
+            return await async_upstream.get(url, timeout=timeout, reader=reader, headers=headers)
+        if asyncio.get_running_loop() is not async_upstream.loop:
+            return await async_upstream.call(self.get(url, timeout, reader, headers))
+
+        breaker = self.breaker(source)
+        probe = breaker.before_request()
+        counters, latencies = self._source_state(source)
+        counters['requests'] += 1
+        start = time.perf_counter()
+        try:
+            # 試しの送信ではヘッジしない
+            delay = None if probe else self._hedge_delay(source, counters)
+            res = await self._hedged_get(url, timeout, reader, headers, source, counters, delay)
+        except UpstreamBusy:
+            breaker.release_probe(probe)
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            breaker.record(False, probe)
+            raise
+        except BaseException:
+            breaker.release_probe(probe)
+            raise
+
+        failed = self._is_failure(res)
+        breaker.record(not failed, probe)
+        if not failed:
+            latencies.append(time.perf_counter() - start)
+        return res
+
+    async def _hedged_get(self, url, timeout, reader, headers, source, counters, delay):
+        primary = asyncio.ensure_future(async_upstream.get(url, timeout=timeout, reader=reader, headers=headers))
+        if delay is None or delay >= timeout:
+            return await primary
+
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                return primary.result()
+
+            counters['hedges'] += 1
+            metrics.inc('pcparts_upstream_hedges_total', source=source)
+            hedge = asyncio.ensure_future(
+                async_upstream.get(url, timeout=timeout - delay, reader=reader, headers=headers))
+            tasks.append(hedge)
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            counters['hedge_wins'] += 1
+                            metrics.inc('pcparts_upstream_hedge_wins_total', source=source)
+                        return task.result()
+            # 両方失敗した場合は最初のリクエストのエラーを返す
+            return primary.result()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def stats(self):
+        """取得先ごとの遮断の状態・p95・ヘッジの回数"""
+        with self._lock:
+            sources = set(self._breakers) | set(self._counters)
+        stats = {}
+        for source in sorted(sources):
+            source_stats = self.breaker(source).stats()
+            counters, _ = self._source_state(source)
+            source_stats.update(counters)
+            p95 = self.p95(source)
+            source_stats['p95_seconds'] = round(p95, 4) if p95 is not None else None
+            stats[source] = source_stats
+        return stats
+
+
+source_health = SourceHealth(
+    failures=BREAKER_FAILURES,
+    cooldown=BREAKER_COOLDOWN,
+    max_cooldown=BREAKER_MAX_COOLDOWN,
+    hedge_enabled=HEDGE_ENABLED,
+    hedge_min_delay=HEDGE_MIN_DELAY,
+    hedge_max_ratio=HEDGE_MAX_RATIO,
+    window=HEDGE_WINDOW,
+    min_samples=HEDGE_MIN_SAMPLES,
+)
+
+
+async def http_get_async(url, timeout=10, reader=None, headers=None):
+    """取得用イベントループでGETリクエストを送信
+
+    取得先ごとのサーキットブレーカーとヘッジ（source_health）を通して送る。
+    ヘッダー受信まで（接続確立を含む）を upstream_ttfb、本文の受信を download として計測する。
+    reader には本文の読み方（stream_reader.reader() など）、headers には追加のヘッダーを指定できる。
+    """
+    return await source_health.get(url, timeout=timeout, reader=reader, headers=headers)
+
+
+def http_get(url, timeout=10):
+    """http_get_async の同期版"""
+    return async_upstream.run(http_get_async(url, timeout=timeout))
+
+
+# ==========================
+# 🔤 レスポンスの文字コード判定
+# ==========================
+# <meta charset> を探す先頭のバイト数
+ENCODING_SNIFF_BYTES = int(os.environ.get('ENCODING_SNIFF_BYTES', 4096))
+
+_HEADER_CHARSET_RE = re.compile(r'charset\s*=\s*["\']?\s*([A-Za-z0-9_.:\-]+)', re.I)
+# <meta charset="..."> と <meta http-equiv="Content-Type" content="...; charset=..."> の両方に一致
+_META_CHARSET_RE = re.compile(rb'<meta[^>]*?charset\s*=\s*["\']?\s*([A-Za-z0-9_.:\-]+)', re.I)
+
+# Python が知らない別名
+_ENCODING_ALIASES = {
+    'windows-31j': 'cp932',
+    'x-sjis': 'cp932',
+}
+# 宣言された文字コードより広い互換の文字コードで読む（Shift_JIS のページも実際は機種依存文字を含む）
+_ENCODING_SUPERSETS = {
+    'shift_jis': 'cp932',
+    'iso8859-1': 'cp1252',
+    'ascii': 'utf-8',
+}
+
+
+def _normalize_encoding(name):
+    """文字コード名を Python の正式名に変換（不明な名前は None）"""
+    if not name:
+        return None
+    name = name.strip().lower()
+    try:
+        name = codecs.lookup(_ENCODING_ALIASES.get(name, name)).name
+    except LookupError:
+        return None
+    return _ENCODING_SUPERSETS.get(name, name)
+
+
+class EncodingResolver:
+    """Content-Type → 先頭の <meta charset> → ホストごとの前回値 の順に文字コードを決める
+
+    統計的な推定（apparent_encoding）は本文全体を走査して遅いため、どれでも決まらない場合だけ使う。
+    """
+
+    def __init__(self, sniff_bytes):
+        self.sniff_bytes = sniff_bytes
+        self._by_host = {}
+        self._lock = threading.Lock()
+        self._counters = {'header': 0, 'meta': 0, 'host': 0, 'detected': 0}
+
+    def _count(self, method):
+        with self._lock:
+            self._counters[method] += 1
+
+    def resolve(self, res):
+        host = urlsplit(res.url).hostname or ''
+
+        match = _HEADER_CHARSET_RE.search(res.headers.get('Content-Type', ''))
+        encoding = _normalize_encoding(match.group(1)) if match else None
+        method = 'header'
+
+        if encoding is None:
+            match = _META_CHARSET_RE.search(res.content[:self.sniff_bytes])
+            encoding = _normalize_encoding(match.group(1).decode('ascii')) if match else None
+            method = 'meta'
+
+        if encoding is None:
+            with self._lock:
+                encoding = self._by_host.get(host)
+            method = 'host'
+
+        if encoding is None:
+            encoding = _normalize_encoding(res.apparent_encoding) or 'utf-8'
+            method = 'detected'
+
+        self._count(method)
+        if method != 'host':
+            with self._lock:
+                self._by_host[host] = encoding
+        return encoding
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['hosts'] = dict(self._by_host)
+        return stats
+
+
+encoding_resolver = EncodingResolver(ENCODING_SNIFF_BYTES)
+
+
+# ==========================
+# 🤝 同一リクエストの相乗り（single-flight）
+# ==========================
+class SingleFlight:
+    """同じキーの処理が実行中なら新たに実行せず、その結果を共有する（取得用イベントループ内で使う）
+
+    待っている呼び出し元がすべて取り消された場合は、共有している処理も取り消す。
+    """
+
+    def __init__(self):
+        self._calls = {}  # key -> [タスク, 待っている数]
+        self._counters = {'calls': 0, 'executions': 0, 'coalesced': 0, 'cancelled': 0}
+
+    async def do(self, key, func, *args, **kwargs):
+        self._counters['calls'] += 1
+        call = self._calls.get(key)
+        if call is None:
+            call = self._calls[key] = [asyncio.ensure_future(func(*args, **kwargs)), 0]
+            self._counters['executions'] += 1
+
+            def forget(_, call=call):
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call[0].add_done_callback(forget)
+        else:
+            self._counters['coalesced'] += 1
+
+        task = call[0]
+        call[1] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            call[1] -= 1
+            if call[1] == 0 and not task.done():
+                task.cancel()
+                self._counters['cancelled'] += 1
+
+    def stats(self):
+        stats = dict(self._counters)
+        stats['in_flight'] = len(self._calls)
+        return stats
+
+
+single_flight = SingleFlight()
+
+
+def coalesce_upstream(source, priority='interactive'):
+    """(取得先, 検索語, カテゴリ) が同じ同時リクエストを1回の取得・解析にまとめる
+
+    非同期関数に付け、どのイベントループから呼んでも取得用イベントループで実行する。
+    取得は upstream_priority() で指定がなければ priority の優先度で送る。
+    結果のオブジェクトは呼び出し元で共有されるため、書き換える場合はコピーすること。
+    """
+    def decorator(func):
+        async def measured(*args, **kwargs):
+            _metric_source.set(source)
+            if _upstream_priority.get() is None:
+                _upstream_priority.set(priority)
+            start = time.perf_counter()
+            outcome = 'error'
+            try:
+                result = await func(*args, **kwargs)
+                outcome = 'ok' if result else 'empty'
+                return result
+            except asyncio.CancelledError:
+                outcome = 'cancelled'
+                raise
+            finally:
+                metrics.observe('pcparts_upstream_seconds', time.perf_counter() - start, source=source)
+                metrics.inc('pcparts_upstream_requests_total', source=source, outcome=outcome)
+
+        @functools.wraps(func)
+        async def wrapper(query, category='', *args, **kwargs):
+            key = (source, part_keys.key(query, category), category)
+            return await async_upstream.call(single_flight.do(key, measured, query, category, *args, **kwargs))
+        return wrapper
+    return decorator
+
+
 # ==========================
 # 🎯 カテゴリに応じた検索キーワード最適化
 # ==========================
 def optimize_search_query(product_name, category):
     """カテゴリに応じて検索クエリを最適化"""
     # 日本語キーワードを追加すると価格.comで404エラーになるため
-    # 商品名のみを返す
+    # 商品名のみを返す（型番のキーはキャッシュ・まとめ・履歴だけに使い、検索語は入力のまま送る）
     return product_name
 
 
+def normalize_product_name(product_name):
+    """キャッシュ・索引のキー用に商品名を正規化（大文字小文字・空白の揺れを吸収）"""
+    return ' '.join(product_name.lower().split())
+
+
+# ==========================
+# 🔑 型番の正規化（キャッシュ・まとめ・履歴のキー）
+# ==========================
+# 覚えておく言い換え（検索語 → 型番）の上限
+PART_ALIAS_MAX = int(os.environ.get('PART_ALIAS_MAX', 5000))
+
+# 型番の前後に付いていても同じ商品として扱う語
+_PART_NOISE_RE = re.compile(
+    r'\b(?:box|bulk|retail|processor|desktop|cpu|gpu|graphics card|video card|kit|memory|ram|dimm|udimm)\b'
+    r'|プロセッサー?|グラフィック(?:ボード|カード)|グラボ|メモリー?|[()\[\]]')
+_PART_SEPARATOR_RE = re.compile(r'[-_/,・]+')
+
+
+def normalize_part_text(product_name):
+    """全角・大文字小文字・記号と空白の揺れを吸収した文字列（型番の文法に一致しない検索語のキー）"""
+    text = unicodedata.normalize('NFKC', product_name or '').lower()
+    return ' '.join(_PART_SEPARATOR_RE.sub(' ', text).split())
+
+
+def _intel_core(m):
+    tier, model = m.group(1), m.group(2)
+    return f'intel core i{tier}-{model}', f'Core i{tier}-{model.upper()}'
+
+
+def _intel_core_ultra(m):
+    tier, model = m.group(1), m.group(2)
+    return f'intel core ultra {tier} {model}', f'Core Ultra {tier} {model.upper()}'
+
+
+def _amd_ryzen(m):
+    tier, model = m.group(1) or m.group(2), m.group(3)
+    return f'amd ryzen {tier} {model}', f'Ryzen {tier} {model.upper()}'
+
+
+def _amd_threadripper(m):
+    pro = ' pro' if m.group(1) else ''
+    model = m.group(2)
+    return f'amd ryzen threadripper{pro} {model}', f'Ryzen Threadripper{pro.upper()} {model.upper()}'
+
+
+def _geforce(m):
+    series, number, ti, super_, memory = m.groups()
+    key = ['nvidia geforce', series, number]
+    query = [series.upper(), number]
+    if ti:
+        key.append('ti')
+        query.append('Ti')
+    if super_:
+        key.append('super')
+        query.append('SUPER')
+    if memory:
+        key.append(f'{memory}gb')
+        query.append(f'{memory}GB')
+    return ' '.join(key), ' '.join(query)
+
+
+def _radeon(m):
+    number, suffix, memory = m.groups()
+    key = ['amd radeon rx', number]
+    query = ['RX', number]
+    if suffix:
+        key.append(suffix)
+        query.append(suffix.upper())
+    if memory:
+        key.append(f'{memory}gb')
+        query.append(f'{memory}GB')
+    return ' '.join(key), ' '.join(query)
+
+
+# (カテゴリ, 文法, (キー, 検索語) を作る関数)。文法は記号・不要語を除いた検索語の全体に一致させる
+_PART_GRAMMARS = [
+    (('cpu',), re.compile(r'(?:intel )?(?:core )?ultra ?([3579]) ?(\d{3}[a-z]{0,2})'), _intel_core_ultra),
+    (('cpu',), re.compile(r'(?:intel )?(?:core )?i ?([3579]) ?(\d{4,5}[a-z]{0,3})'), _intel_core),
+    (('cpu',), re.compile(r'(?:amd )?(?:ryzen )?threadripper( pro)? ?(\d{4}[a-z]{0,2})'), _amd_threadripper),
+    (('cpu',), re.compile(r'(?:amd )?(?:ryzen ?([3579])|r([3579])) ?(\d{4}[a-z]{0,2}(?:3d)?)'), _amd_ryzen),
+    (('gpu',), re.compile(r'(?:nvidia )?(?:geforce )?(rtx|gtx) ?(\d{4}) ?(ti)? ?(super)?(?: ?(\d{1,2}) ?gb)?'),
+     _geforce),
+    (('gpu',), re.compile(r'(?:amd )?(?:radeon )?rx ?(\d{4}) ?(xtx|xt|gre)?(?: ?(\d{1,2}) ?gb)?'), _radeon),
+]
+
+_DDR_SPEED_RE = re.compile(r'\bddr([45]) ?(\d{4,5})\b|\bpc([45]) ?(\d{5})\b')
+_DDR_KIT_RE = re.compile(r'\b(\d) ?x ?(\d{1,3}) ?gb\b|\b(\d{1,3}) ?gb ?x ?(\d)\b')
+_DDR_CAPACITY_RE = re.compile(r'\b(\d{1,3}) ?gb\b')
+_DDR_GENERATION_RE = re.compile(r'\bddr([45])\b')
+
+
+def _memory_kit(text):
+    """DDR4/DDR5 の 規格・速度・容量（・枚数）だけからなる検索語を (キー, 検索語) にする（語順は問わない）
+
+    16GBx2 のような複数枚のキットは枚数と1枚の容量もキーに含め、同じ合計容量の1枚とは別の商品にする。
+    """
+    speeds = set()
+    totals = set()
+    kits = set()
+    generations = set()
+
+    def speed(m):
+        if m.group(1):
+            speeds.add((m.group(1), m.group(2)))
+        else:
+            # PC5-48000 は DDR5-6000（転送速度 MB/s ÷ 8）
+            speeds.add((m.group(3), str(int(m.group(4)) // 8)))
+        return ' '
+
+    def kit(m):
+        count, size = (m.group(1), m.group(2)) if m.group(1) else (m.group(4), m.group(3))
+        totals.add(int(count) * int(size))
+        kits.add((int(count), int(size)))
+        return ' '
+
+    def capacity(m):
+        totals.add(int(m.group(1)))
+        return ' '
+
+    def generation(m):
+        generations.add(m.group(1))
+        return ' '
+
+    rest = _DDR_SPEED_RE.sub(speed, text)
+    rest = _DDR_KIT_RE.sub(kit, rest)
+    rest = _DDR_CAPACITY_RE.sub(capacity, rest)
+    rest = _DDR_GENERATION_RE.sub(generation, rest)
+    if rest.strip() or len(speeds) != 1 or len(totals) != 1 or len(kits) > 1:
+        return None
+    (gen, mts), total = speeds.pop(), totals.pop()
+    if generations - {gen}:
+        return None
+    if kits and kits != {(1, total)}:
+        count, size = kits.pop()
+        return f'ddr{gen}-{mts} {total}gb {count}x{size}', f'DDR{gen}-{mts} {size}GBx{count}'
+    return f'ddr{gen}-{mts} {total}gb', f'DDR{gen}-{mts} {total}GB'
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_part_model(product_name, category=''):
+    """検索語が型番の文法に一致すれば (キー, 検索語) を返す
+
+    型番以外の語（メーカー独自のモデル名など）が残る場合は別の商品の可能性があるため None を返す。
+    """
+    text = unicodedata.normalize('NFKC', product_name or '').lower()
+    text = ' '.join(_PART_SEPARATOR_RE.sub(' ', _PART_NOISE_RE.sub(' ', text)).split())
+    if not text:
+        return None
+    for categories, pattern, build in _PART_GRAMMARS:
+        if category and category not in categories:
+            continue
+        m = pattern.fullmatch(text)
+        if m:
+            return build(m)
+    if not category or category == 'memory':
+        return _memory_kit(text)
+    return None
+
+
+class PartKeyNormalizer:
+    """検索語とカテゴリから型番のキーを作る（キャッシュ・同時リクエストのまとめ・検索履歴に使う）
+
+    型番の文法に一致する検索語は 'i9 14900k' も 'Intel Core i9-14900K' も同じ型番に、
+    一致しない検索語は価格.comの結果から覚えた言い換え（'14900k' → Core i9-14900K）を使う。
+    どちらもなければ記号・空白の揺れだけを吸収した文字列をキーにする。
+    """
+
+    def __init__(self, max_aliases):
+        self.max_aliases = max_aliases
+        self.store = None
+        self._aliases = OrderedDict()  # (検索語, カテゴリ) -> (キー, 検索語)
+        self._lock = threading.Lock()
+        self._counters = {'grammar': 0, 'alias': 0, 'text': 0, 'learned': 0}
+
+    def resolve(self, product_name, category=''):
+        """(キー, 表記を揃えた型番, 種類) を返す。種類は 'grammar' / 'alias' / 'text'"""
+        parsed = parse_part_model(product_name, category)
+        if parsed is not None:
+            return parsed[0], parsed[1], 'grammar'
+        text = normalize_part_text(product_name)
+        with self._lock:
+            alias = self._aliases.get((text, category))
+            if alias is not None:
+                self._aliases.move_to_end((text, category))
+                return alias[0], alias[1], 'alias'
+        return text, product_name, 'text'
+
+    def key(self, product_name, category=''):
+        return self.resolve(product_name, category)[0]
+
+    @staticmethod
+    def names_model(text, key):
+        """検索語（normalize_part_text 済み）が型番のキーの商品を特定する語をすべて含むか
+
+        商品を特定する語は数字を2桁以上含む語（14900k・4090・16gb など）。
+        'i9'・'rtx' のような広い検索語を、たまたま最安だった1つの型番の言い換えにしない。
+        """
+        model_tokens = {token for token in normalize_part_text(key).split()
+                        if sum(ch.isdigit() for ch in token) >= 2}
+        return bool(model_tokens) and model_tokens <= set(text.split())
+
+    def learn(self, product_name, category, result_name):
+        """文法に一致しない検索語で見つかった商品名が型番の文法に一致すれば、言い換えとして覚える"""
+        if not result_name or parse_part_model(product_name, category) is not None:
+            return
+        parsed = parse_part_model(result_name, category)
+        text = normalize_part_text(product_name)
+        # 検索語の単語がすべて商品名に含まれ、検索語に型番そのものが含まれる場合だけ覚える（別の商品を同じキーにしない）
+        if parsed is None or not text or not set(text.split()) <= set(normalize_part_text(result_name).split()):
+            return
+        if not self.names_model(text, parsed[0]):
+            return
+        if not self._set((text, category), parsed):
+            return
+        self.count('learned')
+        if self.store is not None:
+            self.store.put_alias(text, category, parsed[0], parsed[1])
+
+    def _set(self, alias_key, parsed):
+        with self._lock:
+            if self._aliases.get(alias_key) == parsed:
+                return False
+            self._aliases[alias_key] = parsed
+            self._aliases.move_to_end(alias_key)
+            while len(self._aliases) > self.max_aliases:
+                self._aliases.popitem(last=False)
+            return True
+
+    def load(self, store, limit):
+        """永続キャッシュに保存した言い換えを読み込み、以後の言い換えも保存する
+
+        型番そのものを含まない検索語の言い換え（以前の条件で覚えたもの）は読み込まない。
+        """
+        self.store = store
+        for text, category, key, query in reversed(store.aliases(limit)):
+            if self.names_model(text, key):
+                self._set((text, category), (key, query))
+
+    def count(self, kind):
+        with self._lock:
+            self._counters[kind] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['aliases'] = len(self._aliases)
+        return stats
+
+
+part_keys = PartKeyNormalizer(PART_ALIAS_MAX)
+
+
 # ==========================
 # 📊 スペック情報の抽出
 # ==========================
-def extract_cpu_specs(product_name):
-    """CPUの商品名からソケット情報を抽出"""
-    specs = {}
-    import re
-
-    # ソケット情報のパターン
-    socket_patterns = {
-        'LGA1700': ['LGA1700', 'LGA 1700'],
-        'LGA1200': ['LGA1200', 'LGA 1200'],
-        'LGA1151': ['LGA1151', 'LGA 1151'],
-        'AM5': ['AM5', 'Socket AM5'],
-        'AM4': ['AM4', 'Socket AM4'],
-        'sTRX4': ['sTRX4', 'TRX4'],
-        'sTR4': ['sTR4', 'TR4'],
-    }
+def _trie_pattern(keywords):
+    """キーワード集合をトライ構造の正規表現に変換（同じ位置では最長のキーワードに一致する）"""
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for ch in keyword:
+            node = node.setdefault(ch, {})
+        node[''] = {}
+
+    def build(node):
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ''
+        if len(branches) == 1 and '' not in node:
+            return branches[0]
+        return '(?:' + '|'.join(branches) + ')' + ('?' if '' in node else '')
+
+    return build(trie)
+
+
+# キーワードがこの数以下なら、トライの正規表現より str の部分一致検索（C実装）を並べる方が速い
+# （bench/fixtures/spec_golden.json の商品名で 3〜15語は2〜3倍、32語でも1割ほど速く、77語では正規表現が1.6倍速い）
+_SCAN_KEYWORD_LIMIT = 32
+
+
+class KeywordMatcher:
+    """商品名に含まれるキーワードをまとめて検出する
+
+    キーワードが _SCAN_KEYWORD_LIMIT 以下なら1語ずつ部分一致を調べ、
+    それより多ければキーワード集合のトライ構造の正規表現で1回だけ走査する。
+    """
+
+    def __init__(self, keywords):
+        self.keywords = sorted({keyword.lower() for keyword in keywords if keyword})
+        self._pattern = None
+        self._prefixes = {}
+        if len(self.keywords) > _SCAN_KEYWORD_LIMIT:
+            self._pattern = re.compile('(?=(' + _trie_pattern(self.keywords) + '))')
+            # 同じ位置で一致する短いキーワード（接頭辞）もまとめて検出済みにする
+            self._prefixes = {
+                keyword: tuple(other for other in self.keywords if keyword.startswith(other))
+                for keyword in self.keywords
+            }
 
-    # CPUモデルからソケットを推定
-    product_lower = product_name.lower()
+    def find(self, text):
+        """text（小文字化済み）に含まれるキーワードの集合（frozenset）を返す"""
+        if self._pattern is None:
+            return frozenset([keyword for keyword in self.keywords if keyword in text])
+        found = set()
+        for keyword in self._pattern.findall(text):
+            found.update(self._prefixes[keyword])
+        return frozenset(found)
+
+
+class ChoiceRule:
+    """キーワードの有無で値を選ぶルール
+
+    options は (値, [キーワードの組, ...]) のリスト。組のキーワードがすべて含まれれば一致とする。
+    mode: 'first' = 最初に一致した値 / 'last' = 最後に一致した値で上書き / 'if_missing' = 未設定の場合のみ
+    """
+
+    def __init__(self, field, options, mode='first'):
+        self.field = field
+        self.options = [(value, [tuple(k.lower() for k in group) for group in groups]) for value, groups in options]
+        self.mode = mode
+        # キーワード1つで決まる選択肢は キーワード -> 選択肢の番号 の索引で引く
+        self._single = {}
+        self._multi = []
+        for index, (_, groups) in enumerate(self.options):
+            for group in groups:
+                if len(group) == 1:
+                    self._single.setdefault(group[0], []).append(index)
+                else:
+                    self._multi.append((index, group))
+
+    @property
+    def keywords(self):
+        return {keyword for _, groups in self.options for group in groups for keyword in group}
+
+    def apply(self, text, found, specs):
+        if self.mode == 'if_missing' and self.field in specs:
+            return
+        selected = None
+        for keyword in found:
+            indices = self._single.get(keyword)
+            if indices:
+                index = indices[-1] if self.mode == 'last' else indices[0]
+                if selected is None or (index > selected if self.mode == 'last' else index < selected):
+                    selected = index
+        for index, group in self._multi:
+            if all(keyword in found for keyword in group):
+                if selected is None or (index > selected if self.mode == 'last' else index < selected):
+                    selected = index
+        if selected is not None:
+            specs[self.field] = self.options[selected][0]
+
+    def apply_text(self, text, specs):
+        """キーワードの集合を作らずに text を直接調べて適用する（一致した時点で打ち切る）"""
+        if self.mode == 'if_missing' and self.field in specs:
+            return
+        for value, groups in (reversed(self.options) if self.mode == 'last' else self.options):
+            for group in groups:
+                for keyword in group:
+                    if keyword not in text:
+                        break
+                else:
+                    specs[self.field] = value
+                    return
+
+
+class RegexRule:
+    """正規表現で値を取り出すルール（最初に一致したパターンを使う）
+
+    patterns は (パターン, 必須キーワード) のリスト。必須キーワードがない文字列では照合しない。
+    """
+
+    def __init__(self, field, patterns, format_match, find_all=False):
+        self.field = field
+        self.patterns = [(re.compile(pattern), required) for pattern, required in patterns]
+        self.format_match = format_match
+        self.find_all = find_all
+
+    @property
+    def keywords(self):
+        return {required for _, required in self.patterns if required}
+
+    def apply(self, text, found, specs):
+        for pattern, required in self.patterns:
+            if required and required not in found:
+                continue
+            if self.find_all:
+                matches = pattern.findall(text)
+                if matches:
+                    specs[self.field] = self.format_match(matches)
+                    break
+            else:
+                match = pattern.search(text)
+                if match:
+                    specs[self.field] = self.format_match(match)
+                    break
+
+
+def _keywords(*keywords):
+    """キーワードをそれぞれ単独の組にする（いずれか1つを含めば一致）"""
+    return [(keyword,) for keyword in keywords]
+
+
+# カテゴリごとのスペック抽出ルール（上から順に適用）
+SPEC_RULES = {
+    'cpu': [
+        # TDP情報を抽出
+        RegexRule('tdp', [(r'tdp\s*(\d{2,3})\s*w', 'tdp'), (r'(\d{2,3})\s*w\s*tdp', 'tdp')],
+                  lambda m: m.group(1) + 'W'),
+        # CPUモデルからソケットを推定
+        ChoiceRule('socket', [
+            # Intel 12th-14th Gen (Alder Lake, Raptor Lake) -> LGA1700
+            ('LGA1700', _keywords('12th', '13th', '14th', 'i3-12', 'i3-13', 'i3-14',
+                                  'i5-12', 'i5-13', 'i5-14', 'i7-12', 'i7-13', 'i7-14',
+                                  'i9-12', 'i9-13', 'i9-14')),
+            # Intel 10th-11th Gen (Comet Lake, Rocket Lake) -> LGA1200
+            ('LGA1200', _keywords('10th', '11th', 'i3-10', 'i3-11', 'i5-10', 'i5-11',
+                                  'i7-10', 'i7-11', 'i9-10', 'i9-11')),
+            # AMD Ryzen 7000 series -> AM5
+            ('AM5', _keywords('ryzen 7 7', 'ryzen 5 7', 'ryzen 9 7', 'ryzen 3 7', '7950x', '7900x',
+                              '7800x3d', '7700x', '7600x', '7600')),
+            # AMD Ryzen 5000, 3000, 2000, 1000 series -> AM4
+            ('AM4', _keywords('ryzen 7 5', 'ryzen 5 5', 'ryzen 9 5', 'ryzen 7 3', 'ryzen 5 3', 'ryzen 9 3',
+                              'ryzen 7 2', 'ryzen 5 2', 'ryzen 7 1', 'ryzen 5 1',
+                              '5950x', '5900x', '5800x3d', '5800x', '5700x', '5600x', '5600',
+                              '3950x', '3900x', '3800x', '3700x', '3600x', '3600')),
+            # AMD Threadripper -> sTRX4 or sTR4
+            ('sTRX4', [('threadripper', model) for model in ('3990x', '3970x', '3960x')]),
+            ('sTR4', _keywords('threadripper')),
+        ]),
+        # 商品名に直接ソケット情報が含まれている場合はそちらを優先
+        ChoiceRule('socket', [
+            ('LGA1700', _keywords('lga1700', 'lga 1700')),
+            ('LGA1200', _keywords('lga1200', 'lga 1200')),
+            ('LGA1151', _keywords('lga1151', 'lga 1151')),
+            ('AM5', _keywords('am5', 'socket am5')),
+            ('AM4', _keywords('am4', 'socket am4')),
+            ('sTRX4', _keywords('strx4', 'trx4')),
+            ('sTR4', _keywords('str4', 'tr4')),
+        ], mode='last'),
+    ],
+    'psu': [
+        # ワット数を抽出（例: 850W, 850ワット, 850watt）
+        RegexRule('wattage', [(r'(\d{3,4})\s*w(?:att)?(?:\s|$)', 'w'), (r'(\d{3,4})\s*ワット', 'ワット')],
+                  lambda m: m.group(1) + 'W'),
+        # 80 PLUS認証を抽出
+        ChoiceRule('certification', [
+            ('80 PLUS Titanium', _keywords('titanium', 'チタン')),
+            ('80 PLUS Platinum', _keywords('platinum', 'プラチナ')),
+            ('80 PLUS Gold', _keywords('gold', 'ゴールド')),
+            ('80 PLUS Silver', _keywords('silver', 'シルバー')),
+            ('80 PLUS Bronze', _keywords('bronze', 'ブロンズ')),
+            ('80 PLUS Standard', _keywords('80 plus standard', '80plus standard')),
+        ]),
+        # 80 PLUSのみの記載があるか
+        ChoiceRule('certification', [('80 PLUS', _keywords('80 plus'))], mode='if_missing'),
+    ],
+    'motherboard': [
+        ChoiceRule('socket', [
+            ('LGA1700', _keywords('lga1700', 'lga 1700')),
+            ('LGA1200', _keywords('lga1200', 'lga 1200')),
+            ('AM5', _keywords('am5', 'socket am5')),
+            ('AM4', _keywords('am4', 'socket am4')),
+        ]),
+        ChoiceRule('chipset', [
+            (chipset, _keywords(chipset)) for chipset in
+            ['Z790', 'Z690', 'B760', 'B660', 'H770', 'H670', 'X670E', 'X670', 'B650E', 'B650', 'A620', 'X570', 'B550', 'A520']
+        ]),
+        ChoiceRule('formFactor', [
+            ('E-ATX', _keywords('e-atx', 'eatx', 'extended atx')),
+            ('ATX', _keywords('atx')),
+            ('Micro-ATX', _keywords('micro-atx', 'matx', 'micro atx')),
+            ('Mini-ITX', _keywords('mini-itx', 'mini itx', 'mitx')),
+        ]),
+    ],
+    'memory': [
+        ChoiceRule('type', [('DDR5', _keywords('ddr5')), ('DDR4', _keywords('ddr4'))]),
+        RegexRule('speed', [(r'(\d{4,5})\s*mhz', 'mhz'), (r'ddr[45]-(\d{4,5})', 'ddr')],
+                  lambda m: m.group(1) + 'MHz'),
+        # 容量（複数記載されている場合は合計）
+        RegexRule('capacity', [(r'(\d+)\s*gb', 'gb'), (r'(\d+)gb', 'gb')],
+                  lambda matches: f"{sum(int(m) for m in matches)}GB", find_all=True),
+    ],
+    'gpu': [
+        # 消費電力（TDP/TGP）
+        RegexRule('power', [(r'(\d{2,3})\s*w(?:att)?(?:\s|$)', 'w'), (r'tdp\s*(\d{2,3})', 'tdp'),
+                            (r'tgp\s*(\d{2,3})', 'tgp')],
+                  lambda m: m.group(1) + 'W'),
+    ],
+    'storage': [
+        ChoiceRule('type', [
+            ('NVMe SSD', _keywords('nvme', 'm.2')),
+            ('SATA SSD', [('ssd', 'sata')]),
+            ('SSD', _keywords('ssd')),
+            ('HDD', _keywords('hdd')),
+        ]),
+        RegexRule('capacity', [(r'(\d+)\s*tb', 'tb'), (r'(\d+)tb', 'tb'), (r'(\d+)\s*gb', 'gb'), (r'(\d+)gb', 'gb')],
+                  lambda m: m.group(1) + ('TB' if 'tb' in m.group(0) else 'GB')),
+    ],
+    'case': [
+        ChoiceRule('formFactor', [
+            ('E-ATX', _keywords('e-atx', 'eatx')),
+            ('ATX', _keywords('atx')),
+            ('Micro-ATX', _keywords('micro-atx', 'matx')),
+            ('Mini-ITX', _keywords('mini-itx', 'mitx')),
+        ]),
+    ],
+    'cooler': [
+        ChoiceRule('type', [('簡易水冷', _keywords('簡易水冷', 'aio', '水冷')), ('空冷', _keywords('空冷', 'air'))]),
+    ],
+    'os': [
+        ChoiceRule('edition', [('Pro', _keywords('pro')), ('Home', _keywords('home'))]),
+        ChoiceRule('license', [
+            ('DSP版', _keywords('dsp')),
+            ('パッケージ版', _keywords('パッケージ', 'package')),
+            ('OEM版', _keywords('oem')),
+        ]),
+    ],
+}
+
+
+class SpecExtractor:
+    """ルール表に従って商品名からスペックを抽出する（キーワード照合は1回の走査で行う）
+
+    選択ルールの結果は検出したキーワードの集合だけで決まるため、集合ごとに結果を記憶する。
+    （選択ルールと正規表現ルールは別々の項目を設定する前提）
+    """
+
+    _CHOICE_CACHE_SIZE = 4096
+
+    def __init__(self, rules):
+        self.rules = rules
+        keywords = set()
+        for rule in rules:
+            keywords |= rule.keywords
+        self.matcher = KeywordMatcher(keywords)
+        self._choice_rules = [rule for rule in rules if isinstance(rule, ChoiceRule)]
+        # 選択ルールだけでキーワードも少ないカテゴリ（クーラー・OSなど）は、先頭のルールから直接調べる
+        self._direct = (not any(isinstance(rule, RegexRule) for rule in rules)
+                        and len(self.matcher.keywords) <= _SCAN_KEYWORD_LIMIT)
+        self._choice_cache = {}
+
+    def _choices(self, found):
+        choices = self._choice_cache.get(found)
+        if choices is None:
+            choices = {}
+            for rule in self._choice_rules:
+                rule.apply(None, found, choices)
+            if len(self._choice_cache) >= self._CHOICE_CACHE_SIZE:
+                self._choice_cache.clear()
+            self._choice_cache[found] = choices
+        return choices
+
+    def _apply(self, text, found):
+        choices = self._choices(found) if found else {}
+        specs = {}
+        for rule in self.rules:
+            if isinstance(rule, RegexRule):
+                rule.apply(text, found, specs)
+            elif rule.field in choices and rule.field not in specs:
+                specs[rule.field] = choices[rule.field]
+        return specs
+
+    def extract(self, product_name):
+        text = product_name.lower()
+        if self._direct:
+            specs = {}
+            for rule in self._choice_rules:
+                rule.apply_text(text, specs)
+            return specs
+        return self._apply(text, self.matcher.find(text))
+
+    def extract_batch(self, product_names):
+        # 区切り文字で連結して1回で走査するより、1件ずつ照合する方が速い（bench/bench_specs.py）
+        extract = self.extract
+        return [extract(product_name) for product_name in product_names]
+
+
+SPEC_EXTRACTORS = {category: SpecExtractor(rules) for category, rules in SPEC_RULES.items()}
+
+
+def extract_specs(category, product_name):
+    """カテゴリに応じたスペック情報を抽出"""
+    extractor = SPEC_EXTRACTORS.get(category)
+    if not extractor:
+        return {}
+    return extractor.extract(product_name)
 
-    # TDP情報を抽出
-    tdp_patterns = [
-        r'tdp\s*(\d{2,3})\s*w',
-        r'(\d{2,3})\s*w\s*tdp',
-    ]
-    for pattern in tdp_patterns:
-        match = re.search(pattern, product_lower)
-        if match:
-            specs['tdp'] = match.group(1) + 'W'
-            print(f"  ⚡ 検出したTDP: {specs['tdp']}")
-            break
 
-    # Intel 12th-14th Gen (Alder Lake, Raptor Lake) -> LGA1700
-    if any(cpu in product_lower for cpu in ['12th', '13th', '14th', 'i3-12', 'i3-13', 'i3-14',
-                                               'i5-12', 'i5-13', 'i5-14',
-                                               'i7-12', 'i7-13', 'i7-14',
-                                               'i9-12', 'i9-13', 'i9-14']):
-        specs['socket'] = 'LGA1700'
-
-    # Intel 10th-11th Gen (Comet Lake, Rocket Lake) -> LGA1200
-    elif any(cpu in product_lower for cpu in ['10th', '11th', 'i3-10', 'i3-11',
-                                                'i5-10', 'i5-11',
-                                                'i7-10', 'i7-11',
-                                                'i9-10', 'i9-11']):
-        specs['socket'] = 'LGA1200'
-
-    # AMD Ryzen 7000 series -> AM5
-    elif any(cpu in product_lower for cpu in ['ryzen 7 7', 'ryzen 5 7', 'ryzen 9 7',
-                                                'ryzen 3 7', '7950x', '7900x', '7800x3d',
-                                                '7700x', '7600x', '7600']):
-        specs['socket'] = 'AM5'
-
-    # AMD Ryzen 5000, 3000, 2000, 1000 series -> AM4
-    elif any(cpu in product_lower for cpu in ['ryzen 7 5', 'ryzen 5 5', 'ryzen 9 5',
-                                                'ryzen 7 3', 'ryzen 5 3', 'ryzen 9 3',
-                                                'ryzen 7 2', 'ryzen 5 2',
-                                                'ryzen 7 1', 'ryzen 5 1',
-                                                '5950x', '5900x', '5800x3d', '5800x', '5700x', '5600x', '5600',
-                                                '3950x', '3900x', '3800x', '3700x', '3600x', '3600']):
-        specs['socket'] = 'AM4'
-
-    # AMD Threadripper -> sTRX4 or sTR4
-    elif 'threadripper' in product_lower:
-        if any(model in product_lower for model in ['3990x', '3970x', '3960x']):
-            specs['socket'] = 'sTRX4'
-        else:
-            specs['socket'] = 'sTR4'
+def extract_specs_batch(category, product_names):
+    """複数の商品名からまとめてスペック情報を抽出"""
+    extractor = SPEC_EXTRACTORS.get(category)
+    if not extractor:
+        return [{} for _ in product_names]
+    return extractor.extract_batch(product_names)
 
-    # 商品名に直接ソケット情報が含まれている場合
-    for socket_name, patterns in socket_patterns.items():
-        for pattern in patterns:
-            if pattern.lower() in product_lower:
-                specs['socket'] = socket_name
-                break
 
-    return specs
+def extract_cpu_specs(product_name):
+    """CPUの商品名からソケット情報を抽出"""
+    return extract_specs('cpu', product_name)
 
 
 def extract_psu_specs(product_name):
     """電源ユニットの商品名から容量と認証を抽出"""
-    specs = {}
-    product_lower = product_name.lower()
-
-    # ワット数を抽出（例: 850W, 850ワット, 850watt）
-    import re
-    wattage_patterns = [
-        r'(\d{3,4})\s*w(?:att)?(?:\s|$)',  # 850W, 850watt
-        r'(\d{3,4})\s*ワット',              # 850ワット
-    ]
+    return extract_specs('psu', product_name)
 
-    for pattern in wattage_patterns:
-        match = re.search(pattern, product_lower)
-        if match:
-            specs['wattage'] = match.group(1) + 'W'
-            print(f"  🔋 検出したワット数: {specs['wattage']}")
-            break
 
-    # 80 PLUS認証を抽出
-    certifications = {
-        '80 PLUS Titanium': ['titanium', 'チタン'],
-        '80 PLUS Platinum': ['platinum', 'プラチナ'],
-        '80 PLUS Gold': ['gold', 'ゴールド'],
-        '80 PLUS Silver': ['silver', 'シルバー'],
-        '80 PLUS Bronze': ['bronze', 'ブロンズ'],
-        '80 PLUS Standard': ['80 plus standard', '80plus standard'],
-    }
+def extract_motherboard_specs(product_name):
+    """マザーボードの商品名からスペックを抽出"""
+    return extract_specs('motherboard', product_name)
 
-    for cert_name, keywords in certifications.items():
-        if any(keyword in product_lower for keyword in keywords):
-            specs['certification'] = cert_name
-            print(f"  🏅 検出した認証: {specs['certification']}")
-            break
 
-    # 80 PLUSのみの記載があるか
-    if 'certification' not in specs and '80 plus' in product_lower:
-        specs['certification'] = '80 PLUS'
-        print(f"  🏅 検出した認証: {specs['certification']}")
+def extract_memory_specs(product_name):
+    """メモリの商品名からスペックを抽出"""
+    return extract_specs('memory', product_name)
+
 
-    return specs
+def extract_gpu_specs(product_name):
+    """GPUの商品名からスペックを抽出"""
+    return extract_specs('gpu', product_name)
 
 
-def extract_motherboard_specs(product_name):
-    """マザーボードの商品名からスペックを抽出"""
-    specs = {}
-    product_lower = product_name.lower()
-
-    # ソケット情報
-    socket_patterns = {
-        'LGA1700': ['lga1700', 'lga 1700'],
-        'LGA1200': ['lga1200', 'lga 1200'],
-        'AM5': ['am5', 'socket am5'],
-        'AM4': ['am4', 'socket am4'],
-    }
-    for socket_name, patterns in socket_patterns.items():
-        if any(p in product_lower for p in patterns):
-            specs['socket'] = socket_name
-            print(f"  🔌 検出したソケット: {specs['socket']}")
-            break
+def extract_storage_specs(product_name):
+    """ストレージの商品名からスペックを抽出"""
+    return extract_specs('storage', product_name)
 
-    # チップセット
-    chipsets = ['Z790', 'Z690', 'B760', 'B660', 'H770', 'H670', 'X670E', 'X670', 'B650E', 'B650', 'A620', 'X570', 'B550', 'A520']
-    for chipset in chipsets:
-        if chipset.lower() in product_lower:
-            specs['chipset'] = chipset
-            print(f"  🔧 検出したチップセット: {specs['chipset']}")
-            break
 
-    # フォームファクター
-    form_factors = {
-        'E-ATX': ['e-atx', 'eatx', 'extended atx'],
-        'ATX': ['atx'],
-        'Micro-ATX': ['micro-atx', 'matx', 'micro atx'],
-        'Mini-ITX': ['mini-itx', 'mini itx', 'mitx'],
-    }
-    for ff_name, patterns in form_factors.items():
-        if any(p in product_lower for p in patterns):
-            specs['formFactor'] = ff_name
-            print(f"  📐 検出したフォームファクター: {specs['formFactor']}")
-            break
+def extract_case_specs(product_name):
+    """PCケースの商品名からスペックを抽出"""
+    return extract_specs('case', product_name)
 
-    return specs
 
+def extract_cooler_specs(product_name):
+    """CPUクーラーの商品名からスペックを抽出"""
+    return extract_specs('cooler', product_name)
 
-def extract_memory_specs(product_name):
-    """メモリの商品名からスペックを抽出"""
-    specs = {}
-    product_lower = product_name.lower()
-    import re
-
-    # メモリタイプ
-    if 'ddr5' in product_lower:
-        specs['type'] = 'DDR5'
-    elif 'ddr4' in product_lower:
-        specs['type'] = 'DDR4'
-    if specs.get('type'):
-        print(f"  💾 検出したメモリタイプ: {specs['type']}")
-
-    # メモリ速度
-    speed_patterns = [
-        r'(\d{4,5})\s*mhz',
-        r'ddr[45]-(\d{4,5})',
-    ]
-    for pattern in speed_patterns:
-        match = re.search(pattern, product_lower)
-        if match:
-            specs['speed'] = match.group(1) + 'MHz'
-            print(f"  ⚡ 検出したメモリ速度: {specs['speed']}")
-            break
 
-    # 容量
-    capacity_patterns = [
-        r'(\d+)\s*gb',
-        r'(\d+)gb',
-    ]
-    for pattern in capacity_patterns:
-        matches = re.findall(pattern, product_lower)
-        if matches:
-            total = sum(int(m) for m in matches)
-            specs['capacity'] = f"{total}GB"
-            print(f"  📊 検出したメモリ容量: {specs['capacity']}")
+def extract_os_specs(product_name):
+    """OSの商品名からスペックを抽出"""
+    return extract_specs('os', product_name)
+
+
+# ==========================
+# 🧾 価格.com検索結果ページの解析
+# ==========================
+# BeautifulSoupのパーサー（lxmlをインストールして 'lxml' を指定すると高速）
+KAKAKU_PARSER = os.environ.get('KAKAKU_PARSER', 'html.parser')
+
+# 商品要素のセレクター（上から順に試行）
+ITEM_SELECTORS = [".p-item", "li.item", "[data-item]", ".productlist_item"]
+
+# 商品要素内の価格・商品名・画像のセレクター（上から優先）
+# 各要素は (CSSセレクター, タグ名, クラス名, 必須属性)
+PRICE_SELECTORS = [
+    (".p-item_price", None, 'p-item_price', None),
+    (".item_price", None, 'item_price', None),
+    (".price", None, 'price', None),
+    ("span.priceTxt", 'span', 'priceTxt', None),
+    (".pryen", None, 'pryen', None),
+]
+NAME_SELECTORS = [
+    (".p-item_name", None, 'p-item_name', None),
+    (".item_name", None, 'item_name', None),
+    ("h3", 'h3', None, None),
+    ("a", 'a', None, None),
+    (".productName", None, 'productName', None),
+]
+IMAGE_SELECTORS = [
+    ("img.p-item_image", 'img', 'p-item_image', None),
+    ("img.lazy", 'img', 'lazy', None),
+    ("img[data-original]", 'img', None, 'data-original'),
+    ("img", 'img', None, None),
+]
+_FIELD_SELECTORS = (PRICE_SELECTORS, NAME_SELECTORS, IMAGE_SELECTORS)
+
+
+def parse_price(price):
+    """価格文字列を整数に変換（0円や10億円以上などの異常値は None）"""
+    try:
+        price_num = int(re.sub(r"[^\d]", "", str(price)))
+    except ValueError:
+        return None
+    if 100 <= price_num < 1000000000:
+        return price_num
+    return None
+
+
+def _is_result_item(name, attrs):
+    """商品要素の候補となるタグか（それ以外のヘッダーやサイドバーは木を作らない）"""
+    attrs = attrs or {}
+    classes = attrs.get('class') or ''
+    if isinstance(classes, str):
+        classes = classes.split()
+    return ('p-item' in classes or 'productlist_item' in classes or 'data-item' in attrs
+            or (name == 'li' and 'item' in classes))
+
+
+RESULT_ITEM_STRAINER = SoupStrainer(_is_result_item)
+
+
+def _selector_rank(selectors, tag, classes):
+    for rank, (_, tag_name, class_name, attr) in enumerate(selectors):
+        if tag_name and tag.name != tag_name:
+            continue
+        if class_name and class_name not in classes:
+            continue
+        if attr and not tag.has_attr(attr):
+            continue
+        return rank
+    return None
+
+
+def _extract_item_fields(item):
+    """商品要素を1回だけ走査し、(価格, 商品名, 画像) の要素を返す
+
+    各セレクターを順に select_one() した場合と同じ要素を選ぶ。
+    """
+    return _extract_item_fields_ranked(item)[0]
+
+
+def _extract_item_fields_ranked(item):
+    """_extract_item_fields と同じ要素と、一致したセレクターの順位（見つからなければ None）を返す"""
+    found = [None, None, None]
+    ranks = [len(PRICE_SELECTORS), len(NAME_SELECTORS), len(IMAGE_SELECTORS)]
+
+    for tag in item.descendants:
+        if not isinstance(tag, Tag):
+            continue
+        classes = tag.get('class') or ()
+        for field, selectors in enumerate(_FIELD_SELECTORS):
+            if ranks[field] == 0:
+                continue
+            rank = _selector_rank(selectors, tag, classes)
+            if rank is not None and rank < ranks[field]:
+                ranks[field] = rank
+                found[field] = tag
+        if ranks == [0, 0, 0]:
             break
 
-    return specs
+    return found, [rank if tag is not None else None for rank, tag in zip(ranks, found)]
 
 
-def extract_gpu_specs(product_name):
-    """GPUの商品名からスペックを抽出"""
-    specs = {}
-    product_lower = product_name.lower()
-    import re
-
-    # 消費電力（TDP/TGP）
-    power_patterns = [
-        r'(\d{2,3})\s*w(?:att)?(?:\s|$)',
-        r'tdp\s*(\d{2,3})',
-        r'tgp\s*(\d{2,3})',
-    ]
-    for pattern in power_patterns:
-        match = re.search(pattern, product_lower)
-        if match:
-            specs['power'] = match.group(1) + 'W'
-            print(f"  ⚡ 検出した消費電力: {specs['power']}")
-            break
+def _image_url(img_tag):
+    """画像タグから絶対URLを取り出す（プレースホルダーは空文字）"""
+    if not img_tag:
+        return ""
 
-    return specs
+    # 複数の属性から画像URLを取得
+    image_url = (img_tag.get("data-original") or
+                 img_tag.get("data-src") or
+                 img_tag.get("data-lazy-src") or
+                 img_tag.get("src") or "")
 
+    # 相対URLを絶対URLに変換
+    if image_url and not image_url.startswith("http"):
+        if image_url.startswith("//"):
+            image_url = "https:" + image_url
+        elif image_url.startswith("/"):
+            image_url = "https://kakaku.com" + image_url
 
-def extract_storage_specs(product_name):
-    """ストレージの商品名からスペックを抽出"""
-    specs = {}
-    product_lower = product_name.lower()
-    import re
-
-    # ストレージタイプ
-    if 'nvme' in product_lower or 'm.2' in product_lower:
-        specs['type'] = 'NVMe SSD'
-    elif 'ssd' in product_lower and 'sata' in product_lower:
-        specs['type'] = 'SATA SSD'
-    elif 'ssd' in product_lower:
-        specs['type'] = 'SSD'
-    elif 'hdd' in product_lower:
-        specs['type'] = 'HDD'
-    if specs.get('type'):
-        print(f"  💿 検出したストレージタイプ: {specs['type']}")
-
-    # 容量
-    capacity_patterns = [
-        r'(\d+)\s*tb',
-        r'(\d+)tb',
-        r'(\d+)\s*gb',
-        r'(\d+)gb',
-    ]
-    for pattern in capacity_patterns:
-        match = re.search(pattern, product_lower)
-        if match:
-            capacity = match.group(1)
-            if 'tb' in match.group(0):
-                specs['capacity'] = capacity + 'TB'
-            else:
-                specs['capacity'] = capacity + 'GB'
-            print(f"  📊 検出した容量: {specs['capacity']}")
-            break
+    # 小さいアイコンやプレースホルダー画像を除外
+    if image_url and any(skip in image_url.lower() for skip in ['noimage', 'placeholder', 'loading', '1x1']):
+        logger.debug("  ⚠️ プレースホルダー画像を検出: %s", image_url)
+        image_url = ""
 
-    return specs
+    if not image_url.startswith("http"):
+        return ""
+    return image_url
 
 
-def extract_case_specs(product_name):
-    """PCケースの商品名からスペックを抽出"""
-    specs = {}
-    product_lower = product_name.lower()
-
-    # フォームファクター
-    form_factors = {
-        'E-ATX': ['e-atx', 'eatx'],
-        'ATX': ['atx'],
-        'Micro-ATX': ['micro-atx', 'matx'],
-        'Mini-ITX': ['mini-itx', 'mitx'],
-    }
-    for ff_name, patterns in form_factors.items():
-        if any(p in product_lower for p in patterns):
-            specs['formFactor'] = ff_name
-            print(f"  📐 検出したフォームファクター: {specs['formFactor']}")
-            break
+# ==========================
+# 🧭 セレクターのレイアウトの記憶
+# ==========================
+# 価格.comのサジェストで商品名のリンクを探すセレクター（上から順に試行）
+SUGGEST_SELECTORS = ["div.p-item_name a", "li.item a", "a.ckitanker", "div[class*='item'] a, td.ckitanker a"]
+
+
+class LayoutMemory:
+    """ページの種類ごとに、直近に一致したセレクターの組み合わせ（レイアウト）を覚える
+
+    覚えたレイアウトを先に試し、一致しない場合だけ全セレクターを順に試す。
+    レイアウトが変わった（価格.comのデザイン変更など）場合はログと /metrics に記録する。
+    """
+
+    def __init__(self):
+        self._layouts = {}
+        self._counters = {'fast': 0, 'fallbacks': 0, 'switches': 0}
+        self._lock = threading.Lock()
+
+    def get(self, page):
+        return self._layouts.get(page)
+
+    def snapshot(self):
+        """解析プロセスに渡す、覚えているレイアウトの写し"""
+        with self._lock:
+            return dict(self._layouts)
+
+    def learn(self, page, layout):
+        with self._lock:
+            previous = self._layouts.get(page)
+            if previous == layout:
+                return
+            self._layouts[page] = layout
+            if previous is None:
+                return
+            self._counters['switches'] += 1
+        metrics.inc('pcparts_layout_switches_total', page=page)
+        logger.warning("🔀 価格.comのレイアウトが変わりました（%s）: %s → %s", page, previous, layout)
+
+    def count(self, name, amount=1):
+        if amount:
+            with self._lock:
+                self._counters[name] += amount
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            layouts = dict(self._layouts)
+        stats['layouts'] = {page: _describe_layout(page, layout) for page, layout in layouts.items()}
+        return stats
+
+
+def _describe_layout(page, layout):
+    if page == 'suggestions':
+        return SUGGEST_SELECTORS[layout]
+    item_index, *ranks = layout
+    fields = {'item': ITEM_SELECTORS[item_index]}
+    for name, selectors, rank in zip(('price', 'name', 'image'), _FIELD_SELECTORS, ranks):
+        fields[name] = selectors[rank][0] if rank is not None else None
+    return fields
+
+
+layout_memory = LayoutMemory()
+
+
+def _select_first(soup, selectors, remembered):
+    """覚えているセレクターを先に試し、なければ上から順に試す。(一致した要素, セレクターの番号) を返す"""
+    if remembered is not None:
+        found = soup.select(selectors[remembered])
+        if found:
+            return found, remembered
+    for index, selector in enumerate(selectors):
+        if index == remembered:
+            continue
+        found = soup.select(selector)
+        if found:
+            return found, index
+    return [], None
+
+
+def _compile_field_matchers(ranks):
+    """覚えている順位のセレクターだけを (フィールド, タグ名, クラス名, 必須属性) の一覧にする"""
+    return [(field, *_FIELD_SELECTORS[field][rank][1:])
+            for field, rank in enumerate(ranks) if rank is not None]
+
+
+def _extract_item_fields_fast(item, matchers):
+    """覚えているセレクターだけで商品要素を1回走査する。どれかが見つからなければ None"""
+    found = [None, None, None]
+    remaining = len(matchers)
+    for tag in item.descendants:
+        if not isinstance(tag, Tag):
+            continue
+        classes = tag.get('class') or ()
+        for field, tag_name, class_name, attr in matchers:
+            if found[field] is not None:
+                continue
+            if tag_name and tag.name != tag_name:
+                continue
+            if class_name and class_name not in classes:
+                continue
+            if attr and not tag.has_attr(attr):
+                continue
+            found[field] = tag
+            remaining -= 1
+        if not remaining:
+            return found
+    return None
+
+
+def _learn_offer_layout(item_index, rank_votes):
+    """全セレクターで取り出した商品の、フィールドごとに最も多く一致した順位をレイアウトとして覚える"""
+    ranks = [max(votes, key=votes.get) if votes else None for votes in rank_votes]
+    layout_memory.learn('offers', (item_index, *ranks))
+
+
+def parse_kakaku_offers(html, product_name=''):
+    """検索結果ページから有効な価格の商品を取り出し、安い順に返す
+
+    商品一覧の部分だけを木にし、各商品から価格・商品名・画像を1回の走査で取り出す。
+    前回一致したレイアウト（layout_memory）のセレクターだけを先に試し、見つからない商品だけ全セレクターで探す。
+    木は返す前に破棄する。
+    """
+    with timed('parse'):
+        soup = BeautifulSoup(html, KAKAKU_PARSER, parse_only=RESULT_ITEM_STRAINER)
+    try:
+        with timed('select'):
+            # 全商品を取得して最安値を探す
+            layout = layout_memory.get('offers')
+            items, item_index = _select_first(soup, ITEM_SELECTORS, layout[0] if layout else None)
+
+            if not items:
+                logger.debug("❌ 商品要素が見つかりません")
+                return []
+
+            logger.debug("📦 %d件の商品が見つかりました", len(items))
+
+            matchers = _compile_field_matchers(layout[1:]) if layout and layout[0] == item_index else None
+            rank_votes = [{}, {}, {}]
+            fallbacks = 0
+            offers = []
+            for idx, item in enumerate(items):
+                fields = _extract_item_fields_fast(item, matchers) if matchers else None
+                if fields is None:
+                    fields, ranks = _extract_item_fields_ranked(item)
+                    fallbacks += 1
+                    for votes, rank in zip(rank_votes, ranks):
+                        if rank is not None:
+                            votes[rank] = votes.get(rank, 0) + 1
+                price_elem, name_elem, img_tag = fields
+                if not price_elem:
+                    continue
 
-    return specs
+                price_num = parse_price(price_elem.get_text(strip=True))
+                if price_num is None:
+                    continue
 
+                offers.append({
+                    'price': price_num,
+                    'name': name_elem.get_text(strip=True) if name_elem else product_name,
+                    'image': _image_url(img_tag),
+                    'index': idx,
+                })
 
-def extract_cooler_specs(product_name):
-    """CPUクーラーの商品名からスペックを抽出"""
-    specs = {}
-    product_lower = product_name.lower()
+            if matchers is None or fallbacks * 2 > len(items):
+                # 覚えたレイアウトがない・半数以上の商品で一致しなかった場合は覚え直す
+                _learn_offer_layout(item_index, rank_votes)
+            if matchers is not None:
+                layout_memory.count('fast', len(items) - fallbacks)
+                layout_memory.count('fallbacks', fallbacks)
 
-    # クーラータイプ
-    if '簡易水冷' in product_lower or 'aio' in product_lower or '水冷' in product_lower:
-        specs['type'] = '簡易水冷'
-    elif '空冷' in product_lower or 'air' in product_lower:
-        specs['type'] = '空冷'
-    if specs.get('type'):
-        print(f"  ❄️ 検出したクーラータイプ: {specs['type']}")
+            # 価格順にソート
+            offers.sort(key=lambda offer: offer['price'])
+            return offers
+    finally:
+        soup.decompose()
 
-    return specs
 
+# ==========================
+# 🌊 検索結果の途中までの受信（ストリーミング）
+# ==========================
+# 商品要素が揃った時点で受信を打ち切る（0 で常に全体を受信）
+STREAM_ENABLED = os.environ.get('STREAM_ENABLED', '1') != '0'
+# 1ページあたりの受信の上限バイト数
+STREAM_MAX_BYTES = int(os.environ.get('STREAM_MAX_BYTES', 2 * 1024 * 1024))
+STREAM_CHUNK_BYTES = int(os.environ.get('STREAM_CHUNK_BYTES', 16384))
+# 受信する商品要素の数（価格.comは価格の安い順に並べて取得する / サジェストは先頭10件だけ使う）
+KAKAKU_STREAM_ITEMS = int(os.environ.get('KAKAKU_STREAM_ITEMS', 20))
+SUGGEST_STREAM_ITEMS = 10
+
+# 開始タグと class 属性（タグ構造は ASCII なので、文字コードを決める前のバイト列のまま探す）
+_START_TAG_RE = re.compile(rb'<([A-Za-z][A-Za-z0-9]*)(\s[^>]*)?>')
+_CLASS_ATTR_RE = re.compile(rb'\bclass\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+))', re.I)
+_DATA_ITEM_ATTR_RE = re.compile(rb'\bdata-item\b', re.I)
+
+
+def _item_kind(tag, attrs):
+    """商品要素の開始タグなら ITEM_SELECTORS の何番目に当たるかを返す（該当しなければ None）"""
+    match = _CLASS_ATTR_RE.search(attrs)
+    classes = b''.join(group for group in match.groups() if group).split() if match else []
+    if b'p-item' in classes:
+        return 0
+    if tag.lower() == b'li' and b'item' in classes:
+        return 1
+    if _DATA_ITEM_ATTR_RE.search(attrs):
+        return 2
+    if b'productlist_item' in classes:
+        return 3
+    return None
+
+
+class ResultItemScanner:
+    """受信済みの本文から商品要素の開始タグを数え、max_items 件を受信し終えた位置を返す
+
+    parse_kakaku_offers と同じく、見つかった中で ITEM_SELECTORS の最も前のセレクターの要素を数える。
+    max_items + 1 件目の開始タグの位置で切れば、max_items 件目までの要素は欠けずに含まれる。
+    """
+
+    def __init__(self, max_items):
+        self.max_items = max_items
+        self.counts = [0] * len(ITEM_SELECTORS)
+        self.last_start = [None] * len(ITEM_SELECTORS)
+        self.pos = 0
+
+    def _best_kind(self):
+        for kind, count in enumerate(self.counts):
+            if count:
+                return kind
+        return None
+
+    def feed(self, buffer):
+        """追加受信後の本文全体を渡す。max_items 件揃っていれば切る位置を返す"""
+        end = len(buffer)
+        # 受信途中のタグは次回に回す
+        open_tag = buffer.rfind(b'<', self.pos)
+        if open_tag != -1 and buffer.find(b'>', open_tag) == -1:
+            end = open_tag
+        for match in _START_TAG_RE.finditer(buffer, self.pos, end):
+            attrs = match.group(2)
+            if not attrs or b'item' not in attrs:
+                continue
+            kind = _item_kind(match.group(1), attrs)
+            if kind is None:
+                continue
+            self.counts[kind] += 1
+            self.last_start[kind] = match.start()
+            if kind == self._best_kind() and self.counts[kind] > self.max_items:
+                return match.start()
+        self.pos = end
+        return None
+
+    def complete_prefix(self):
+        """受信途中で打ち切る場合に、欠けているかもしれない最後の商品要素より前で切る位置"""
+        kind = self._best_kind()
+        return self.last_start[kind] if kind is not None else None
+
+    def complete_items(self):
+        """受信し終えた（次の商品要素が始まっている）商品要素の数"""
+        kind = self._best_kind()
+        return self.counts[kind] - 1 if kind is not None else 0
+
+
+class StreamingReader:
+    """本文を少しずつ受信し、商品要素が揃うか上限バイト数に達したら受信を打ち切る"""
+
+    def __init__(self, enabled, max_bytes, chunk_bytes):
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+        self.chunk_bytes = chunk_bytes
+        self._counters = {'streams': 0, 'early_stops': 0, 'capped': 0, 'bytes_read': 0, 'bytes_kept': 0}
+        self._lock = threading.Lock()
+
+    def reader(self, max_items, on_prefix=None):
+        """http_get_async(reader=...) に渡す読み方（無効なら None で全体を受信）
+
+        on_prefix を指定すると、最初の商品要素を受信し終えた時点で、そこまでの本文を
+        レスポンス（requests.Response）にして1回だけ渡す（逐次検索で最安値を先に送るため）。
+        """
+        if not self.enabled:
+            return None
+        return functools.partial(self.read, max_items=max_items, on_prefix=on_prefix)
+
+    async def read(self, response, max_items, on_prefix=None):
+        scanner = ResultItemScanner(max_items)
+        buffer = bytearray()
+        cut = None
+        capped = False
+        async for chunk in response.content.iter_chunked(self.chunk_bytes):
+            buffer += chunk
+            cut = scanner.feed(buffer)
+            if cut is None and len(buffer) >= self.max_bytes:
+                cut = scanner.complete_prefix() or self.max_bytes
+                capped = True
+            if cut is not None:
+                break
+            if on_prefix is not None and response.status == 200 and scanner.complete_items():
+                on_prefix(_build_response(str(response.url), response.status, response.headers,
+                                          bytes(buffer[:scanner.complete_prefix()])))
+                on_prefix = None
 
-def extract_os_specs(product_name):
-    """OSの商品名からスペックを抽出"""
-    specs = {}
-    product_lower = product_name.lower()
+        bytes_read = len(buffer)
+        if cut is not None:
+            # 残りは受信しない（接続は再利用せずに閉じる）
+            response.close()
+            del buffer[cut:]
+        with self._lock:
+            self._counters['streams'] += 1
+            self._counters['early_stops'] += cut is not None and not capped
+            self._counters['capped'] += capped
+            self._counters['bytes_read'] += bytes_read
+            self._counters['bytes_kept'] += len(buffer)
+        return bytes(buffer)
 
-    # エディション
-    if 'pro' in product_lower:
-        specs['edition'] = 'Pro'
-    elif 'home' in product_lower:
-        specs['edition'] = 'Home'
-    if specs.get('edition'):
-        print(f"  🏷️ 検出したエディション: {specs['edition']}")
+    def stats(self):
+        with self._lock:
+            return dict(self._counters)
 
-    # ライセンスタイプ
-    if 'dsp' in product_lower:
-        specs['license'] = 'DSP版'
-    elif 'パッケージ' in product_lower or 'package' in product_lower:
-        specs['license'] = 'パッケージ版'
-    elif 'oem' in product_lower:
-        specs['license'] = 'OEM版'
-    if specs.get('license'):
-        print(f"  📜 検出したライセンス: {specs['license']}")
 
-    return specs
+stream_reader = StreamingReader(STREAM_ENABLED, STREAM_MAX_BYTES, STREAM_CHUNK_BYTES)
+
+
+# ==========================
+# ⚙️ 解析のプロセスプール
+# ==========================
+# HTMLを解析するプロセス数（0 でプロセスを使わずスレッドで解析。既定は CPU数-1、最大4）
+PARSE_PROCESSES = int(os.environ.get('PARSE_PROCESSES', min(4, max(0, (os.cpu_count() or 1) - 1))))
+# これより小さいページはプロセス間の受け渡しの方が高くつくためスレッドで解析する
+PARSE_POOL_MIN_BYTES = int(os.environ.get('PARSE_POOL_MIN_BYTES', 32768))
+# プロセスに渡して解析中・待機中のページ数の上限（超えた分はスレッドで解析する）
+PARSE_QUEUE_MAX = int(os.environ.get('PARSE_QUEUE_MAX', max(1, PARSE_PROCESSES) * 4))
+
+
+class _RecordingMetrics:
+    """解析プロセス内の計測を記録し、結果と一緒に親プロセスへ返す"""
+
+    def __init__(self):
+        self._records = []
+
+    def observe(self, name, seconds, **labels):
+        self._records.append(('observe', name, seconds, labels))
+
+    def inc(self, name, amount=1, **labels):
+        self._records.append(('inc', name, amount, labels))
+
+    def drain(self):
+        records, self._records = self._records, []
+        return records
+
+
+class _RecordingLayoutMemory:
+    """解析プロセス内で親プロセスの覚えたレイアウトを使い、覚え直し・件数を記録して親プロセスへ返す
+
+    レイアウトの記憶・切り替わりの警告・/api/stats の値は親プロセスの layout_memory だけが持つ。
+    """
+
+    def __init__(self):
+        self._layouts = {}
+        self._records = []
+
+    def reset(self, layouts):
+        self._layouts = dict(layouts)
+        self._records = []
+
+    def get(self, page):
+        return self._layouts.get(page)
+
+    def learn(self, page, layout):
+        self._layouts[page] = layout
+        self._records.append(('learn', page, layout))
+
+    def count(self, name, amount=1):
+        if amount:
+            self._records.append(('count', name, amount))
+
+    def drain(self):
+        records, self._records = self._records, []
+        return records
+
+
+def _init_parse_process():
+    """解析プロセスの初期化（計測とレイアウトの記憶を、親プロセスへ返す記録に置き換える）"""
+    global metrics, layout_memory
+    metrics = _RecordingMetrics()
+    layout_memory = _RecordingLayoutMemory()
+
+
+def _parse_in_process(parse, body, encoding, source, layouts, args):
+    """解析プロセスで本文をデコードして parse(html, *args) を実行し、(結果, 計測の記録, レイアウトの記録) を返す"""
+    _metric_source.set(source)
+    metrics.drain()
+    layout_memory.reset(layouts)
+    result = parse(body.decode(encoding, errors='replace'), *args)
+    return result, metrics.drain(), layout_memory.drain()
+
+
+class ParsePool:
+    """CPUを使うHTML解析を別プロセスで行い、GILを持ったまま他のリクエストを止めないようにする
+
+    文字コードは親プロセスで決め（ホストごとの前回値を共有するため）、本文のバイト列・解析関数・覚えたレイアウトを渡して
+    抽出結果と計測・レイアウトの記録を受け取る。小さいページと、処理中が queue_max 件に達している間はスレッドで解析する。
+    解析プロセスは forkserver（なければ spawn）で起動し、スレッドが動いているプロセスを fork しない。
+    """
+
+    def __init__(self, processes, min_bytes, queue_max):
+        self.processes = processes
+        self.min_bytes = min_bytes
+        self.queue_max = queue_max
+        self._executor = None
+        self._pid = None
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._counters = {'process': 0, 'thread_small': 0, 'thread_overflow': 0, 'failures': 0}
+
+    def _get_executor(self):
+        pid = os.getpid()
+        with self._lock:
+            if self._pid != pid:
+                # gunicorn のワーカーごとに作る（親のプールは子プロセスでは使えない）
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.processes, mp_context=context, initializer=_init_parse_process)
+                self._pid = pid
+            return self._executor
+
+    def _reserve(self):
+        with self._lock:
+            if self._in_flight >= self.queue_max:
+                return False
+            self._in_flight += 1
+            return True
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    async def parse(self, res, parse, *args):
+        """_parse_response(res, parse, *args) と同じ結果を返す"""
+        if self.processes <= 0 or len(res.content) < self.min_bytes:
+            self._count('thread_small')
+            return await asyncio.to_thread(_parse_response, res, parse, *args)
+        if not self._reserve():
+            self._count('thread_overflow')
+            return await asyncio.to_thread(_parse_response, res, parse, *args)
+
+        try:
+            with timed('encoding'):
+                encoding = encoding_resolver.resolve(res)
+            future = self._get_executor().submit(
+                _parse_in_process, parse, res.content, encoding, current_source(), layout_memory.snapshot(), args)
+            result, records, layout_records = await asyncio.wrap_future(future)
+        except BrokenProcessPool as e:
+            # 解析プロセスが落ちた場合は作り直し、このページはスレッドで解析する
+            logger.warning("❌ 解析プロセスが停止しました: %s", e)
+            self._count('failures')
+            with self._lock:
+                self._pid = None
+            return await asyncio.to_thread(_parse_response, res, parse, *args)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+        self._count('process')
+        for kind, name, value, labels in records:
+            getattr(metrics, kind)(name, value, **labels)
+        for kind, name, value in layout_records:
+            getattr(layout_memory, kind)(name, value)
+        return result
+
+    def close(self):
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['in_flight'] = self._in_flight
+        stats['processes'] = self.processes
+        return stats
+
+
+parse_pool = ParsePool(PARSE_PROCESSES, PARSE_POOL_MIN_BYTES, PARSE_QUEUE_MAX)
+atexit.register(parse_pool.close)
+
+
+async def parse_response_async(res, parse, *args):
+    """レスポンスを parse(html, *args) で解析する（大きいページは解析プロセス、それ以外はスレッド）
+
+    parse は解析プロセスにも渡せるようモジュールの関数にし、結果は小さい値（辞書・リスト）にすること。
+    """
+    return await parse_pool.parse(res, parse, *args)
 
 
 # ==========================
 # 🔍 各サイトのスクレイピング関数
 # ==========================
 
-def search_kakaku(product_name, category=''):
-    """価格.comから最安値を取得（精度向上版）"""
+@coalesce_upstream('kakaku')
+async def search_kakaku_offers_async(product_name, category='', timeout=15, on_prefix=None):
+    """価格.comの検索結果から価格の安い順に商品を取得（該当する商品がなければ空のリスト）
+
+    送信の見送り・ブレーカーの遮断・タイムアウト・5xx などで結果を得られなかった場合は、
+    「商品なし」と区別できるよう UpstreamUnavailable を送出する。
+    on_prefix は StreamingReader.reader と同じ（同時リクエストをまとめた場合は最初の呼び出しのものだけ使う）。
+    """
     try:
         # カテゴリに応じて検索クエリを最適化
         search_query = optimize_search_query(product_name, category)
-        print(f"🔎 価格.comで検索中: {search_query} (カテゴリ: {category})")
+        logger.debug("🔎 価格.comで検索中: %s (カテゴリ: %s)", search_query, category)
 
         # 正しいURL形式に修正（価格順にソート）
         # URLエンコーディングを正しく行う
         search_term = quote(search_query, safe='')
 
         # シンプルな検索URL（ソート指定のみ）
-        url = f"https://kakaku.com/search_results/{search_term}/?sort=price_asc"
-        print(f"🔗 検索URL: {url}")
-
-        print(f"⏳ 価格.comにリクエスト送信中...")
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
-            "Accept-Language": "ja,en-US;q=0.7,en;q=0.3",
-            "Accept-Encoding": "gzip, deflate, br",
-            "Connection": "keep-alive",
-            "Upgrade-Insecure-Requests": "1"
-        }
-        res = requests.get(url, headers=headers, timeout=15)
-        print(f"✅ レスポンス受信完了")
-
-        # レスポンスの文字コードを明示的に設定
-        res.encoding = res.apparent_encoding or 'utf-8'
-
-        print(f"📄 HTTPステータス: {res.status_code}")
-        print(f"📝 文字コード: {res.encoding}")
-        print(f"⏳ HTMLを解析中...")
-
-        soup = BeautifulSoup(res.text, "html.parser")
-        print(f"✅ HTML解析完了")
-
-        # 全商品を取得して最安値を探す
-        print(f"🔍 商品要素を検索中...")
-        items = soup.select(".p-item")
-        if not items:
-            print(f"  ⏳ .p-itemが見つからず、li.itemを試行中...")
-            items = soup.select("li.item")
-        if not items:
-            print(f"  ⏳ li.itemが見つからず、[data-item]を試行中...")
-            items = soup.select("[data-item]")
-        if not items:
-            print(f"  ⏳ [data-item]が見つからず、.productlist_itemを試行中...")
-            items = soup.select(".productlist_item")
-
-        if not items:
-            print("❌ 商品要素が見つかりません")
-            print(f"📝 検索URL: {url}")
-            # HTMLの一部を出力（デバッグ用）
-            print(f"📝 HTML冒頭: {str(soup)[:500]}")
-            return {}
-
-        print(f"📦 {len(items)}件の商品が見つかりました")
-        print(f"⏳ 各商品の価格を解析中...")
-
-        # 価格と商品のリストを作成
-        price_list = []
-
-        for idx, item in enumerate(items):
-            # 価格の取得（複数パターン試行）
-            price_elem = item.select_one(".p-item_price")
-            if not price_elem:
-                price_elem = item.select_one(".item_price")
-            if not price_elem:
-                price_elem = item.select_one(".price")
-            if not price_elem:
-                price_elem = item.select_one("span.priceTxt")
-            if not price_elem:
-                price_elem = item.select_one(".pryen")
-
-            if price_elem:
-                try:
-                    price_text = price_elem.get_text(strip=True)
-                    # 数字以外を除去して価格を抽出
-                    price_num = int(re.sub(r"[^\d]", "", price_text))
-
-                    # 異常値をフィルタリング（0円、または10億円以上は除外）
-                    if 100 <= price_num < 1000000000:
-                        price_list.append({
-                            'price': price_num,
-                            'item': item,
-                            'index': idx
-                        })
-                        print(f"  📊 [{idx}] 価格: ¥{price_num:,}")
-                except (ValueError, AttributeError) as e:
-                    print(f"   [{idx}] 価格解析失敗: {e}")
-                    continue
+        url = f"{KAKAKU_BASE_URL}/search_results/{search_term}/?sort=price_asc"
+        logger.debug("🔗 検索URL: %s", url)
+
+        logger.debug("⏳ 価格.comにリクエスト送信中...")
+        res = await http_get_async(url, timeout=timeout,
+                                   reader=stream_reader.reader(KAKAKU_STREAM_ITEMS, on_prefix))
+        logger.debug("✅ レスポンス受信完了")
+        if res.status_code >= 500 or res.status_code == 429:
+            raise UpstreamUnavailable(f'価格.com: HTTP {res.status_code}')
+
+        # 解析はイベントループを止めないよう別スレッド・別プロセスで行う
+        return await parse_response_async(res, parse_kakaku_offers, product_name)
+    except UpstreamUnavailable as e:
+        logger.warning("⏳ 価格.comへの取得を見送りました: %s", e)
+        raise
+    except Exception as e:
+        logger.warning("❌ 価格.com取得失敗: %s", e, exc_info=True)
+        raise UpstreamUnavailable(f'価格.com: {e!r}') from e
 
-        if not price_list:
-            print("❌ 有効な価格が見つかりません")
-            return {}
-
-        print(f"✅ {len(price_list)}件の有効な価格を検出")
-        print(f"⏳ 価格をソート中...")
-
-        # 価格順にソート
-        price_list.sort(key=lambda x: x['price'])
-
-        # 最安値の商品を取得
-        best_item_data = price_list[0]
-        best_item = best_item_data['item']
-        min_price = best_item_data['price']
-
-        print(f"🏆 最安値商品インデックス: {best_item_data['index']}")
-        print(f"⏳ 商品情報を抽出中...")
-
-        # 商品名の取得（複数パターン試行）
-        name = ""
-        name_elem = best_item.select_one(".p-item_name")
-        if not name_elem:
-            name_elem = best_item.select_one(".item_name")
-        if not name_elem:
-            name_elem = best_item.select_one("h3")
-        if not name_elem:
-            name_elem = best_item.select_one("a")
-        if not name_elem:
-            name_elem = best_item.select_one(".productName")
-
-        if name_elem:
-            name = name_elem.get_text(strip=True)
-        else:
-            # 商品名が見つからない場合は、検索クエリを使用
-            name = product_name
 
-        # 画像URLを取得（複数パターン試行）
-        image_url = ""
-        print(f"🔍 画像URLを検索中...")
-
-        # 複数の画像タグパターンを試行
-        img_tag = best_item.select_one("img.p-item_image")
-        if not img_tag:
-            img_tag = best_item.select_one("img.lazy")
-        if not img_tag:
-            img_tag = best_item.select_one("img[data-original]")
-        if not img_tag:
-            img_tag = best_item.select_one("img")
-
-        if img_tag:
-            # 複数の属性から画像URLを取得
-            image_url = (img_tag.get("data-original") or
-                        img_tag.get("data-src") or
-                        img_tag.get("data-lazy-src") or
-                        img_tag.get("src") or "")
-
-            # 相対URLを絶対URLに変換
-            if image_url and not image_url.startswith("http"):
-                if image_url.startswith("//"):
-                    image_url = "https:" + image_url
-                elif image_url.startswith("/"):
-                    image_url = "https://kakaku.com" + image_url
-
-            # 小さいアイコンやプレースホルダー画像を除外
-            if image_url and any(skip in image_url.lower() for skip in ['noimage', 'placeholder', 'loading', '1x1']):
-                print(f"  ⚠️ プレースホルダー画像を検出: {image_url}")
-                image_url = ""
-
-        # 画像が見つからなかった場合は"No image"
-        if not image_url or not image_url.startswith("http"):
-            print("⚠️ 価格.comで画像が見つかりませんでした")
-            image_url = "No image"
-        else:
-            print(f"✅ 価格.comから画像取得: {image_url[:60]}...")
+async def search_kakaku_async(product_name, category='', timeout=15):
+    """価格.comから最安値を取得（精度向上版）"""
+    offers = await search_kakaku_offers_async(product_name, category, timeout)
+    # サジェスト索引に商品名を登録（カタログの巡回と同じく最安値以外の商品も）
+    suggestion_index.add_many(category, [offer['name'] for offer in offers[:KAKAKU_OFFERS_MAX]])
+    return _kakaku_result(offers, product_name, category)
 
-        # 型番を商品名から抽出（商品名全体を型番として使用）
-        model_number = name
 
-        # CPUの場合はソケット情報を抽出
-        result = {
-            "price": str(min_price),
-            "product": name,
-            "source": "価格.com（最安値）",
-            "image": image_url,
-            "model_number": model_number
-        }
+def search_kakaku(product_name, category='', timeout=15):
+    """search_kakaku_async の同期版"""
+    return async_upstream.run(search_kakaku_async(product_name, category, timeout))
 
-        # カテゴリ別のスペック情報を抽出
-        print(f"🔍 スペック情報を抽出中...")
 
-        if category == 'cpu':
-            cpu_specs = extract_cpu_specs(name)
-            result.update(cpu_specs)
+def _parse_response(res, parse, *args):
+    """レスポンスの文字コードを決めて本文を parse(html, *args) に渡す"""
+    # レスポンスの文字コードを明示的に設定
+    with timed('encoding'):
+        res.encoding = encoding_resolver.resolve(res)
+        html = res.text
 
-        elif category == 'motherboard':
-            mb_specs = extract_motherboard_specs(name)
-            result.update(mb_specs)
+    logger.debug("📄 HTTPステータス: %s", res.status_code)
+    logger.debug("📝 文字コード: %s", res.encoding)
+    logger.debug("⏳ HTMLを解析中...")
+    return parse(html, *args)
 
-        elif category == 'memory':
-            mem_specs = extract_memory_specs(name)
-            result.update(mem_specs)
 
-        elif category == 'gpu':
-            gpu_specs = extract_gpu_specs(name)
-            result.update(gpu_specs)
+# 価格.comの結果の取得元の表示名
+KAKAKU_SOURCE = "価格.com（最安値）"
+# 1回の検索結果からキャッシュに残す商品数（安い順）と、/api/search が返す商品数の既定値
+KAKAKU_OFFERS_MAX = max(1, int(os.environ.get('KAKAKU_OFFERS_MAX', 20)))
+SEARCH_OFFERS = int(os.environ.get('SEARCH_OFFERS', 5))
+# 商品一覧（offers）の各商品以外の、結果の項目（残りはスペック）
+_RESULT_FIELDS = ('price', 'product', 'source', 'image', 'model_number', 'offers', 'offersTotal', 'sources',
+                  'timings')
 
-        elif category == 'storage':
-            storage_specs = extract_storage_specs(name)
-            result.update(storage_specs)
 
-        elif category == 'psu':
-            psu_specs = extract_psu_specs(name)
-            result.update(psu_specs)
+def _kakaku_result(offers, product_name, category):
+    """parse_kakaku_offers の結果から最安値の商品の結果を作る（見つからなければ空）
 
-        elif category == 'case':
-            case_specs = extract_case_specs(name)
-            result.update(case_specs)
+    サジェスト索引への登録は呼び出し側で行う（結果を作るだけで、ほかの状態は変えない）。
+    """
+    if not offers:
+        logger.info("❌ 有効な価格が見つかりません: %s (%s)", product_name, category)
+        return {}
 
-        elif category == 'cooler':
-            cooler_specs = extract_cooler_specs(name)
-            result.update(cooler_specs)
+    logger.debug("✅ %d件の有効な価格を検出", len(offers))
 
-        elif category == 'os':
-            os_specs = extract_os_specs(name)
-            result.update(os_specs)
+    # 最安値の商品を取得
+    best = offers[0]
+    name = best['name']
+    min_price = best['price']
+    image_url = best['image']
 
-        print(f"✅ 商品名: {name}")
-        print(f"✅ 最安値: ¥{min_price:,}円")
-        print(f"🖼️ 画像URL: {image_url[:50]}..." if image_url else "🖼️ 画像URL: なし")
-        print(f"🎉 価格.comからの取得完了！")
+    logger.debug("🏆 最安値商品インデックス: %d", best['index'])
 
-        return result
-    except Exception as e:
-        print("❌ 価格.com取得失敗:", e)
-        import traceback
-        traceback.print_exc()
-        return {}
+    # 画像が見つからなかった場合は"No image"
+    if not image_url:
+        logger.debug("⚠️ 価格.comで画像が見つかりませんでした")
+        image_url = "No image"
+    else:
+        logger.debug("✅ 価格.comから画像取得: %s...", image_url[:60])
 
-def search_rakuten(product_name, category=''):
+    # 型番を商品名から抽出（商品名全体を型番として使用）
+    model_number = name
+
+    result = {
+        "price": str(min_price),
+        "product": name,
+        "source": KAKAKU_SOURCE,
+        "image": image_url,
+        "model_number": model_number
+    }
+
+    # カテゴリ別のスペック情報を抽出（最安値以外の商品もまとめて抽出し、候補の一覧として残す）
+    logger.debug("🔍 スペック情報を抽出中...")
+
+    offers = offers[:KAKAKU_OFFERS_MAX]
+    with timed('specs'):
+        specs = extract_specs_batch(category, [offer['name'] for offer in offers])
+    result.update(specs[0])
+    result['offers'] = [
+        dict(offer_specs, name=offer['name'], price=offer['price'], image=offer['image'] or "No image")
+        for offer, offer_specs in zip(offers, specs)
+    ]
+
+    logger.debug("✅ 商品名: %s", name)
+    logger.debug("✅ 最安値: ¥%s円", f"{min_price:,}")
+    logger.debug("🖼️ 画像URL: %s...", image_url[:50])
+    logger.debug("🎉 価格.comからの取得完了！")
+
+    return result
+
+
+def result_offers(result):
+    """検索結果の商品一覧（安い順）を返す
+
+    商品一覧を持たない結果（一覧を残す前にキャッシュした値など）は最安値の商品だけの一覧にする。
+    """
+    if 'offers' in result:
+        return result['offers']
+    if not result.get('price'):
+        return []
+    offer = {field: value for field, value in result.items() if field not in _RESULT_FIELDS}
+    offer.update(name=result['product'], price=parse_price(result['price']), image=result.get('image', "No image"))
+    return [offer]
+
+
+def page_offers(result, offset=0, limit=SEARCH_OFFERS):
+    """検索結果の商品一覧を offset 件目から limit 件に絞った結果を返す（キャッシュの値は変更しない）"""
+    offers = result_offers(result)
+    return dict(result, offers=offers[offset:offset + limit], offersTotal=len(offers))
+
+
+@coalesce_upstream('rakuten')
+async def search_rakuten_async(product_name, category='', timeout=10):
     """楽天市場から価格を取得"""
     try:
         search_query = optimize_search_query(product_name, category)
-        print(f" 楽天で検索中: {search_query}")
-        url = f"https://search.rakuten.co.jp/search/mall/{search_query.replace(' ', '+')}/"
-        headers = {"User-Agent": "Mozilla/5.0"}
-        res = requests.get(url, headers=headers, timeout=10)
-        soup = BeautifulSoup(res.text, "html.parser")
+        logger.debug(" 楽天で検索中: %s", search_query)
+        url = f"{RAKUTEN_BASE_URL}/search/mall/{search_query.replace(' ', '+')}/"
+        res = await http_get_async(url, timeout=timeout)
+        return await parse_response_async(res, parse_rakuten_offer)
+    except Exception as e:
+        logger.warning(" 楽天取得失敗: %s", e)
+        return {}
 
-        item = soup.select_one(".searchresultitem")
-        if not item:
-            return {}
 
-        name = item.select_one(".title").get_text(strip=True)
-        price_text = item.select_one(".important").get_text(strip=True)
-        price = re.sub(r"[^\d]", "", price_text)
+def search_rakuten(product_name, category='', timeout=10):
+    """search_rakuten_async の同期版"""
+    return async_upstream.run(search_rakuten_async(product_name, category, timeout))
 
-        # 画像URLを取得
-        image_url = ""
-        img_tag = item.select_one("img")
-        if img_tag and img_tag.get("src"):
-            image_url = img_tag.get("src")
-
-        # 型番を商品名から抽出
-        model_number = name
-
-        return {
-            "price": price,
-            "product": name,
-            "source": "楽天市場",
-            "image": image_url,
-            "model_number": model_number
-        }
-    except Exception as e:
-        print(" 楽天取得失敗:", e)
+
+def parse_rakuten_offer(html):
+    """楽天市場の検索結果ページから先頭の商品を取り出す（見つからなければ空）"""
+    with timed('parse'):
+        soup = BeautifulSoup(html, "html.parser")
+
+    item = soup.select_one(".searchresultitem")
+    if not item:
         return {}
 
-def search_amazon(product_name, category=''):
+    name = item.select_one(".title").get_text(strip=True)
+    price_text = item.select_one(".important").get_text(strip=True)
+    price = re.sub(r"[^\d]", "", price_text)
+
+    # 画像URLを取得
+    image_url = ""
+    img_tag = item.select_one("img")
+    if img_tag and img_tag.get("src"):
+        image_url = img_tag.get("src")
+
+    # 型番を商品名から抽出
+    model_number = name
+
+    return {
+        "price": price,
+        "product": name,
+        "source": "楽天市場",
+        "image": image_url,
+        "model_number": model_number
+    }
+
+
+@coalesce_upstream('amazon')
+async def search_amazon_async(product_name, category='', timeout=10):
     """Amazonから価格を取得"""
     try:
         search_query = optimize_search_query(product_name, category)
-        print(f" Amazonで検索中: {search_query}")
-        url = f"https://www.amazon.co.jp/s?k={search_query.replace(' ', '+')}"
-        headers = {"User-Agent": "Mozilla/5.0"}
-        res = requests.get(url, headers=headers, timeout=10)
-        soup = BeautifulSoup(res.text, "html.parser")
+        logger.debug(" Amazonで検索中: %s", search_query)
+        url = f"{AMAZON_BASE_URL}/s?k={search_query.replace(' ', '+')}"
+        res = await http_get_async(url, timeout=timeout)
+        return await parse_response_async(res, parse_amazon_offer)
+    except Exception as e:
+        logger.warning(" Amazon取得失敗: %s", e)
+        return {}
 
-        item = soup.select_one("div[data-component-type='s-search-result']")
-        if not item:
-            return {}
 
-        name = item.h2.get_text(strip=True)
-        price_text = item.select_one(".a-price-whole")
-        if not price_text:
-            return {}
+def search_amazon(product_name, category='', timeout=10):
+    """search_amazon_async の同期版"""
+    return async_upstream.run(search_amazon_async(product_name, category, timeout))
 
-        price = re.sub(r"[^\d]", "", price_text.get_text(strip=True))
 
-        # 画像URLを取得
-        image_url = ""
-        img_tag = item.select_one("img.s-image")
-        if img_tag and img_tag.get("src"):
-            image_url = img_tag.get("src")
-
-        # 型番を商品名から抽出
-        model_number = name
-
-        return {
-            "price": price,
-            "product": name,
-            "source": "Amazon",
-            "image": image_url,
-            "model_number": model_number
-        }
-    except Exception as e:
-        print(" Amazon取得失敗:", e)
+def parse_amazon_offer(html):
+    """Amazonの検索結果ページから先頭の商品を取り出す（見つからなければ空）"""
+    with timed('parse'):
+        soup = BeautifulSoup(html, "html.parser")
+
+    item = soup.select_one("div[data-component-type='s-search-result']")
+    if not item:
+        return {}
+
+    name = item.h2.get_text(strip=True)
+    price_text = item.select_one(".a-price-whole")
+    if not price_text:
         return {}
 
-def search_google_shopping(product_name, category=''):
+    price = re.sub(r"[^\d]", "", price_text.get_text(strip=True))
+
+    # 画像URLを取得
+    image_url = ""
+    img_tag = item.select_one("img.s-image")
+    if img_tag and img_tag.get("src"):
+        image_url = img_tag.get("src")
+
+    # 型番を商品名から抽出
+    model_number = name
+
+    return {
+        "price": price,
+        "product": name,
+        "source": "Amazon",
+        "image": image_url,
+        "model_number": model_number
+    }
+
+
+@coalesce_upstream('google')
+async def search_google_shopping_async(product_name, category='', timeout=10):
     """Googleショッピングから価格を取得"""
     try:
         search_query = optimize_search_query(product_name, category)
-        print(f" Googleショッピングで検索中: {search_query}")
-        url = f"https://www.google.com/search?tbm=shop&q={search_query.replace(' ', '+')}"
-        headers = {"User-Agent": "Mozilla/5.0"}
-        res = requests.get(url, headers=headers, timeout=10)
-        soup = BeautifulSoup(res.text, "html.parser")
+        logger.debug(" Googleショッピングで検索中: %s", search_query)
+        url = f"{GOOGLE_BASE_URL}/search?tbm=shop&q={search_query.replace(' ', '+')}"
+        res = await http_get_async(url, timeout=timeout)
+        return await parse_response_async(res, parse_google_shopping_offer)
+    except Exception as e:
+        logger.warning(" Google取得失敗: %s", e)
+        return {}
 
-        item = soup.select_one(".sh-dgr__gr-auto")
-        if not item:
-            return {}
 
-        name = item.select_one(".tAxDx").get_text(strip=True)
-        price_text = item.select_one(".a8Pemb").get_text(strip=True)
-        price = re.sub(r"[^\d]", "", price_text)
+def search_google_shopping(product_name, category='', timeout=10):
+    """search_google_shopping_async の同期版"""
+    return async_upstream.run(search_google_shopping_async(product_name, category, timeout))
 
-        # 画像URLを取得
-        image_url = ""
-        img_tag = item.select_one("img")
-        if img_tag and img_tag.get("src"):
-            image_url = img_tag.get("src")
-
-        # 型番を商品名から抽出
-        model_number = name
-
-        return {
-            "price": price,
-            "product": name,
-            "source": "Googleショッピング",
-            "image": image_url,
-            "model_number": model_number
-        }
-    except Exception as e:
-        print(" Google取得失敗:", e)
+
+def parse_google_shopping_offer(html):
+    """Googleショッピングの検索結果ページから先頭の商品を取り出す（見つからなければ空）"""
+    with timed('parse'):
+        soup = BeautifulSoup(html, "html.parser")
+
+    item = soup.select_one(".sh-dgr__gr-auto")
+    if not item:
         return {}
 
+    name = item.select_one(".tAxDx").get_text(strip=True)
+    price_text = item.select_one(".a8Pemb").get_text(strip=True)
+    price = re.sub(r"[^\d]", "", price_text)
+
+    # 画像URLを取得
+    image_url = ""
+    img_tag = item.select_one("img")
+    if img_tag and img_tag.get("src"):
+        image_url = img_tag.get("src")
+
+    # 型番を商品名から抽出
+    model_number = name
+
+    return {
+        "price": price,
+        "product": name,
+        "source": "Googleショッピング",
+        "image": image_url,
+        "model_number": model_number
+    }
+
 
 # ==========================
-# 🧩 メイン処理
+# 💡 サジェスト候補の取得
 # ==========================
-@app.route('/api/search', methods=['POST'])
-def search_product():
-    data = request.json
-    product_name = data.get('productName', '')
-    category = data.get('category', '')
+# カテゴリごとの価格.comカテゴリコード
+CATEGORY_CODES = {
+    'cpu': '0510',
+    'motherboard': '0540',
+    'memory': '0520',
+    'gpu': '0550',
+    'storage': '0537',
+    'psu': '0590',
+    'case': '0580',
+    'cooler': '0512',
+    'os': '0560'
+}
+
+# カテゴリ別のキーワードフィルター（必須キーワード）
+CATEGORY_KEYWORDS = {
+    'cpu': ['Intel', 'AMD', 'Core', 'Ryzen', 'Processor', 'CPU'],
+    'motherboard': ['ASUS', 'MSI', 'GIGABYTE', 'ASRock', 'Motherboard', 'マザーボード', 'Z790', 'B760', 'X670', 'B650'],
+    'memory': ['DDR4', 'DDR5', 'Memory', 'メモリ', 'RAM', 'GB'],
+    'gpu': ['GeForce', 'Radeon', 'グラフィックボード', 'グラフィック', 'ビデオカード', 'GPU', 'NVIDIA', 'AMD', 'RTX', 'GTX', 'RX', 'Arc'],
+    'storage': ['SSD', 'HDD', 'NVMe', 'SATA', 'M.2', 'ストレージ'],
+    'psu': ['電源', 'PSU', 'Power Supply', '電源ユニット', 'W', '80PLUS'],
+    'case': ['ケース', 'PCケース', 'タワー', 'Tower', 'ミドルタワー'],
+    'cooler': ['CPUクーラー', 'クーラー', '水冷', '空冷', 'ファン'],
+    'os': ['Windows', 'OS', 'オペレーティングシステム']
+}
+
+# 除外キーワード（これらが含まれていたら除外）
+EXCLUDE_KEYWORDS = {
+    'gpu': ['ウェッジ', 'ゴルフ', 'Golf', 'フレックス', 'ロフト', 'バンス', 'シャフト']
+}
+
+# 入力がない場合に表示する人気商品の例
+POPULAR_ITEMS = {
+    'cpu': ['Intel Core i9-14900K', 'AMD Ryzen 9 7950X', 'Intel Core i7-14700K', 'AMD Ryzen 7 7800X3D'],
+    'motherboard': ['ASUS ROG MAXIMUS Z790', 'MSI MPG B650 EDGE WIFI', 'ASUS TUF GAMING B760M'],
+    'memory': ['DDR5-6000 32GB', 'DDR4-3200 16GB', 'DDR5-5600 32GB'],
+    'gpu': ['RTX 4090', 'RTX 4080 SUPER', 'RTX 4070 Ti SUPER', 'RX 7900 XTX'],
+    'storage': ['Samsung 990 PRO 2TB', 'WD Blue SN580 1TB', 'Crucial P3 Plus 2TB'],
+    'psu': ['Corsair RM850e 850W', 'Seasonic FOCUS GX-850 850W'],
+    'case': ['NZXT H9 Flow', 'Fractal Design Pop Air RGB'],
+    'cooler': ['Noctua NH-D15', 'DeepCool AK620'],
+    'os': ['Windows 11 Home', 'Windows 11 Pro']
+}
+
+
+@coalesce_upstream('kakaku_suggest', priority='suggest')
+async def fetch_kakaku_suggestions_async(query, category, timeout=10):
+    """価格.comの検索結果からカテゴリに合う商品名の候補を取得"""
+    category_code = CATEGORY_CODES[category]
+
+    search_url = f"{KAKAKU_BASE_URL}/search_results/{quote(query)}/?category={category_code}"
+    logger.debug("[DEBUG] Search URL: %s", search_url)
+
+    res = await http_get_async(search_url, timeout=timeout, reader=stream_reader.reader(SUGGEST_STREAM_ITEMS))
+    suggestions = await parse_response_async(res, parse_kakaku_suggestions, category)
+    suggestion_index.add_many(category, suggestions)
+    return suggestions
+
+
+def fetch_kakaku_suggestions(query, category, timeout=10):
+    """fetch_kakaku_suggestions_async の同期版"""
+    return async_upstream.run(fetch_kakaku_suggestions_async(query, category, timeout))
+
+
+def parse_kakaku_suggestions(html, category):
+    """価格.comの検索結果ページからカテゴリに合う商品名を最大10件取り出す"""
+    suggestions = []
+    with timed('parse'):
+        soup = BeautifulSoup(html, "html.parser")
+
+    with timed('select'):
+        # 前回一致したセレクターを先に試し、なければ上から順に試行
+        remembered = layout_memory.get('suggestions')
+        items, index = _select_first(soup, SUGGEST_SELECTORS, remembered)
+        if index is not None:
+            logger.debug("[DEBUG] %s: %d", SUGGEST_SELECTORS[index], len(items))
+            if remembered is not None:
+                layout_memory.count('fast' if index == remembered else 'fallbacks')
+            layout_memory.learn('suggestions', index)
+
+        items = items[:10]
+
+    # カテゴリに関連するキーワードを含む商品のみフィルタリング
+    for item in items:
+        name = item.get_text(strip=True)
+        name = name.replace('\n', ' ').replace('  ', ' ').strip()
+
+        if name not in suggestions and is_relevant_suggestion(name, category):
+            suggestions.append(name)
+            logger.debug("[DEBUG] Added: %s", name)
+    soup.decompose()
+    return suggestions
+
+
+def is_relevant_suggestion(name, category):
+    """商品名がカテゴリに関連するか（除外キーワードを含まず、必須キーワードを含む）"""
+    if not name or len(name) <= 3:
+        return False
+
+    # 除外キーワードチェック
+    for exclude in EXCLUDE_KEYWORDS.get(category, []):
+        if exclude in name:
+            logger.debug("[DEBUG] Excluded (contains '%s'): %s", exclude, name)
+            return False
+
+    # PCパーツに関連するキーワードが含まれているかチェック
+    keywords = CATEGORY_KEYWORDS.get(category, [])
+    if not keywords:
+        return True  # キーワードがない場合はすべて許可
+    name_lower = name.lower()
+    return any(keyword.lower() in name_lower for keyword in keywords)
 
-    if not product_name:
-        return jsonify({'error': '商品名が必要です'}), 400
 
-    print(f"\n{'='*50}")
-    print(f"🔍 検索開始: {product_name} (カテゴリ: {category})")
-    print(f"{'='*50}")
+# ==========================
+# 🗂️ サジェスト用のローカル索引
+# ==========================
+SUGGEST_MIN_LOCAL = int(os.environ.get('SUGGEST_MIN_LOCAL', 5))
+SUGGEST_INDEX_MAX_NAMES = int(os.environ.get('SUGGEST_INDEX_MAX_NAMES', 20000))
+SUGGEST_LIMIT = 8
+# トライの各ノードに保持する候補数と、索引に入れる接頭辞の最大長
+_TRIE_NODE_CAP = 16
+_TRIE_MAX_DEPTH = 40
+_FUZZY_THRESHOLD = 0.6
+
+
+class _CategoryIndex:
+    def __init__(self):
+        self.names = []            # id -> 表示用の商品名
+        self.ids = {}              # 正規化した商品名 -> id
+        self.trie = [{}, []]       # [子ノード, 候補id]
+        self.trigrams = {}         # 3文字組 -> id の集合
+        self.recent_queries = OrderedDict()  # 直近の上流検索語 -> 候補id
+
+
+def _trigrams(text):
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SuggestionIndex:
+    """カテゴリごとの商品名索引（単語先頭からの接頭辞トライ + 3-gramのあいまい検索）"""
+
+    def __init__(self, max_names):
+        self.max_names = max_names
+        self._categories = {}
+        self._lock = threading.Lock()
+        self._counters = {'index_hits': 0, 'narrowed_hits': 0, 'upstream_fetches': 0}
+
+    def _category(self, category):
+        index = self._categories.get(category)
+        if index is None:
+            index = self._categories[category] = _CategoryIndex()
+        return index
+
+    def add_many(self, category, names, check_relevance=True):
+        for name in names:
+            self.add(category, name, check_relevance)
+
+    def add(self, category, name, check_relevance=True):
+        name = ' '.join((name or '').split())
+        if check_relevance and not is_relevant_suggestion(name, category):
+            return
+        key = normalize_product_name(name)
+        if not key:
+            return
+
+        with self._lock:
+            index = self._category(category)
+            if key in index.ids or len(index.names) >= self.max_names:
+                return
+            name_id = len(index.names)
+            index.names.append(name)
+            index.ids[key] = name_id
+
+            # 各単語の先頭から始まる接頭辞をトライに登録
+            starts = [0] + [i + 1 for i, ch in enumerate(key) if ch == ' ']
+            for start in starts:
+                node = index.trie
+                for ch in key[start:start + _TRIE_MAX_DEPTH]:
+                    node = node[0].setdefault(ch, [{}, []])
+                    if len(node[1]) < _TRIE_NODE_CAP and name_id not in node[1]:
+                        node[1].append(name_id)
+
+            for gram in _trigrams(key):
+                index.trigrams.setdefault(gram, set()).add(name_id)
+
+    def search(self, category, query, limit=SUGGEST_LIMIT):
+        """接頭辞一致の候補を返し、足りなければ3-gramのあいまい一致で補う
+
+        (候補, 接頭辞一致の件数) を返す。
+        """
+        key = normalize_product_name(query)
+        with self._lock:
+            index = self._categories.get(category)
+            if index is None or not key:
+                return [], 0
+
+            results = []
+            node = index.trie
+            for ch in key[:_TRIE_MAX_DEPTH]:
+                node = node[0].get(ch)
+                if node is None:
+                    break
+            else:
+                results = list(node[1])
+            prefix_count = len(results)
+
+            if len(results) < limit and len(key) >= 3:
+                query_grams = _trigrams(key)
+                scores = {}
+                for gram in query_grams:
+                    for name_id in index.trigrams.get(gram, ()):
+                        scores[name_id] = scores.get(name_id, 0) + 1
+                fuzzy = [name_id for name_id, score in scores.items()
+                         if score / len(query_grams) >= _FUZZY_THRESHOLD and name_id not in results]
+                fuzzy.sort(key=lambda name_id: (-scores[name_id], name_id))
+                results.extend(fuzzy)
+
+            return [index.names[name_id] for name_id in results[:limit]], prefix_count
+
+    def remember_query(self, category, query, names):
+        """上流で検索した語と結果を記録（続けて入力された語の絞り込みに使う）"""
+        key = normalize_product_name(query)
+        with self._lock:
+            index = self._category(category)
+            index.recent_queries[key] = [index.ids[normalize_product_name(name)] for name in names
+                                         if normalize_product_name(name) in index.ids]
+            index.recent_queries.move_to_end(key)
+            while len(index.recent_queries) > 256:
+                index.recent_queries.popitem(last=False)
+
+    def narrow(self, category, query, limit=SUGGEST_LIMIT):
+        """直前の検索語を延長した入力なら、その結果をローカルで絞り込む"""
+        key = normalize_product_name(query)
+        tokens = key.split()
+        with self._lock:
+            index = self._categories.get(category)
+            if index is None:
+                return []
+            previous = [q for q in index.recent_queries if key.startswith(q) and q != key]
+            if not previous:
+                return []
+            candidates = index.recent_queries[max(previous, key=len)]
+            names = [index.names[name_id] for name_id in candidates]
+        return [name for name in names
+                if all(token in normalize_product_name(name) for token in tokens)][:limit]
+
+    def count(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['names'] = {category: len(index.names) for category, index in self._categories.items()}
+        return stats
+
+
+suggestion_index = SuggestionIndex(SUGGEST_INDEX_MAX_NAMES)
+for _category, _names in POPULAR_ITEMS.items():
+    suggestion_index.add_many(_category, _names, check_relevance=False)
+
+
+async def suggest_products_async(query, category):
+    """索引 → 直前の結果の絞り込み → 価格.com の順にサジェストを取得"""
+    local, prefix_count = suggestion_index.search(category, query)
+    if prefix_count >= SUGGEST_MIN_LOCAL:
+        suggestion_index.count('index_hits')
+        return local
+
+    narrowed = suggestion_index.narrow(category, query)
+    if len(narrowed) >= SUGGEST_MIN_LOCAL:
+        suggestion_index.count('narrowed_hits')
+        return narrowed
+
+    suggestion_index.count('upstream_fetches')
+    try:
+        upstream = await fetch_kakaku_suggestions_async(query, category)
+    except UpstreamBusy as e:
+        # 取得を見送った場合は索引の候補だけで返す
+        logger.info("⏳ サジェストの取得を見送りました: %s", e)
+        upstream = []
+    else:
+        suggestion_index.remember_query(category, query, upstream)
 
-    # 価格.comから価格を取得
-    web_result = search_kakaku(product_name, category)
-    if web_result.get("price"):
-        print(f"✅ {web_result['source']} から取得成功: ¥{web_result['price']}円")
-        return jsonify(web_result)
+    # 価格.comの結果を優先し、索引の候補で補う
+    merged = list(upstream)
+    for name in local + narrowed:
+        if name not in merged:
+            merged.append(name)
+    return merged
 
-    return jsonify({'error': '価格.comで価格を取得できませんでした'}), 404
 
-@app.route('/api/suggestions', methods=['POST'])
-def get_suggestions():
-    """入力内容に応じた商品サジェストを取得"""
-    data = request.json
-    category = data.get('category', '')
-    query = data.get('query', '').strip()
+def suggest_products(query, category):
+    """suggest_products_async の同期版"""
+    return async_upstream.run(suggest_products_async(query, category))
+
+
+# ==========================
+# 💾 検索結果キャッシュ（TTL + LRU）
+# ==========================
+# 有効期限（秒）。取得失敗（空の結果）は短めのTTLでネガティブキャッシュする
+CACHE_TTL = float(os.environ.get('CACHE_TTL', 600))
+CACHE_NEGATIVE_TTL = float(os.environ.get('CACHE_NEGATIVE_TTL', 60))
+# 期限切れ後もこの秒数までは古い値を返しつつ裏で再取得する
+CACHE_STALE_TTL = float(os.environ.get('CACHE_STALE_TTL', 3600))
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 1024))
+CACHE_MAX_BYTES = int(os.environ.get('CACHE_MAX_BYTES', 8 * 1024 * 1024))
+# ワーカー間で共有する永続キャッシュ（SQLite）。空文字にすると無効
+PRICE_CACHE_DB = os.environ.get(
+    'PRICE_CACHE_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'price_cache.sqlite3'))
+# 期限切れ行の削除・ファイルの縮小の間隔（秒）と、起動時にメモリへ読み込む件数
+PRICE_CACHE_MAINTENANCE_INTERVAL = float(os.environ.get('PRICE_CACHE_MAINTENANCE_INTERVAL', 3600))
+PRICE_CACHE_WARM_ENTRIES = int(os.environ.get('PRICE_CACHE_WARM_ENTRIES', 512))
+
+
+class PriceStore:
+    """search_kakaku の結果を SQLite（WALモード）に保存し、gunicorn の全ワーカーと再起動後で共有する
+
+    値は圧縮したJSONで保存し、取得時刻（UNIX時刻）とTTLを持つ。
+    接続はプロセスごとに1つだけ開いて（スキーマの作成もその時だけ）ロックを取って使い、
+    定期的に期限切れ行を削除してファイルを縮める。
+    """
+
+    SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS prices (
+            name_key TEXT NOT NULL,
+            category TEXT NOT NULL,
+            payload BLOB NOT NULL,
+            fetched_at REAL NOT NULL,
+            ttl REAL NOT NULL,
+            PRIMARY KEY (name_key, category)
+        ) WITHOUT ROWID""",
+        'CREATE INDEX IF NOT EXISTS prices_category ON prices (category, fetched_at)',
+        'CREATE INDEX IF NOT EXISTS prices_expiry ON prices (fetched_at + ttl)',
+        """CREATE TABLE IF NOT EXISTS part_aliases (
+            alias TEXT NOT NULL,
+            category TEXT NOT NULL,
+            part_key TEXT NOT NULL,
+            query TEXT NOT NULL,
+            learned_at REAL NOT NULL,
+            PRIMARY KEY (alias, category)
+        ) WITHOUT ROWID""",
+    )
+
+    def __init__(self, path, maintenance_interval, stale_ttl):
+        self.path = path
+        self.maintenance_interval = maintenance_interval
+        self.stale_ttl = stale_ttl
+        self._connection = None
+        self._pid = None
+        self._db_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._counters = {'reads': 0, 'hits': 0, 'writes': 0, 'purged': 0, 'errors': 0}
+
+    def _connect(self):
+        # 取得用イベントループ・リクエスト・保守のスレッドで共有する（使う間は _db_lock を持つ）
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        # auto_vacuum は新しいファイルに最初に書き込む前でないと効かない
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        for statement in self.SCHEMA:
+            conn.execute(statement)
+        return conn
+
+    @contextmanager
+    def _conn(self):
+        """プロセスで共有する接続をロックを取って渡す（fork 前に開いた接続は子プロセスで使わない）"""
+        with self._db_lock:
+            pid = os.getpid()
+            if self._pid != pid:
+                self._connection = self._connect()
+                self._pid = pid
+                self._start_maintenance()
+            yield self._connection
+
+    def _start_maintenance(self):
+        if self.maintenance_interval <= 0:
+            return
+        thread = threading.Thread(target=self._maintenance_loop, daemon=True)
+        thread.start()
+
+    def _maintenance_loop(self):
+        while True:
+            time.sleep(self.maintenance_interval)
+            self.purge_expired()
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    @staticmethod
+    def _encode(value):
+        return zlib.compress(json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+    @staticmethod
+    def _decode(payload):
+        return json.loads(zlib.decompress(payload).decode('utf-8'))
+
+    def get(self, key):
+        """(値, 取得時刻, TTL) を返す。保存されていなければ None"""
+        self._count('reads')
+        try:
+            with self._conn() as conn:
+                row = conn.execute(
+                    'SELECT payload, fetched_at, ttl FROM prices WHERE name_key = ? AND category = ?', key
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning("❌ 永続キャッシュ読み込み失敗: %s", e)
+            self._count('errors')
+            return None
+        if row is None:
+            return None
+        self._count('hits')
+        return self._decode(row[0]), row[1], row[2]
+
+    def put(self, key, value, ttl, fetched_at=None):
+        fetched_at = time.time() if fetched_at is None else fetched_at
+        payload = self._encode(value)
+        try:
+            with self._conn() as conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO prices (name_key, category, payload, fetched_at, ttl) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (key[0], key[1], payload, fetched_at, ttl),
+                )
+            self._count('writes')
+        except sqlite3.Error as e:
+            logger.warning("❌ 永続キャッシュ書き込み失敗: %s", e)
+            self._count('errors')
+
+    def recent(self, limit):
+        """古い値としても使えなくなっていない行を新しい順に (キー, 値, 取得時刻, TTL) で返す"""
+        try:
+            with self._conn() as conn:
+                rows = conn.execute(
+                    'SELECT name_key, category, payload, fetched_at, ttl FROM prices '
+                    'WHERE fetched_at + ttl > ? ORDER BY fetched_at DESC LIMIT ?',
+                    (time.time() - self.stale_ttl, limit),
+                ).fetchall()
+        except sqlite3.Error as e:
+            logger.warning("❌ 永続キャッシュ読み込み失敗: %s", e)
+            self._count('errors')
+            return []
+        return [((name_key, category), self._decode(payload), fetched_at, ttl)
+                for name_key, category, payload, fetched_at, ttl in rows]
+
+    def put_alias(self, alias, category, part_key, query):
+        """検索語の言い換え（PartKeyNormalizer が覚えた型番）を保存"""
+        try:
+            with self._conn() as conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO part_aliases (alias, category, part_key, query, learned_at) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (alias, category, part_key, query, time.time()),
+                )
+        except sqlite3.Error as e:
+            logger.warning("❌ 言い換えの保存失敗: %s", e)
+            self._count('errors')
+
+    def aliases(self, limit):
+        """保存した言い換えを新しい順に (検索語, カテゴリ, キー, 検索語) で返す"""
+        try:
+            with self._conn() as conn:
+                return conn.execute(
+                    'SELECT alias, category, part_key, query FROM part_aliases ORDER BY learned_at DESC LIMIT ?',
+                    (limit,),
+                ).fetchall()
+        except sqlite3.Error as e:
+            logger.warning("❌ 言い換えの読み込み失敗: %s", e)
+            self._count('errors')
+            return []
+
+    def purge_expired(self):
+        """古い値としても使えなくなった行を削除し、空いたページをファイルから切り詰める"""
+        try:
+            with self._conn() as conn:
+                deleted = conn.execute(
+                    'DELETE FROM prices WHERE fetched_at + ttl <= ?', (time.time() - self.stale_ttl,)
+                ).rowcount
+                conn.execute('PRAGMA incremental_vacuum')
+                conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        except sqlite3.Error as e:
+            logger.warning("❌ 永続キャッシュの整理失敗: %s", e)
+            self._count('errors')
+            return 0
+        self._count('purged', deleted)
+        return deleted
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        try:
+            with self._conn() as conn:
+                stats['rows'] = conn.execute('SELECT COUNT(*) FROM prices').fetchone()[0]
+            stats['bytes'] = os.path.getsize(self.path)
+        except (sqlite3.Error, OSError):
+            stats['rows'] = stats['bytes'] = 0
+        return stats
+
+
+class ResultCache:
+    """件数・バイト数で上限を持つTTL付きLRUキャッシュ（stale-while-revalidate対応）"""
+
+    def __init__(self, max_entries, max_bytes, ttl, negative_ttl, stale_ttl, store=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.stale_ttl = stale_ttl
+        # メモリにない場合に参照する永続キャッシュ（PriceStore）
+        self.store = store
+        self._entries = OrderedDict()  # key -> (value, size, expires_at)
+        self._bytes = 0
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._counters = {
+            'hits': 0,
+            'stale_hits': 0,
+            'negative_hits': 0,
+            'misses': 0,
+            'store_hits': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'refreshes': 0,
+            'refresh_failures': 0,
+        }
+
+    @staticmethod
+    def _entry_size(key, value):
+        return len(json.dumps([key, value], ensure_ascii=False).encode('utf-8'))
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def get(self, key):
+        """(値, 状態) を返す。状態は 'fresh' / 'stale' / 'miss'"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, _, expires_at = entry
+                if now < expires_at + self.stale_ttl:
+                    self._entries.move_to_end(key)
+                    return value, self._count_hit(value, now < expires_at)
+                self._remove(key)
+                self._counters['expirations'] += 1
+
+        # 他のワーカーや再起動前に保存された値を探す
+        stored = self.store.get(key) if self.store is not None else None
+        if stored is not None:
+            value, fetched_at, ttl = stored
+            remaining = fetched_at + ttl - time.time()
+            if remaining > -self.stale_ttl:
+                self._set_local(key, value, now + remaining)
+                with self._lock:
+                    self._counters['store_hits'] += 1
+                    return value, self._count_hit(value, remaining > 0)
+
+        self._count('misses')
+        return None, 'miss'
+
+    def _count_hit(self, value, fresh):
+        """ロックを持った状態でヒットを数え、状態を返す"""
+        if not value:
+            self._counters['negative_hits'] += 1
+        if fresh:
+            self._counters['hits'] += 1
+            return 'fresh'
+        self._counters['stale_hits'] += 1
+        return 'stale'
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl if value else self.negative_ttl
+        self._set_local(key, value, time.monotonic() + ttl)
+        if self.store is not None:
+            self.store.put(key, value, ttl)
+
+    def warm_start(self, limit):
+        """永続キャッシュの新しい行をメモリに読み込み、再起動直後の取得をまとめて発生させない"""
+        if self.store is None or limit <= 0:
+            return 0
+        now, wall = time.monotonic(), time.time()
+        rows = self.store.recent(limit)
+        # 古い行から入れて、LRUでは新しい行ほど後まで残す
+        for key, value, fetched_at, ttl in reversed(rows):
+            self._set_local(key, value, now + fetched_at + ttl - wall)
+        return len(rows)
+
+    def _set_local(self, key, value, expires_at):
+        size = self._entry_size(key, value)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, expires_at)
+            self._bytes += size
+
+            # 古いものから追い出す
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._counters['evictions'] += 1
+
+    async def get_or_load_async(self, key, loader):
+        """キャッシュから取得し、なければ await loader() の結果を保存して返す
+
+        loader() が例外を送出した場合（UpstreamUnavailable など）は何も保存せずにそのまま送出する。
+        """
+        value, state = self.get(key)
+        if state == 'fresh':
+            return value
+        if state == 'stale':
+            # 呼び出し元のイベントループはリクエスト後に止まるため、再取得は取得用イベントループに任せる
+            self._refresh_in_background(key, lambda: async_upstream.run(loader()), value)
+            return value
+
+        value = await loader()
+        self.set(key, value)
+        return value
+
+    def peek(self, key):
+        """統計を数えずに (値, 有効期限までの秒数) を返す。ない場合は (None, None)
+
+        メモリの値が期限間近なら、他のワーカーが永続キャッシュに保存した新しい値を取り込む。
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+        value, remaining = (entry[0], entry[2] - now) if entry is not None else (None, None)
+
+        if self.store is not None and (remaining is None or remaining < self.ttl / 2):
+            stored = self.store.get(key)
+            if stored is not None:
+                stored_value, fetched_at, ttl = stored
+                stored_remaining = fetched_at + ttl - time.time()
+                if remaining is None or stored_remaining > remaining:
+                    self._set_local(key, stored_value, now + stored_remaining)
+                    value, remaining = stored_value, stored_remaining
+        return value, remaining
+
+    def refresh(self, key, loader, stale_value=None):
+        """loader() で再取得して保存する（同じキーを再取得中なら何もしない）"""
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+        return self._refresh(key, loader, stale_value)
+
+    def _refresh_in_background(self, key, loader, stale_value):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        thread = threading.Thread(target=self._refresh, args=(key, loader, stale_value), daemon=True)
+        thread.start()
+
+    def _refresh(self, key, loader, stale_value):
+        """再取得して保存し、有効な値が得られたかを返す（取得は background の優先度で送る）"""
+        try:
+            with upstream_priority('background'):
+                value = loader()
+            if not value and stale_value:
+                # 再取得に失敗した場合は古い値を残し、少し待ってから再試行する
+                self.set(key, stale_value, ttl=self.negative_ttl)
+                self._count('refresh_failures')
+            else:
+                self.set(key, value)
+            self._count('refreshes')
+            return bool(value)
+        except Exception as e:
+            logger.warning("❌ キャッシュ再取得失敗: %s %s", key, e)
+            if stale_value:
+                self.set(key, stale_value, ttl=self.negative_ttl)
+            self._count('refresh_failures')
+            return False
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update({
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'refreshing': len(self._refreshing),
+            })
+        lookups = stats['hits'] + stats['stale_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['hits'] + stats['stale_hits']) / lookups, 4) if lookups else 0.0
+        return stats
+
+
+price_store = PriceStore(
+    PRICE_CACHE_DB,
+    maintenance_interval=PRICE_CACHE_MAINTENANCE_INTERVAL,
+    stale_ttl=CACHE_STALE_TTL,
+) if PRICE_CACHE_DB else None
+
+result_cache = ResultCache(
+    max_entries=CACHE_MAX_ENTRIES,
+    max_bytes=CACHE_MAX_BYTES,
+    ttl=CACHE_TTL,
+    negative_ttl=CACHE_NEGATIVE_TTL,
+    stale_ttl=CACHE_STALE_TTL,
+    store=price_store,
+)
+
+def _kakaku_cache_key(product_name, category):
+    """価格.comの検索結果のキャッシュのキーと、キーの種類（PartKeyNormalizer.resolve）を返し、検索履歴に記録する"""
+    part_key, _, kind = part_keys.resolve(product_name, category)
+    part_keys.count(kind)
+    key = (part_key, category)
+    prewarm_scheduler.record(key, product_name)
+    return key, kind
+
+
+async def cached_search_kakaku_async(product_name, category='', timeout=15):
+    """キャッシュ経由で価格.comを検索"""
+    key, kind = _kakaku_cache_key(product_name, category)
+    result = await result_cache.get_or_load_async(
+        key, lambda: load_kakaku_async(product_name, category, timeout))
+    if kind == 'text' and result.get('product'):
+        part_keys.learn(product_name, category, result['product'])
+    return dict(result)
+
+
+async def load_kakaku_async(product_name, category='', timeout=15):
+    """カタログ（一覧の巡回結果）にあればその結果を、なければ価格.comを検索して返す（キャッシュは通さない）
+
+    カタログの結果は、型番のキーが完全に一致し CATALOG_MAX_AGE 秒以内に一覧で確認した商品だけを使う（Catalog.lookup）。
+    取得用イベントループからも呼ばれるため、カタログ（SQLite）の読み込みはスレッドで行う。
+    """
+    if catalog is not None:
+        result = await asyncio.to_thread(catalog.lookup, part_keys.key(product_name, category), category)
+        if result is not None:
+            return result
+    return await search_kakaku_async(product_name, category, timeout)
+
+
+def load_kakaku(product_name, category='', timeout=15):
+    """load_kakaku_async の同期版"""
+    return async_upstream.run(load_kakaku_async(product_name, category, timeout))
+
+
+def cached_search_kakaku(product_name, category='', timeout=15):
+    """cached_search_kakaku_async の同期版"""
+    return run_in_caller(cached_search_kakaku_async(product_name, category, timeout))
+
+
+# ==========================
+# 🔥 人気・最近の検索の事前取得
+# ==========================
+PREWARM_ENABLED = os.environ.get('PREWARM_ENABLED', '1') != '0'
+# 確認の間隔（秒）と、期限までこの秒数を切ったキーを再取得する
+PREWARM_INTERVAL = float(os.environ.get('PREWARM_INTERVAL', 60))
+PREWARM_AHEAD = float(os.environ.get('PREWARM_AHEAD', 120))
+# 最近よく検索された (検索語, カテゴリ) の上位何件を対象にするか
+PREWARM_TOP_N = int(os.environ.get('PREWARM_TOP_N', 50))
+PREWARM_TRACK_MAX = int(os.environ.get('PREWARM_TRACK_MAX', 2000))
+# 同時に取得する数と、各取得の前に入れる待ち時間の上限（秒）
+PREWARM_CONCURRENCY = int(os.environ.get('PREWARM_CONCURRENCY', 2))
+PREWARM_JITTER = float(os.environ.get('PREWARM_JITTER', 2.0))
+# 処理中のAPIリクエストがこの数を超えている間は事前取得を待つ
+PREWARM_YIELD_INFLIGHT = int(os.environ.get('PREWARM_YIELD_INFLIGHT', 4))
+
+
+class PrewarmScheduler:
+    """人気商品と最近よく検索されたキーを、キャッシュの期限が切れる前に裏で取り直す
+
+    検索回数は確認のたびに半減させ、最近のアクセスほど重く数える。
+    処理中のAPIリクエストが多い間は取得を始めずに待つ。
+    """
+
+    def __init__(self, cache, loader, interval, ahead, top_n, track_max, concurrency, jitter, yield_inflight):
+        self.cache = cache
+        self.loader = loader
+        self.interval = interval
+        self.ahead = ahead
+        self.top_n = top_n
+        self.track_max = track_max
+        self.concurrency = concurrency
+        self.jitter = jitter
+        self.yield_inflight = yield_inflight
+        self._counts = {}  # key -> [回数, 検索語]
+        self._live = 0
+        self._pid = None
+        self._lock = threading.Lock()
+        self._counters = {'cycles': 0, 'refreshed': 0, 'skipped_fresh': 0, 'failures': 0, 'yields': 0}
+
+    def record(self, key, product_name):
+        with self._lock:
+            entry = self._counts.get(key)
+            if entry is None:
+                if len(self._counts) >= self.track_max:
+                    self._drop_coldest()
+                entry = self._counts[key] = [0.0, product_name]
+            entry[0] += 1
+
+    def _drop_coldest(self):
+        coldest = min(self._counts, key=lambda k: self._counts[k][0])
+        del self._counts[coldest]
+
+    def live_started(self):
+        with self._lock:
+            self._live += 1
+
+    def live_finished(self):
+        with self._lock:
+            self._live -= 1
+
+    def start(self):
+        """プロセスごとに1回だけスケジューラーのスレッドを起動（gunicorn の fork 後に呼ぶ）"""
+        pid = os.getpid()
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._pid = pid
+            self._live = 0
+        thread = threading.Thread(target=self._run, daemon=True)
+        thread.start()
+
+    def _run(self):
+        executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='prewarm')
+        while True:
+            try:
+                self.run_once(executor)
+            except Exception as e:
+                logger.warning("❌ 事前取得失敗: %s", e, exc_info=True)
+            time.sleep(self.interval + random.uniform(0, self.jitter))
+
+    def candidates(self):
+        """人気商品 + 最近の上位キーを (キー, 検索語, カテゴリ) で返す"""
+        seen = set()
+        candidates = []
+        for category, names in POPULAR_ITEMS.items():
+            for name in names:
+                key = (part_keys.key(name, category), category)
+                if key not in seen:
+                    seen.add(key)
+                    candidates.append((key, name, category))
+
+        with self._lock:
+            hottest = sorted(self._counts.items(), key=lambda item: item[1][0], reverse=True)[:self.top_n]
+            # 減衰させ、ほぼ検索されなくなったキーは忘れる
+            for key, entry in list(self._counts.items()):
+                entry[0] /= 2
+                if entry[0] < 0.05:
+                    del self._counts[key]
+
+        for key, (_, product_name) in hottest:
+            if key not in seen:
+                seen.add(key)
+                candidates.append((key, product_name, key[1]))
+        return candidates
+
+    def _wait_for_quiet(self):
+        while True:
+            with self._lock:
+                busy = self._live > self.yield_inflight
+            if not busy:
+                return
+            self._count('yields')
+            time.sleep(0.5 + random.uniform(0, self.jitter))
+
+    def _refresh(self, key, product_name, category, stale_value):
+        time.sleep(random.uniform(0, self.jitter))
+        self._wait_for_quiet()
+        if self.cache.refresh(key, lambda: self.loader(product_name, category), stale_value):
+            self._count('refreshed')
+        else:
+            self._count('failures')
+
+    def run_once(self, executor):
+        self._count('cycles')
+        futures = []
+        for key, product_name, category in self.candidates():
+            value, remaining = self.cache.peek(key)
+            if remaining is not None and remaining > self.ahead:
+                self._count('skipped_fresh')
+                continue
+            futures.append(executor.submit(self._refresh, key, product_name, category, value))
+        wait(futures)
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['tracked'] = len(self._counts)
+            stats['live_requests'] = self._live
+        return stats
+
+
+prewarm_scheduler = PrewarmScheduler(
+    result_cache,
+    loader=load_kakaku,
+    interval=PREWARM_INTERVAL,
+    ahead=PREWARM_AHEAD,
+    top_n=PREWARM_TOP_N,
+    track_max=PREWARM_TRACK_MAX,
+    concurrency=PREWARM_CONCURRENCY,
+    jitter=PREWARM_JITTER,
+    yield_inflight=PREWARM_YIELD_INFLIGHT,
+)
+
+
+# ==========================
+# 📚 価格.comのカタログ（カテゴリ一覧の定期巡回）
+# ==========================
+# カテゴリ一覧を巡回して商品を保存し、検索・サジェストで価格.comより先に使う（0 で無効）
+CATALOG_ENABLED = os.environ.get('CATALOG_ENABLED', '1') != '0'
+# 保存先（既定は永続キャッシュと同じファイル。空文字で無効）
+CATALOG_DB = os.environ.get('CATALOG_DB', PRICE_CACHE_DB)
+# 巡回の間隔（秒）と、カテゴリごとに巡回する一覧のページ数
+CATALOG_INTERVAL = float(os.environ.get('CATALOG_INTERVAL', 3600))
+CATALOG_PAGES = int(os.environ.get('CATALOG_PAGES', 5))
+# 一覧でこの秒数以内に確認した商品だけを検索の結果に使う
+CATALOG_MAX_AGE = float(os.environ.get('CATALOG_MAX_AGE', 7200))
+# カテゴリ一覧のURL（{code} はカテゴリコード、{page} はページ番号）
+CATALOG_LISTING_URL = os.environ.get(
+    'CATALOG_LISTING_URL', KAKAKU_BASE_URL + '/search_results/?category={code}&sort=popular&page={page}')
+
+
+class Catalog:
+    """価格.comのカテゴリ一覧から集めた商品（価格・画像・スペック）を SQLite に保存し、検索とサジェストに使う
+
+    一覧ページごとに ETag / Last-Modified と本文のハッシュを保存し、条件付きリクエストで変更がなければ
+    (304) 受信せず、本文が前回と同じなら解析しない。どちらの場合もページの商品は確認済みとして扱う。
+    巡回は gunicorn のワーカーのうち、保存先のリースを取った1つだけが行う。
+    """
+
+    SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS catalog_products (
+            category TEXT NOT NULL,
+            name TEXT NOT NULL,
+            part_key TEXT NOT NULL,
+            price INTEGER NOT NULL,
+            image TEXT,
+            specs TEXT NOT NULL,
+            page_url TEXT NOT NULL,
+            seen_at REAL NOT NULL,
+            PRIMARY KEY (category, name)
+        ) WITHOUT ROWID""",
+        'CREATE INDEX IF NOT EXISTS catalog_products_key ON catalog_products (category, part_key, price)',
+        'CREATE INDEX IF NOT EXISTS catalog_products_page ON catalog_products (page_url)',
+        """CREATE TABLE IF NOT EXISTS catalog_pages (
+            url TEXT PRIMARY KEY,
+            etag TEXT,
+            last_modified TEXT,
+            content_hash TEXT,
+            items INTEGER NOT NULL,
+            crawled_at REAL NOT NULL
+        ) WITHOUT ROWID""",
+        """CREATE TABLE IF NOT EXISTS catalog_lease (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID""",
+    )
+    # 一覧から消えてからこの秒数が過ぎた商品は削除する
+    RETENTION = 7 * 24 * 3600
+
+    def __init__(self, path, interval, pages, max_age, listing_url):
+        self.path = path
+        self.interval = interval
+        self.pages = pages
+        self.max_age = max_age
+        self.listing_url = listing_url
+        self._local = threading.local()
+        self._pid = None
+        self._lock = threading.Lock()
+        self._counters = {'crawls': 0, 'lease_skips': 0, 'pages': 0, 'not_modified': 0, 'unchanged': 0,
+                          'changed': 0, 'errors': 0, 'hits': 0, 'misses': 0, 'key_mismatches': 0}
+
+    def _conn(self):
+        # fork 前に開いた接続は子プロセスで使わない
+        pid = os.getpid()
+        if getattr(self._local, 'pid', None) != pid:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+            self._local.conn = conn
+            self._local.pid = pid
+        return self._local.conn
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def lookup(self, part_key, category):
+        """型番のキーが一致する商品のうち、max_age 秒以内に一覧で確認した最安値を search_kakaku と同じ形で返す
+
+        一致した商品は安い順に KAKAKU_OFFERS_MAX 件まで商品一覧（offers）に入れる。
+        保存したキーは巡回時のもので、変更のない一覧ページは解析し直さないため、商品名から今の型番の文法・言い換えで
+        作り直したキーが part_key と完全に一致する商品だけを使う（なければ None。呼び出し側は価格.comを検索する）。
+        """
+        try:
+            rows = self._conn().execute(
+                'SELECT name, price, image, specs FROM catalog_products '
+                'WHERE category = ? AND part_key = ? AND seen_at >= ? ORDER BY price LIMIT ?',
+                (category, part_key, time.time() - self.max_age, KAKAKU_OFFERS_MAX),
+            ).fetchall()
+        except sqlite3.Error as e:
+            logger.warning("❌ カタログ読み込み失敗: %s", e)
+            self._count('errors')
+            return None
+        matched = [row for row in rows if part_keys.key(row[0], category) == part_key]
+        if len(matched) < len(rows):
+            self._count('key_mismatches', len(rows) - len(matched))
+        rows = matched
+        if not rows:
+            self._count('misses')
+            return None
+        self._count('hits')
+
+        offers = [dict(json.loads(specs), name=name, price=price, image=image or "No image")
+                  for name, price, image, specs in rows]
+        best = offers[0]
+        result = {
+            "price": str(best['price']),
+            "product": best['name'],
+            "source": KAKAKU_SOURCE,
+            "image": best['image'],
+            "model_number": best['name'],
+        }
+        result.update(json.loads(rows[0][3]))
+        result['offers'] = offers
+        return result
+
+    def candidates(self, category, limit):
+        """max_age 秒以内に一覧で確認した商品を安い順に {name, price, image, スペック} で返す（構成の最適化用）"""
+        try:
+            rows = self._conn().execute(
+                'SELECT name, price, image, specs FROM catalog_products '
+                'WHERE category = ? AND seen_at >= ? ORDER BY price LIMIT ?',
+                (category, time.time() - self.max_age, limit),
+            ).fetchall()
+        except sqlite3.Error as e:
+            logger.warning("❌ カタログ読み込み失敗: %s", e)
+            self._count('errors')
+            return []
+        return [dict(json.loads(specs), name=name, price=price, image=image) for name, price, image, specs in rows]
+
+    def names(self, category, limit):
+        """最近一覧で確認した商品名（サジェスト索引の読み込み用）"""
+        try:
+            rows = self._conn().execute(
+                'SELECT name FROM catalog_products WHERE category = ? ORDER BY seen_at DESC LIMIT ?',
+                (category, limit),
+            ).fetchall()
+        except sqlite3.Error as e:
+            logger.warning("❌ カタログ読み込み失敗: %s", e)
+            self._count('errors')
+            return []
+        return [name for name, in rows]
+
+    def start(self):
+        """プロセスごとに1回だけ巡回のスレッドを起動（gunicorn の fork 後に呼ぶ）"""
+        pid = os.getpid()
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._pid = pid
+        thread = threading.Thread(target=self._run, daemon=True)
+        thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.crawl_once()
+            except Exception as e:
+                logger.warning("❌ カタログの巡回失敗: %s", e, exc_info=True)
+            time.sleep(self.interval + random.uniform(0, PREWARM_JITTER))
+
+    def _acquire_lease(self):
+        """このプロセスが今回の巡回を行うか（他のワーカーが巡回中・巡回済みなら False）"""
+        now = time.time()
+        conn = self._conn()
+        conn.execute("INSERT OR IGNORE INTO catalog_lease (name, owner, expires_at) VALUES ('crawl', '', 0)")
+        # 次の周期には別のワーカーが引き継げるよう、間隔より少し短く持つ
+        updated = conn.execute(
+            "UPDATE catalog_lease SET owner = ?, expires_at = ? WHERE name = 'crawl' AND expires_at <= ?",
+            (str(os.getpid()), now + self.interval * 0.9, now),
+        ).rowcount
+        return updated == 1
+
+    def crawl_once(self):
+        """全カテゴリの一覧を先頭から巡回する（商品のないページに達したら次のカテゴリへ）"""
+        if not self._acquire_lease():
+            self._count('lease_skips')
+            return
+        self._count('crawls')
+        for category, code in CATEGORY_CODES.items():
+            for page in range(1, self.pages + 1):
+                try:
+                    if not self.crawl_page(category, code, page):
+                        break
+                except (UpstreamBusy, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    logger.info("⏳ カタログの巡回を中断しました: %s %d: %s", category, page, e)
+                    self._count('errors')
+                    break
+        self._conn().execute('DELETE FROM catalog_products WHERE seen_at < ?', (time.time() - self.RETENTION,))
+
+    def crawl_page(self, category, code, page):
+        """一覧ページを取得して商品を保存し、次のページに進むかを返す"""
+        url = self.listing_url.format(code=code, page=page)
+        conn = self._conn()
+        row = conn.execute('SELECT etag, last_modified, content_hash FROM catalog_pages WHERE url = ?',
+                           (url,)).fetchone()
+        headers = {}
+        if row is not None:
+            if row[0]:
+                headers['If-None-Match'] = row[0]
+            if row[1]:
+                headers['If-Modified-Since'] = row[1]
+
+        self._count('pages')
+        res = async_upstream.run(self._fetch(url, headers))
+        now = time.time()
+        if res.status_code == 304:
+            self._count('not_modified')
+            self._touch(url, now)
+            return True
+        if res.status_code != 200:
+            logger.info("❌ カタログの一覧を取得できませんでした: %s (%d)", url, res.status_code)
+            self._count('errors')
+            return False
+
+        content_hash = hashlib.sha1(res.content).hexdigest()
+        if row is not None and row[2] == content_hash:
+            self._count('unchanged')
+            self._touch(url, now, res.headers)
+            return True
+
+        offers = async_upstream.run(parse_response_async(res, parse_kakaku_offers))
+        if not offers:
+            return False
+        products = [
+            (category, offer['name'], part_keys.key(offer['name'], category), offer['price'], offer['image'],
+             json.dumps(extract_specs(category, offer['name']), ensure_ascii=False), url, now)
+            for offer in offers
+        ]
+        conn.execute('BEGIN')
+        try:
+            conn.executemany(
+                'INSERT OR REPLACE INTO catalog_products '
+                '(category, name, part_key, price, image, specs, page_url, seen_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                products,
+            )
+            conn.execute(
+                'INSERT OR REPLACE INTO catalog_pages (url, etag, last_modified, content_hash, items, crawled_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (url, res.headers.get('ETag'), res.headers.get('Last-Modified'), content_hash, len(products), now),
+            )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        self._count('changed')
+        suggestion_index.add_many(category, [offer['name'] for offer in offers])
+        return True
+
+    async def _fetch(self, url, headers):
+        _metric_source.set('kakaku_catalog')
+        with upstream_priority('background'):
+            return await http_get_async(url, headers=headers)
+
+    def _touch(self, url, now, headers=None):
+        """変わっていないページの商品を確認済みにする（新しい ETag / Last-Modified があれば保存）"""
+        conn = self._conn()
+        conn.execute('UPDATE catalog_products SET seen_at = ? WHERE page_url = ?', (now, url))
+        if headers is not None and (headers.get('ETag') or headers.get('Last-Modified')):
+            conn.execute('UPDATE catalog_pages SET etag = ?, last_modified = ?, crawled_at = ? WHERE url = ?',
+                         (headers.get('ETag'), headers.get('Last-Modified'), now, url))
+        else:
+            conn.execute('UPDATE catalog_pages SET crawled_at = ? WHERE url = ?', (now, url))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        try:
+            conn = self._conn()
+            stats['products'] = conn.execute('SELECT COUNT(*) FROM catalog_products').fetchone()[0]
+            stats['fresh_products'] = conn.execute(
+                'SELECT COUNT(*) FROM catalog_products WHERE seen_at >= ?', (time.time() - self.max_age,)
+            ).fetchone()[0]
+            stats['listing_pages'] = conn.execute('SELECT COUNT(*) FROM catalog_pages').fetchone()[0]
+        except sqlite3.Error:
+            stats['products'] = stats['fresh_products'] = stats['listing_pages'] = 0
+        return stats
+
+
+catalog = Catalog(
+    CATALOG_DB,
+    interval=CATALOG_INTERVAL,
+    pages=CATALOG_PAGES,
+    max_age=CATALOG_MAX_AGE,
+    listing_url=CATALOG_LISTING_URL,
+) if CATALOG_ENABLED and CATALOG_DB else None
 
-    # カテゴリごとの価格.comカテゴリコード
-    category_codes = {
-        'cpu': '0510',
-        'motherboard': '0540',
-        'memory': '0520',
-        'gpu': '0550',
-        'storage': '0537',
-        'psu': '0590',
-        'case': '0580',
-        'cooler': '0512',
-        'os': '0560'
+
+# ==========================
+# 🔀 複数サイトの並列検索
+# ==========================
+# 取得先ごとの検索関数（価格.comはキャッシュ経由）
+SEARCH_SOURCES = {
+    'kakaku': cached_search_kakaku_async,
+    'rakuten': search_rakuten_async,
+    'amazon': search_amazon_async,
+    'google': search_google_shopping_async,
+}
+ENABLED_SOURCES = [
+    name.strip() for name in os.environ.get('SEARCH_SOURCES', 'kakaku,rakuten,amazon,google').split(',')
+    if name.strip() in SEARCH_SOURCES
+]
+# 取得先ごとの締め切り（秒）と、リクエスト全体の予算（秒）
+SOURCE_DEADLINES = {
+    'kakaku': float(os.environ.get('DEADLINE_KAKAKU', 8)),
+    'rakuten': float(os.environ.get('DEADLINE_RAKUTEN', 5)),
+    'amazon': float(os.environ.get('DEADLINE_AMAZON', 5)),
+    'google': float(os.environ.get('DEADLINE_GOOGLE', 5)),
+}
+FANOUT_BUDGET = float(os.environ.get('FANOUT_BUDGET', 10))
+
+
+async def _timed_source_call(search_func, product_name, category, timeout):
+    start = time.perf_counter()
+    result = await search_func(product_name, category, timeout=timeout)
+    return result, time.perf_counter() - start
+
+
+async def search_all_sources_async(product_name, category='', sources=None, budget=FANOUT_BUDGET,
+                                   search_funcs=None, on_result=None):
+    """有効な全取得先を並列に検索し、最安値と取得先ごとの状況を返す
+
+    search_funcs で取得先ごとの検索関数を差し替えられる。on_result(取得先, 状況, 結果) は
+    取得先の結果が届くたび（締め切りを過ぎた場合は結果 None）に呼ばれる。
+    """
+    search_funcs = search_funcs or SEARCH_SOURCES
+    sources = [name for name in (sources or ENABLED_SOURCES) if name in search_funcs]
+    start = time.monotonic()
+
+    pending = {}
+    for name in sources:
+        deadline = min(SOURCE_DEADLINES.get(name, budget), budget)
+        task = asyncio.ensure_future(_timed_source_call(search_funcs[name], product_name, category, deadline))
+        pending[task] = (name, deadline)
+
+    statuses = {}
+    offers = []
+    try:
+        while pending:
+            elapsed = time.monotonic() - start
+            next_deadline = min(deadline for _, deadline in pending.values())
+            done, _ = await asyncio.wait(
+                pending, timeout=max(next_deadline - elapsed, 0), return_when=asyncio.FIRST_COMPLETED)
+
+            for task in done:
+                name, _ = pending.pop(task)
+                try:
+                    result, latency = task.result()
+                except Exception as e:
+                    result = None
+                    status = {'status': 'error', 'error': str(e),
+                              'latency_ms': round((time.monotonic() - start) * 1000)}
+                else:
+                    price = parse_price(result.get('price')) if result else None
+                    status = {'status': 'ok' if price else 'empty', 'latency_ms': round(latency * 1000)}
+                    if price:
+                        status['price'] = price
+                        offers.append((price, name, result))
+                statuses[name] = status
+                if on_result is not None:
+                    on_result(name, status, result)
+
+            # 締め切りを過ぎた取得先は待たずに打ち切り、取得も取り消す
+            elapsed = time.monotonic() - start
+            for task, (name, deadline) in list(pending.items()):
+                if elapsed >= deadline:
+                    task.cancel()
+                    del pending[task]
+                    statuses[name] = {'status': 'timeout', 'latency_ms': round(deadline * 1000)}
+                    if on_result is not None:
+                        on_result(name, statuses[name], None)
+    finally:
+        # 呼び出し元が取り消された場合も残りの取得を取り消す
+        for task in pending:
+            task.cancel()
+
+    best = {}
+    if offers:
+        offers.sort(key=lambda offer: offer[0])
+        _, _, best_result = offers[0]
+        best = dict(best_result)
+        # 価格.com以外はスペックを抽出していないので商品名から補完する
+        for field, value in extract_specs(category, best.get('product', '')).items():
+            best.setdefault(field, value)
+
+    best['sources'] = statuses
+    # 所要時間（ミリ秒）は商品のスペックと混ざらないよう別にまとめる
+    best['timings'] = dict({name: status['latency_ms'] for name, status in statuses.items()},
+                           total=round((time.monotonic() - start) * 1000))
+    return best
+
+
+def search_all_sources(product_name, category='', sources=None, budget=FANOUT_BUDGET):
+    """search_all_sources_async の同期版"""
+    return run_in_caller(search_all_sources_async(product_name, category, sources, budget))
+
+
+def _sources_error(sources):
+    """リクエストの sources が取得先名のリストでなければエラーメッセージを返す"""
+    if sources is not None and (not isinstance(sources, list)
+                                or not all(isinstance(name, str) for name in sources)):
+        return 'sources は取得先名のリストで指定してください'
+    return None
+
+
+# ==========================
+# 📦 構成全体の一括価格取得
+# ==========================
+# 1回の一括検索で同時に検索するパーツ数
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', 9))
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 20))
+
+
+def _parse_batch_parts(parts):
+    """{カテゴリ: 商品名} またはリスト形式のパーツ指定を (カテゴリ, 商品名) のリストに変換"""
+    if isinstance(parts, dict):
+        items = parts.items()
+    else:
+        items = ((part.get('category', ''), part.get('productName', '')) for part in parts or [])
+
+    parsed = []
+    for category, product_name in items:
+        if isinstance(product_name, dict):
+            product_name = product_name.get('name', '')
+        product_name = (product_name or '').strip()
+        if product_name:
+            parsed.append((category, product_name))
+    return parsed
+
+
+async def search_batch_async(parts, fanout=False):
+    """複数パーツの価格を並列に取得（同じ商品は1回だけ検索）"""
+    start = time.monotonic()
+    search_func = search_all_sources_async if fanout else cached_search_kakaku_async
+    semaphore = asyncio.Semaphore(BATCH_WORKERS)
+
+    async def limited(product_name, category):
+        async with semaphore:
+            return await search_func(product_name, category)
+
+    tasks = {}
+    for category, product_name in parts:
+        key = (part_keys.key(product_name, category), category)
+        if key not in tasks:
+            tasks[key] = asyncio.ensure_future(limited(product_name, category))
+    try:
+        await asyncio.wait(tasks.values())
+    finally:
+        for task in tasks.values():
+            task.cancel()
+
+    results = {}
+    errors = {}
+    total = 0
+    for category, product_name in parts:
+        key = (part_keys.key(product_name, category), category)
+        try:
+            result = dict(tasks[key].result())
+        except Exception as e:
+            errors[category] = str(e)
+            continue
+
+        price = parse_price(result.get('price'))
+        if price:
+            results[category] = result
+            total += price
+        else:
+            errors[category] = f'{product_name} の価格を取得できませんでした'
+
+    return {
+        'results': results,
+        'errors': errors,
+        'total': total,
+        'elapsed_ms': round((time.monotonic() - start) * 1000),
     }
 
-    if category not in category_codes:
-        return jsonify({'suggestions': []})
 
+def search_batch(parts, fanout=False):
+    """search_batch_async の同期版"""
+    return run_in_caller(search_batch_async(parts, fanout))
+
+
+# ==========================
+# 📡 検索結果の逐次送信（Server-Sent Events）
+# ==========================
+async def _stream_kakaku(product_name, category, timeout, emit):
+    """cached_search_kakaku_async と同じキャッシュを使い、途中の結果を emit(イベント名, データ) で送る
+
+    キャッシュの値（cached）→ 価格と商品名（price）→ 画像とスペック（details）の順に送る。
+    price は最初の商品要素を受信した時点で送り、ページ全体の最安値が違えば送り直す。
+    取得用イベントループで動くため、永続キャッシュ・カタログ（SQLite）の読み書きはスレッドで行う。
+    """
+    key, kind = _kakaku_cache_key(product_name, category)
+    value, state = await asyncio.to_thread(result_cache.get, key)
+    if value:
+        emit('cached', dict(value, stale=state == 'stale'))
+    if state == 'fresh':
+        return dict(value)
+
+    hit = await asyncio.to_thread(catalog.lookup, key[0], category) if catalog is not None else None
+    if hit is not None:
+        emit('price', {field: hit[field] for field in ('price', 'product', 'source')})
+        emit('details', {field: value for field, value in hit.items() if field not in ('price', 'product', 'source')})
+        await asyncio.to_thread(result_cache.set, key, hit)
+        return dict(hit)
+
+    sent = {}
+
+    def emit_price(offer):
+        price = {'price': str(offer['price']), 'product': offer['name'], 'source': KAKAKU_SOURCE}
+        if price != sent:
+            sent.update(price)
+            emit('price', price)
+
+    async def emit_first_price(res):
+        offers = await asyncio.to_thread(_parse_response, res, parse_kakaku_offers, product_name)
+        if offers:
+            emit_price(offers[0])
+
+    early = []
+
+    def on_prefix(res):
+        if not early:
+            early.append(asyncio.ensure_future(emit_first_price(res)))
+
+    try:
+        offers = await search_kakaku_offers_async(product_name, category, timeout, on_prefix=on_prefix)
+    except UpstreamUnavailable:
+        # 一時的に取得できなかった結果はキャッシュしない（古い値があれば少し待ってから再取得させる）
+        if value:
+            await asyncio.to_thread(result_cache.set, key, value, result_cache.negative_ttl)
+            return dict(value)
+        return {}
+    finally:
+        for task in early:
+            # ページ全体の結果が先に揃った場合は途中の結果を送らない
+            task.cancel()
+    if offers:
+        emit_price(offers[0])
+    suggestion_index.add_many(category, [offer['name'] for offer in offers[:KAKAKU_OFFERS_MAX]])
+    result = _kakaku_result(offers, product_name, category)
+    if result:
+        emit('details', {field: value for field, value in result.items()
+                         if field not in ('price', 'product', 'source')})
+
+    if not result and value:
+        # 取得に失敗した場合は古い値を残し、少し待ってから再取得させる（ResultCache._refresh と同じ）
+        await asyncio.to_thread(result_cache.set, key, value, result_cache.negative_ttl)
+        return dict(value)
+    await asyncio.to_thread(result_cache.set, key, result)
+    if kind == 'text' and result.get('product'):
+        await asyncio.to_thread(part_keys.learn, product_name, category, result['product'])
+    return dict(result)
+
+
+async def search_stream_async(product_name, category='', fanout=False, sources=None):
+    """検索結果を届いた順に (イベント名, データ) で返す非同期ジェネレーター
+
+    価格.comの cached・price・details に続き、複数サイト検索では取得先ごとの結果を offer として送る。
+    最後に /api/search と同じ内容（見つからなければ error を含む）を done として送る。
+    """
+    events = asyncio.Queue()
+
+    def emit(event, data):
+        events.put_nowait((event, data))
+
+    def on_result(name, status, result):
+        emit('offer', dict(result or {}, **status, name=name))
+
+    if fanout or sources:
+        search_funcs = dict(SEARCH_SOURCES, kakaku=lambda name, cat, timeout: _stream_kakaku(name, cat, timeout, emit))
+        job = search_all_sources_async(product_name, category, sources, search_funcs=search_funcs,
+                                       on_result=on_result)
+    else:
+        job = _stream_kakaku(product_name, category, 15, emit)
+
+    task = asyncio.ensure_future(job)
+    task.add_done_callback(lambda _: events.put_nowait(None))
     try:
-        print(f"\n[SUGGEST] category={category} query={query}")
+        while True:
+            item = await events.get()
+            if item is None:
+                break
+            yield item
 
-        suggestions = []
+        result = task.result()
+        if not result.get('price'):
+            error = '価格を取得できませんでした' if fanout or sources else '価格.comで価格を取得できませんでした'
+            result = dict(result, error=error)
+        yield 'done', result
+    finally:
+        # 接続が切れた場合も残りの取得を取り消す
+        task.cancel()
 
-        if query and len(query) >= 2:
-            # 入力がある場合は検索結果から取得
-            category_code = category_codes[category]
-
-            # カテゴリ別のキーワードフィルター（必須キーワード）
-            category_keywords = {
-                'cpu': ['Intel', 'AMD', 'Core', 'Ryzen', 'Processor', 'CPU'],
-                'motherboard': ['ASUS', 'MSI', 'GIGABYTE', 'ASRock', 'Motherboard', 'マザーボード', 'Z790', 'B760', 'X670', 'B650'],
-                'memory': ['DDR4', 'DDR5', 'Memory', 'メモリ', 'RAM', 'GB'],
-                'gpu': ['GeForce', 'Radeon', 'グラフィックボード', 'グラフィック', 'ビデオカード', 'GPU', 'NVIDIA', 'AMD', 'RTX', 'GTX', 'RX', 'Arc'],
-                'storage': ['SSD', 'HDD', 'NVMe', 'SATA', 'M.2', 'ストレージ'],
-                'psu': ['電源', 'PSU', 'Power Supply', '電源ユニット', 'W', '80PLUS'],
-                'case': ['ケース', 'PCケース', 'タワー', 'Tower', 'ミドルタワー'],
-                'cooler': ['CPUクーラー', 'クーラー', '水冷', '空冷', 'ファン'],
-                'os': ['Windows', 'OS', 'オペレーティングシステム']
-            }
 
-            # 除外キーワード（これらが含まれていたら除外）
-            exclude_keywords = {
-                'gpu': ['ウェッジ', 'ゴルフ', 'Golf', 'フレックス', 'ロフト', 'バンス', 'シャフト']
-            }
+def _sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
-            search_url = f"https://kakaku.com/search_results/{quote(query)}/?category={category_code}"
-            print(f"[DEBUG] Search URL: {search_url}")
 
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
-            }
+# ==========================
+# 🧮 予算内の構成の最適化
+# ==========================
+# 構成を組む順番（先に決めたパーツで後のパーツの候補を絞り込む）
+BUILD_CATEGORIES = ['cpu', 'gpu', 'psu', 'motherboard', 'case', 'memory', 'storage', 'cooler', 'os']
+# 他のパーツとの互換性を判定しないカテゴリ
+INDEPENDENT_CATEGORIES = ['memory', 'storage', 'cooler', 'os']
+# categories を省略した場合に組むカテゴリ
+DEFAULT_BUILD_CATEGORIES = ['cpu', 'motherboard', 'memory', 'gpu', 'storage', 'psu', 'case']
+# カテゴリごとの候補数・返す構成数の上限
+OPTIMIZE_MAX_CANDIDATES = int(os.environ.get('OPTIMIZE_MAX_CANDIDATES', 5000))
+OPTIMIZE_MAX_TOP_K = int(os.environ.get('OPTIMIZE_MAX_TOP_K', 20))
+# 調べる候補の数と探索時間（秒）の上限（超えたらそれまでに見つけた構成を返す）
+OPTIMIZE_MAX_NODES = int(os.environ.get('OPTIMIZE_MAX_NODES', 200000))
+OPTIMIZE_TIME_LIMIT = float(os.environ.get('OPTIMIZE_TIME_LIMIT', 0.5))
+
+# マザーボード・ケースの大きさの順（ケースと同じか小さいマザーボードが入る）
+FORM_FACTOR_SIZES = {'Mini-ITX': 0, 'Micro-ATX': 1, 'ATX': 2, 'E-ATX': 3}
+# 推定消費電力 = CPUのTDP + GPUの消費電力 + BASE_POWER_W を電源容量の PSU_LOAD_RATIO 以内に収める
+# （画面の互換性チェックと同じ基準）
+BASE_POWER_W = 150
+PSU_LOAD_RATIO = 0.8
+# 下界の計算でCPUの消費電力をまとめる単位（W）
+POWER_STEP_W = 10
+
+
+def _spec_number(value):
+    """'125W' などのスペックの値から数値を取り出す（なければ None）"""
+    match = re.search(r'\d+(?:\.\d+)?', str(value)) if value else None
+    return float(match.group()) if match else None
+
+
+class CandidateTable:
+    """1カテゴリの候補を価格の安い順に並べ、互換性の判定に使う項目を列（リスト）で持つ"""
+
+    def __init__(self, category, candidates):
+        rows = sorted(((parse_price(candidate.get('price')), candidate) for candidate in candidates
+                       if parse_price(candidate.get('price'))), key=lambda row: row[0])
+        self.category = category
+        self.prices = [price for price, _ in rows]
+        self.rows = [dict(candidate, price=price) for price, candidate in rows]
+        self.sockets = [row.get('socket') or None for row in self.rows]
+        self.sizes = [FORM_FACTOR_SIZES.get(row.get('formFactor')) for row in self.rows]
+        # 不明な消費電力は0W、不明な電源容量は None（画面のチェックと同じく判定しない）
+        self.watts = [_spec_number(row.get('tdp') or row.get('power')) or 0 for row in self.rows]
+        self.capacities = [_spec_number(row.get('wattage')) for row in self.rows]
+
+    @classmethod
+    def placeholder(cls, category):
+        """構成に含めないカテゴリの代わりに使う、0円で互換性の判定に影響しない1件だけの表"""
+        table = cls(category, [])
+        table.prices, table.rows = [0], [None]
+        table.sockets, table.sizes, table.watts, table.capacities = [None], [None], [0], [None]
+        return table
+
+    def __len__(self):
+        return len(self.prices)
+
+
+class BuildPlan:
+    """optimize_builds の前処理
+
+    どの構成にも入らない候補（合うマザーボード・ケース・電源がない）を除き、
+    先に決めたパーツごとに「残りのパーツの最安の組み合わせ」（下界）を引けるようにする。
+    依存するカテゴリの組（GPU+電源・マザーボード+ケース）の下界は実際に組める最安値なので、
+    探索はほとんど引き返さずに安い構成へ進む。
+    """
+
+    def __init__(self, tables):
+        self.tables = {category: tables[category] if category in tables else CandidateTable.placeholder(category)
+                       for category in BUILD_CATEGORIES}
+        psu, case = self.tables['psu'], self.tables['case']
+
+        # 電源: 負荷の上限（容量 × PSU_LOAD_RATIO、容量不明は無制限）の昇順に並べ、
+        # 上限が load 以上の電源の最安値を二分探索で引く
+        supports = [capacity * PSU_LOAD_RATIO if capacity is not None else math.inf
+                    for capacity in psu.capacities]
+        order = sorted(range(len(psu)), key=supports.__getitem__)
+        self._psu_supports = supports
+        self._psu_sorted = [supports[i] for i in order]
+        self._psu_cheapest = [math.inf] * (len(order) + 1)
+        for j in range(len(order) - 1, -1, -1):
+            self._psu_cheapest[j] = min(self._psu_cheapest[j + 1], psu.prices[order[j]])
+        self.max_support = self._psu_sorted[-1] if order else -math.inf
+
+        # ケース: マザーボードの大きさ（不明は None）ごとに入るケースを価格順に
+        self._cases = {size: [i for i, other in enumerate(case.sizes)
+                              if size is None or other is None or other >= size]
+                       for size in [None, *FORM_FACTOR_SIZES.values()]}
+
+        self._psu_options = {}
+        self._gpu_options = {}
+        self._board_options = {}
+
+    def psu_cheapest(self, load):
+        """負荷 load[W] に耐える電源の最安値（なければ inf）"""
+        return self._psu_cheapest[bisect.bisect_left(self._psu_sorted, load)]
+
+    def psus(self, load):
+        """負荷 load[W] に耐える電源の位置（価格順）"""
+        j = bisect.bisect_left(self._psu_sorted, load)
+        if j not in self._psu_options:
+            self._psu_options[j] = ([], [])
+            if j < len(self._psu_sorted):
+                floor = self._psu_sorted[j]
+                for i, support in enumerate(self._psu_supports):
+                    if support >= floor:
+                        self._psu_options[j][0].append(self.tables['psu'].prices[i])
+                        self._psu_options[j][1].append(i)
+        return self._psu_options[j]
+
+    def gpus(self, cpu_watts):
+        """CPUの消費電力ごとに、組める電源があるGPUを (GPU + 最安の電源 の価格順の下界, 位置) で返す
+
+        CPUの消費電力は POWER_STEP_W 単位に切り下げてまとめる（負荷を小さく見積もるので下界のまま）。
+        実際の負荷に耐える電源がないGPUは電源の段階で除く。
+        """
+        bucket = cpu_watts - cpu_watts % POWER_STEP_W
+        if bucket not in self._gpu_options:
+            gpu = self.tables['gpu']
+            keyed = []
+            for i, watts in enumerate(gpu.watts):
+                load = BASE_POWER_W + bucket + watts
+                if load <= self.max_support:
+                    keyed.append((gpu.prices[i] + self.psu_cheapest(load), i))
+            keyed.sort()
+            self._gpu_options[bucket] = ([key for key, _ in keyed], [i for _, i in keyed])
+        return self._gpu_options[bucket]
+
+    def case_cheapest(self, size):
+        cases = self._cases[size]
+        return self.tables['case'].prices[cases[0]] if cases else math.inf
+
+    def cases(self, size):
+        """マザーボードの大きさ size が入るケースの (価格, 位置)（価格順）"""
+        cases = self._cases[size]
+        return [self.tables['case'].prices[i] for i in cases], cases
+
+    def boards(self, socket):
+        """CPUのソケットごとに、入るケースがあるマザーボードを (マザーボード + 最安のケース の価格順の下界, 位置) で返す"""
+        if socket not in self._board_options:
+            board = self.tables['motherboard']
+            keyed = sorted((board.prices[i] + self.case_cheapest(board.sizes[i]), i)
+                           for i, other in enumerate(board.sockets)
+                           if socket is None or other is None or other == socket)
+            keyed = [(key, i) for key, i in keyed if key < math.inf]
+            self._board_options[socket] = ([key for key, _ in keyed], [i for _, i in keyed])
+        return self._board_options[socket]
+
+    def cpus(self):
+        """組めるGPU+電源・マザーボード+ケースがあるCPUを (残りの4カテゴリ込みの下界, 位置) で返す"""
+        cpu = self.tables['cpu']
+        keyed = []
+        for i, price in enumerate(cpu.prices):
+            gpu_keys, _ = self.gpus(cpu.watts[i])
+            board_keys, _ = self.boards(cpu.sockets[i])
+            if gpu_keys and board_keys:
+                keyed.append((price + gpu_keys[0] + board_keys[0], i))
+        keyed.sort()
+        return [key for key, _ in keyed], [i for _, i in keyed]
+
+
+def optimize_builds(tables, budget, top_k, max_nodes=OPTIMIZE_MAX_NODES, time_limit=OPTIMIZE_TIME_LIMIT):
+    """予算内で互換性のある構成を安い順に top_k 件探す（分枝限定法）
+
+    CPU → GPU → 電源 → マザーボード → ケース → 残りのカテゴリ の順に決める。
+    各段階の候補は「その候補 + 依存する後のパーツの最安値」の順に並べてあり（BuildPlan）、
+    ここまでの合計 + その値 + 残りのカテゴリの最安値 が予算か見つけた top_k 件目の合計を超えたら
+    その段階の残りの候補はすべて打ち切る。
+    調べた候補の数が max_nodes を超えるか time_limit 秒を過ぎたら、それまでに見つけた構成を返す（truncated）。
+    """
+    categories = [category for category in BUILD_CATEGORIES if category in tables]
+    if not all(len(tables[category]) for category in categories):
+        return {'builds': [], 'nodes': 0, 'truncated': False}
+    plan = BuildPlan(tables)
+    independent = [plan.tables[category] for category in INDEPENDENT_CATEGORIES]
+    # rest[k] = k 番目以降の独立したカテゴリの最安値の合計
+    rest = [0] * (len(independent) + 1)
+    for k in range(len(independent) - 1, -1, -1):
+        rest[k] = rest[k + 1] + independent[k].prices[0]
+    independent_options = [(table.prices, range(len(table))) for table in independent]
+
+    best = []  # (-合計, 順番, 選んだ位置) の最大ヒープ
+    chosen = dict.fromkeys(BUILD_CATEGORIES, 0)
+    deadline = time.monotonic() + time_limit
+    nodes = 0
+    truncated = False
+
+    def limit():
+        # 見つけた top_k 件目より安い構成だけを探す
+        return budget if len(best) < top_k else min(budget, -best[0][0] - 1)
+
+    def scan(options, base):
+        """options の (下界, 位置) を下界 + base が上限を超えるまで返す（調べた候補はすべて数える）"""
+        nonlocal nodes, truncated
+        keys, indices = options
+        for key, i in zip(keys, indices):
+            if truncated or key + base > limit():
+                return
+            nodes += 1
+            if nodes > max_nodes or (nodes & 0xff == 0 and time.monotonic() > deadline):
+                truncated = True
+                return
+            yield key, i
+
+    def record(total):
+        entry = (-total, nodes, tuple(chosen[category] for category in categories))
+        if len(best) < top_k:
+            heapq.heappush(best, entry)
+        else:
+            heapq.heapreplace(best, entry)
+
+    def search_independent(k, subtotal):
+        if k == len(independent):
+            record(subtotal)
+            return
+        for price, i in scan(independent_options[k], subtotal + rest[k + 1]):
+            chosen[INDEPENDENT_CATEGORIES[k]] = i
+            search_independent(k + 1, subtotal + price)
+
+    cpu, gpu, board = plan.tables['cpu'], plan.tables['gpu'], plan.tables['motherboard']
+    for _, c in scan(plan.cpus(), rest[0]):
+        chosen['cpu'] = c
+        cpu_price, cpu_watts = cpu.prices[c], cpu.watts[c]
+        board_floor = plan.boards(cpu.sockets[c])[0][0]
+        for _, g in scan(plan.gpus(cpu_watts), cpu_price + board_floor + rest[0]):
+            chosen['gpu'] = g
+            subtotal = cpu_price + gpu.prices[g]
+            for psu_price, p in scan(plan.psus(BASE_POWER_W + cpu_watts + gpu.watts[g]),
+                                     subtotal + board_floor + rest[0]):
+                chosen['psu'] = p
+                for _, b in scan(plan.boards(cpu.sockets[c]), subtotal + psu_price + rest[0]):
+                    chosen['motherboard'] = b
+                    board_total = subtotal + psu_price + board.prices[b]
+                    for case_price, k in scan(plan.cases(board.sizes[b]), board_total + rest[0]):
+                        chosen['case'] = k
+                        search_independent(0, board_total + case_price)
+
+    builds = []
+    for negative_total, _, picks in sorted(best, reverse=True):
+        parts = {category: plan.tables[category].rows[i] for category, i in zip(categories, picks)}
+        picked = dict(zip(categories, picks))
+        power = BASE_POWER_W + sum(plan.tables[category].watts[picked.get(category, 0)] for category in ('cpu', 'gpu'))
+        builds.append({'total': -negative_total, 'estimatedPower': round(power), 'parts': parts})
+    return {'builds': builds, 'nodes': nodes, 'truncated': truncated}
+
+
+def _candidate_rows(category, candidates, constraints):
+    """候補（商品名・価格とスペック）を整え、constraints（{項目: 値 または 値のリスト}）に合うものだけ返す
+
+    スペックの項目がない候補は商品名から抽出して補う。
+    """
+    rows = [dict(candidate) for candidate in candidates if isinstance(candidate, dict) and candidate.get('name')]
+    for row, specs in zip(rows, extract_specs_batch(category, [row['name'] for row in rows])):
+        for field, value in specs.items():
+            row.setdefault(field, value)
+
+    for field, expected in (constraints or {}).items():
+        if field == 'maxPrice':
+            limit = parse_price(expected)
+            rows = [row for row in rows if limit and (parse_price(row.get('price')) or 0) <= limit]
+            continue
+        allowed = set(expected) if isinstance(expected, list) else {expected}
+        rows = [row for row in rows if row.get(field) in allowed]
+    return rows
+
+
+def _optimize_request_error(data):
+    """/api/optimize の指定の型が正しくなければエラーメッセージを返す"""
+    categories = data.get('categories')
+    if categories is not None and (not isinstance(categories, list)
+                                   or not all(isinstance(category, str) for category in categories)):
+        return 'categories はカテゴリ名のリストで指定してください'
+    unknown = [category for category in categories or [] if category not in BUILD_CATEGORIES]
+    if unknown:
+        return f'不明なカテゴリです: {", ".join(unknown)}'
+
+    candidates = data.get('candidates')
+    if candidates is not None and (not isinstance(candidates, dict)
+                                   or not all(isinstance(rows, list) for rows in candidates.values())):
+        return 'candidates は {カテゴリ: 候補のリスト} で指定してください'
+
+    constraints = data.get('constraints')
+    if constraints is not None and (not isinstance(constraints, dict)
+                                    or not all(isinstance(fields, dict) for fields in constraints.values())):
+        return 'constraints は {カテゴリ: {項目: 値}} で指定してください'
+    for fields in (constraints or {}).values():
+        for expected in fields.values():
+            values = expected if isinstance(expected, list) else [expected]
+            if not all(isinstance(value, (str, int, float)) for value in values):
+                return 'constraints の値は文字列・数値またはそのリストで指定してください'
+    return None
+
+
+# ==========================
+# 🧩 メイン処理
+# ==========================
+_started_pid = None
+_startup_lock = threading.Lock()
+
+
+def start_process():
+    """プロセスごとに1回だけ、保存済みのデータを読み込み裏の処理を始める（最初のリクエストで呼ぶ）
+
+    import 時には永続キャッシュ・カタログのファイルを開かない（解析プロセスも scraper を import するため）。
+    """
+    global _started_pid
+    pid = os.getpid()
+    if _started_pid == pid:
+        return
+    with _startup_lock:
+        if _started_pid == pid:
+            return
+        # 永続キャッシュの新しい結果・覚えた言い換え・巡回済みの商品名を読み込む
+        result_cache.warm_start(PRICE_CACHE_WARM_ENTRIES)
+        if price_store is not None:
+            part_keys.load(price_store, PART_ALIAS_MAX)
+        if catalog is not None:
+            for category in CATEGORY_CODES:
+                suggestion_index.add_many(category, catalog.names(category, SUGGEST_INDEX_MAX_NAMES))
+        if PREWARM_ENABLED:
+            prewarm_scheduler.start()
+        if catalog is not None:
+            catalog.start()
+        _started_pid = pid
+
+
+@app.before_request
+def _start_request_timer():
+    start_process()
+    g.request_started = time.perf_counter()
+    if request.path.startswith('/api/'):
+        prewarm_scheduler.live_started()
+        g.live_request = True
+
+
+@app.teardown_request
+def _finish_live_request(exc):
+    if g.pop('live_request', False):
+        prewarm_scheduler.live_finished()
+
+
+@app.after_request
+def _record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None and request.endpoint != 'get_metrics':
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        status = response.status_code
+
+        def record():
+            metrics.observe('pcparts_request_seconds', time.perf_counter() - started, endpoint=endpoint)
+            metrics.inc('pcparts_requests_total', endpoint=endpoint, status=status)
+
+        if response.is_streamed:
+            # 逐次送信（SSE）はヘッダーを返した時点ではなく、送り終えて閉じた時点までを計る
+            response.call_on_close(record)
+        else:
+            record()
+    return response
 
-            res = requests.get(search_url, headers=headers, timeout=10)
-            res.encoding = res.apparent_encoding or 'utf-8'
-            soup = BeautifulSoup(res.text, "html.parser")
 
-            # 複数のセレクターを試行
-            items = soup.select("div.p-item_name a")
-            print(f"[DEBUG] p-item_name a: {len(items)}")
+@app.route('/api/search', methods=['POST'])
+async def search_product():
+    data = request.json
+    product_name = data.get('productName', '')
+    category = data.get('category', '')
 
-            if len(items) == 0:
-                items = soup.select("li.item a")
-                print(f"[DEBUG] li.item a: {len(items)}")
+    if not product_name:
+        return jsonify({'error': '商品名が必要です'}), 400
 
-            if len(items) == 0:
-                items = soup.select("a.ckitanker")
-                print(f"[DEBUG] a.ckitanker: {len(items)}")
+    logger.debug("🔍 検索開始: %s (カテゴリ: %s)", product_name, category)
 
-            if len(items) == 0:
-                # より一般的なセレクター
-                items = soup.select("div[class*='item'] a, td.ckitanker a")
-                print(f"[DEBUG] generic selectors: {len(items)}")
+    offer_count = _offer_count(data.get('offers'), SEARCH_OFFERS)
+    error = _sources_error(data.get('sources'))
+    if error:
+        return jsonify({'error': error}), 400
 
-            items = items[:10]
+    # 複数サイト並列検索モード
+    if data.get('fanout') or data.get('sources'):
+        fanout_result = await search_all_sources_async(product_name, category, sources=data.get('sources'))
+        if fanout_result.get("price"):
+            logger.info("✅ %s から取得成功: ¥%s円", fanout_result['source'], fanout_result['price'])
+            return jsonify(page_offers(fanout_result, limit=offer_count))
+        return jsonify({'error': '価格を取得できませんでした', 'sources': fanout_result['sources']}), 404
 
-            # カテゴリに関連するキーワードを含む商品のみフィルタリング
-            keywords = category_keywords.get(category, [])
-            excludes = exclude_keywords.get(category, [])
+    # 価格.comから価格を取得（キャッシュ優先）
+    try:
+        web_result = await cached_search_kakaku_async(product_name, category)
+    except UpstreamUnavailable:
+        return jsonify({'error': '価格.comに一時的に接続できません'}), 503
+    if web_result.get("price"):
+        logger.info("✅ %s から取得成功: ¥%s円", web_result['source'], web_result['price'])
+        return jsonify(page_offers(web_result, limit=offer_count))
 
-            for item in items:
-                name = item.get_text(strip=True)
-                name = name.replace('\n', ' ').replace('  ', ' ').strip()
+    return jsonify({'error': '価格.comで価格を取得できませんでした'}), 404
 
-                # 除外キーワードチェック
-                is_excluded = False
-                for exclude in excludes:
-                    if exclude in name:
-                        is_excluded = True
-                        print(f"[DEBUG] Excluded (contains '{exclude}'): {name}")
-                        break
 
-                if is_excluded:
-                    continue
+def _offer_count(value, default):
+    """リクエストの件数の指定を 0〜KAKAKU_OFFERS_MAX に収める（指定がなければ default）"""
+    try:
+        count = default if value is None else int(value)
+    except (TypeError, ValueError):
+        count = default
+    return max(0, min(count, KAKAKU_OFFERS_MAX))
 
-                # PCパーツに関連するキーワードが含まれているかチェック
-                is_relevant = False
-                if keywords:
-                    for keyword in keywords:
-                        if keyword.lower() in name.lower():
-                            is_relevant = True
-                            break
-                else:
-                    is_relevant = True  # キーワードがない場合はすべて許可
 
-                if name and len(name) > 3 and name not in suggestions and is_relevant:
-                    suggestions.append(name)
-                    print(f"[DEBUG] Added: {name}")
+@app.route('/api/search/offers', methods=['POST'])
+async def search_product_offers():
+    """/api/search と同じ検索結果の商品一覧（安い順）を offset 件目から limit 件返す
+
+    キャッシュにある検索結果の一覧から返すため、次のページや他の候補の表示では価格.comへ取得しに行かない。
+    """
+    data = request.get_json(silent=True) or {}
+    product_name = (data.get('productName') or '').strip()
+    category = data.get('category', '')
+    if not product_name:
+        return jsonify({'error': '商品名が必要です'}), 400
+
+    offset = _offer_count(data.get('offset'), 0)
+    limit = _offer_count(data.get('limit'), SEARCH_OFFERS)
+    try:
+        web_result = await cached_search_kakaku_async(product_name, category)
+    except UpstreamUnavailable:
+        return jsonify({'error': '価格.comに一時的に接続できません'}), 503
+    if not web_result.get("price"):
+        return jsonify({'error': '価格.comで価格を取得できませんでした'}), 404
+
+    page = page_offers(web_result, offset, limit)
+    return jsonify({'offers': page['offers'], 'offset': offset, 'limit': limit, 'total': page['offersTotal'],
+                    'source': web_result['source']})
+
+@app.route('/api/search/stream', methods=['GET', 'POST'])
+def search_product_stream():
+    """/api/search の途中の結果を Server-Sent Events で送る（GET ではクエリ文字列で指定）"""
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        sources = data.get('sources')
+    else:
+        data = request.args
+        sources = [name for name in data.get('sources', '').split(',') if name] or None
+    product_name = (data.get('productName') or '').strip()
+    category = data.get('category', '')
+    fanout = str(data.get('fanout', '')).lower() not in ('', '0', 'false')
+    offer_count = _offer_count(data.get('offers'), SEARCH_OFFERS)
 
+    if not product_name:
+        return jsonify({'error': '商品名が必要です'}), 400
+    error = _sources_error(sources)
+    if error:
+        return jsonify({'error': error}), 400
+
+    logger.debug("📡 逐次検索開始: %s (カテゴリ: %s)", product_name, category)
+
+    def generate():
+        # ヘッダーをすぐに送り、プロキシにも接続が生きていることを知らせる
+        yield ': search started\n\n'
+        for event, payload in async_upstream.iterate(search_stream_async(product_name, category, fanout, sources)):
+            # 商品一覧は /api/search と同じ件数だけ送る（続きは /api/search/offers で取得する）
+            if 'offers' in payload or (event == 'done' and payload.get('price')):
+                payload = page_offers(payload, limit=offer_count)
+            yield _sse_event(event, payload)
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/api/search/batch', methods=['POST'])
+async def search_product_batch():
+    """構成全体のパーツ価格を一括取得"""
+    data = request.json or {}
+    parts = _parse_batch_parts(data.get('parts'))
+
+    if not parts:
+        return jsonify({'error': 'パーツ一覧が必要です'}), 400
+    if len(parts) > BATCH_MAX_ITEMS:
+        return jsonify({'error': f'一度に検索できるのは{BATCH_MAX_ITEMS}件までです'}), 400
+    # 結果はカテゴリごとに返すため、同じカテゴリを2回指定すると合計と結果が食い違う
+    seen, duplicates = set(), []
+    for category, _ in parts:
+        if category in seen and category not in duplicates:
+            duplicates.append(category)
+        seen.add(category)
+    if duplicates:
+        return jsonify({'error': 'カテゴリが重複しています', 'duplicates': duplicates}), 400
+
+    logger.debug("📦 一括検索開始: %d件", len(parts))
+    batch_result = await search_batch_async(parts, fanout=bool(data.get('fanout')))
+    offer_count = _offer_count(data.get('offers'), SEARCH_OFFERS)
+    batch_result['results'] = {category: page_offers(result, limit=offer_count)
+                               for category, result in batch_result['results'].items()}
+    logger.info("✅ 一括検索完了: %d件成功 / 合計 ¥%s", len(batch_result['results']), f"{batch_result['total']:,}")
+    return jsonify(batch_result)
+
+@app.route('/api/suggestions', methods=['POST'])
+async def get_suggestions():
+    """入力内容に応じた商品サジェストを取得"""
+    data = request.json
+    category = data.get('category', '')
+    query = data.get('query', '').strip()
+
+    if category not in CATEGORY_CODES:
+        return jsonify({'suggestions': []})
+
+    try:
+        logger.debug("[SUGGEST] category=%s query=%s", category, query)
+
+        if query and len(query) >= 2:
+            # 入力がある場合はローカル索引、足りなければ検索結果から取得
+            suggestions = await suggest_products_async(query, category)
         else:
             # 入力がない場合は人気商品の例を返す
-            popular_items = {
-                'cpu': ['Intel Core i9-14900K', 'AMD Ryzen 9 7950X', 'Intel Core i7-14700K', 'AMD Ryzen 7 7800X3D'],
-                'motherboard': ['ASUS ROG MAXIMUS Z790', 'MSI MPG B650 EDGE WIFI', 'ASUS TUF GAMING B760M'],
-                'memory': ['DDR5-6000 32GB', 'DDR4-3200 16GB', 'DDR5-5600 32GB'],
-                'gpu': ['RTX 4090', 'RTX 4080 SUPER', 'RTX 4070 Ti SUPER', 'RX 7900 XTX'],
-                'storage': ['Samsung 990 PRO 2TB', 'WD Blue SN580 1TB', 'Crucial P3 Plus 2TB'],
-                'psu': ['Corsair RM850e 850W', 'Seasonic FOCUS GX-850 850W'],
-                'case': ['NZXT H9 Flow', 'Fractal Design Pop Air RGB'],
-                'cooler': ['Noctua NH-D15', 'DeepCool AK620'],
-                'os': ['Windows 11 Home', 'Windows 11 Pro']
-            }
-
-            suggestions = popular_items.get(category, [])
+            suggestions = POPULAR_ITEMS.get(category, [])
 
-        print(f"✅ {len(suggestions)}件のサジェストを取得")
+        logger.debug("✅ %d件のサジェストを取得", len(suggestions))
         return jsonify({'suggestions': suggestions[:8]})
 
     except Exception as e:
-        print(f"❌ サジェスト取得失敗: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.warning("❌ サジェスト取得失敗: %s", e, exc_info=True)
         return jsonify({'suggestions': []})
 
+@app.route('/api/optimize', methods=['POST'])
+def optimize_build():
+    """予算内で互換性のある構成を安い順に返す
+
+    {"budget": 250000, "categories": [...], "candidates": {"cpu": [{"name": ..., "price": ...}, ...]},
+     "constraints": {"cpu": {"socket": "AM5"}, "gpu": {"maxPrice": 80000}}, "topK": 5}
+    candidates を省略したカテゴリはカタログ（一覧の巡回結果）の商品を候補にする。
+    """
+    start = time.monotonic()
+    data = request.get_json(silent=True) or {}
+    budget = parse_price(data.get('budget'))
+    if not budget:
+        return jsonify({'error': '予算が必要です'}), 400
+
+    error = _optimize_request_error(data)
+    if error:
+        return jsonify({'error': error}), 400
+
+    categories = [category for category in BUILD_CATEGORIES
+                  if category in (data.get('categories') or DEFAULT_BUILD_CATEGORIES)]
+    try:
+        top_k = max(1, min(int(data.get('topK', 5)), OPTIMIZE_MAX_TOP_K))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'topK は整数で指定してください'}), 400
+    candidates = data.get('candidates') or {}
+    constraints = data.get('constraints') or {}
+
+    tables = {}
+    missing = []
+    for category in categories:
+        rows = candidates.get(category)
+        if rows is None:
+            rows = catalog.candidates(category, OPTIMIZE_MAX_CANDIDATES) if catalog is not None else []
+        table = CandidateTable(category, _candidate_rows(category, rows[:OPTIMIZE_MAX_CANDIDATES],
+                                                         constraints.get(category)))
+        if not len(table):
+            missing.append(category)
+        tables[category] = table
+    if missing:
+        return jsonify({'error': '候補が見つからないカテゴリがあります', 'missing': missing}), 404
+
+    with timed('optimize'):
+        result = optimize_builds(tables, budget, top_k)
+    result['candidates'] = {category: len(table) for category, table in tables.items()}
+    result['elapsed_ms'] = round((time.monotonic() - start) * 1000)
+    if not result['builds']:
+        result['error'] = '予算内で互換性のある構成が見つかりませんでした'
+        return jsonify(result), 404
+    return jsonify(result)
+
+
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    """キャッシュ・接続プール・取得先の状態・文字コード判定・相乗り・サジェスト索引の統計情報を取得"""
+    return jsonify({
+        'cache': result_cache.stats(),
+        'http': async_upstream.stats(),
+        'sources': source_health.stats(),
+        'stream': stream_reader.stats(),
+        'layouts': layout_memory.stats(),
+        'parse_pool': parse_pool.stats(),
+        'part_keys': part_keys.stats(),
+        'catalog': catalog.stats() if catalog is not None else None,
+        'encoding': encoding_resolver.stats(),
+        'price_store': price_store.stats() if price_store is not None else None,
+        'singleflight': single_flight.stats(),
+        'prewarm': prewarm_scheduler.stats(),
+        'suggestions': suggestion_index.stats(),
+    })
+
+def _stats_gauges():
+    """/api/stats の数値を (名前, ラベル, 値) のゲージに変換"""
+    for key, value in result_cache.stats().items():
+        yield f'pcparts_cache_{key}', {}, value
+    if price_store is not None:
+        for key, value in price_store.stats().items():
+            yield f'pcparts_price_store_{key}', {}, value
+    for key, value in single_flight.stats().items():
+        yield f'pcparts_singleflight_{key}', {}, value
+    for key, value in prewarm_scheduler.stats().items():
+        yield f'pcparts_prewarm_{key}', {}, value
+    for key, value in encoding_resolver.stats().items():
+        if key != 'hosts':
+            yield 'pcparts_encoding_resolved_total', {'method': key}, value
+    for host, host_stats in async_upstream.stats().items():
+        for key, value in host_stats.items():
+            if isinstance(value, dict):
+                for priority, count in value.items():
+                    yield f'pcparts_http_{key}', {'host': host, 'priority': priority}, count
+            elif value is not None:
+                yield f'pcparts_http_{key}', {'host': host}, value
+    for key, value in stream_reader.stats().items():
+        yield f'pcparts_stream_{key}', {}, value
+    if catalog is not None:
+        for key, value in catalog.stats().items():
+            yield f'pcparts_catalog_{key}', {}, value
+    for key, value in part_keys.stats().items():
+        yield f'pcparts_part_keys_{key}', {}, value
+    for key, value in parse_pool.stats().items():
+        yield f'pcparts_parse_pool_{key}', {}, value
+    for key, value in layout_memory.stats().items():
+        if key != 'layouts':
+            yield f'pcparts_layout_{key}', {}, value
+    for source, source_stats in source_health.stats().items():
+        for key, value in source_stats.items():
+            if key == 'state':
+                yield 'pcparts_circuit_open', {'source': source}, int(value != 'closed')
+            elif value is not None:
+                yield f'pcparts_source_{key}', {'source': source}, value
+    for key, value in suggestion_index.stats().items():
+        if isinstance(value, dict):
+            for category, count in value.items():
+                yield f'pcparts_suggestions_{key}', {'category': category}, count
+        else:
+            yield f'pcparts_suggestions_{key}', {}, value
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheusのテキスト形式で計測値を出力"""
+    body = metrics.render(_stats_gauges())
+    return Response(body, mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/')
 def index():
     """メインページを表示"""
@@ -889,4 +4803,7 @@ if __name__ == '__main__':
     print("📡 価格.com から自動取得")
     port = int(os.environ.get('PORT', 5000))
     print(f"🚀 起動中: http://localhost:{port}\n")
+    # 開発サーバーでは LOG_LEVEL 未指定なら詳細ログを出す
+    if 'LOG_LEVEL' not in os.environ:
+        logger.setLevel(logging.DEBUG)
     app.run(host='0.0.0.0', port=port, debug=True)
@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+"""テスト共通の設定（scraper を import する前に環境変数を決める）"""
+import os
+import sys
+
+# 永続キャッシュ・カタログのファイルを作らず、裏での事前取得も始めない
+os.environ['PRICE_CACHE_DB'] = ''
+os.environ['CATALOG_ENABLED'] = '0'
+os.environ['PREWARM_ENABLED'] = '0'
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
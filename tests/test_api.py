@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""APIの入力チェックと応答の形"""
+import json
+import os
+
+import pytest
+
+import scraper
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bench', 'fixtures')
+
+
+@pytest.fixture
+def client():
+    return scraper.app.test_client()
+
+
+def test_search_rejects_string_sources(client):
+    response = client.post('/api/search', json={'productName': 'RTX 4090', 'sources': 'kakaku'})
+    assert response.status_code == 400
+
+
+def test_stream_rejects_string_sources(client):
+    response = client.post('/api/search/stream', json={'productName': 'RTX 4090', 'sources': 'kakaku'})
+    assert response.status_code == 400
+
+
+def test_batch_rejects_duplicate_categories(client):
+    parts = [{'category': 'storage', 'productName': 'SSD 1TB'}, {'category': 'storage', 'productName': 'HDD 4TB'}]
+    response = client.post('/api/search/batch', json={'parts': parts})
+    assert response.status_code == 400
+    assert response.get_json()['duplicates'] == ['storage']
+
+
+@pytest.mark.parametrize('data', [
+    {'budget': 200000, 'categories': 'cpu'},
+    {'budget': 200000, 'categories': ['cpu', 'toaster']},
+    {'budget': 200000, 'candidates': {'cpu': 'Ryzen'}},
+    {'budget': 200000, 'candidates': ['cpu']},
+    {'budget': 200000, 'topK': 'many'},
+    {'categories': ['cpu']},
+])
+def test_optimize_rejects_bad_input(client, data):
+    assert client.post('/api/optimize', json=data).status_code == 400
+
+
+def test_optimize_reports_no_build(client):
+    candidates = {
+        'cpu': [{'name': 'cpu', 'price': 30000, 'socket': 'AM5'}],
+        'motherboard': [{'name': 'board', 'price': 20000, 'socket': 'LGA1700'}],
+    }
+    response = client.post('/api/optimize', json={
+        'budget': 200000, 'categories': ['cpu', 'motherboard'], 'candidates': candidates})
+    assert response.status_code == 404
+    assert response.get_json()['builds'] == []
+
+
+def test_stream_pages_offers_like_search(client, monkeypatch):
+    with open(os.path.join(FIXTURE_DIR, 'kakaku_search_cpu.html'), 'rb') as f:
+        body = f.read()
+
+    async def kakaku_page(url, *args, **kwargs):
+        return scraper._build_response(url, 200, {'Content-Type': 'text/html; charset=Shift_JIS'}, body)
+
+    monkeypatch.setattr(scraper, 'http_get_async', kakaku_page)
+    response = client.post('/api/search/stream', json={'productName': 'test stream paging', 'category': 'cpu',
+                                                       'offers': 2})
+    events = {}
+    for block in response.get_data(as_text=True).split('\n\n'):
+        lines = dict(line.split(': ', 1) for line in block.split('\n') if line.startswith(('event', 'data')))
+        if 'event' in lines:
+            events[lines['event']] = json.loads(lines['data'])
+
+    assert len(events['done']['offers']) == 2
+    assert events['done']['offersTotal'] > 2
+    assert len(events['details']['offers']) == 2
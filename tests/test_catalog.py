@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""カタログの結果を使うのは、型番のキーが完全に一致し最近確認した商品だけであること"""
+import asyncio
+import json
+import time
+
+import pytest
+
+import scraper
+
+NAME = 'Intel Core i9-14900K BOX'
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    return scraper.Catalog(str(tmp_path / 'catalog.sqlite3'), interval=3600, pages=1, max_age=600,
+                           listing_url='http://127.0.0.1/{code}/{page}')
+
+
+def add_product(catalog, name, part_key, price=80000, age=0):
+    catalog._conn().execute(
+        'INSERT OR REPLACE INTO catalog_products '
+        '(category, name, part_key, price, image, specs, page_url, seen_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+        ('cpu', name, part_key, price, '', json.dumps({}), 'http://127.0.0.1/0510/1', time.time() - age),
+    )
+
+
+def test_fresh_exact_key_is_used(catalog):
+    key = scraper.part_keys.key(NAME, 'cpu')
+    add_product(catalog, NAME, key)
+    result = catalog.lookup(key, 'cpu')
+    assert result['product'] == NAME
+    assert result['price'] == '80000'
+
+
+def test_old_product_is_not_used(catalog):
+    key = scraper.part_keys.key(NAME, 'cpu')
+    add_product(catalog, NAME, key, age=601)
+    assert catalog.lookup(key, 'cpu') is None
+
+
+def test_outdated_stored_key_is_not_used(catalog):
+    # 巡回時のキーが今の文法で作るキーと違う商品（解析し直していない一覧ページの商品）
+    key = scraper.part_keys.key('Intel Core i7-14700K', 'cpu')
+    add_product(catalog, NAME, key)
+    assert catalog.lookup(key, 'cpu') is None
+    assert catalog.stats()['key_mismatches'] == 1
+
+
+def test_load_falls_back_to_live_search(catalog, monkeypatch):
+    add_product(catalog, NAME, scraper.part_keys.key(NAME, 'cpu'), age=601)
+    live = {'price': '79000', 'product': NAME, 'source': scraper.KAKAKU_SOURCE}
+
+    async def search(product_name, category='', timeout=15):
+        return live
+
+    monkeypatch.setattr(scraper, 'catalog', catalog)
+    monkeypatch.setattr(scraper, 'search_kakaku_async', search)
+    assert asyncio.run(scraper.load_kakaku_async('i9 14900k', 'cpu')) == live
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""CircuitBreaker の状態遷移（closed → open → half_open → closed / open）"""
+import pytest
+
+import scraper
+
+
+def make_breaker(failures=3, cooldown=30, max_cooldown=120):
+    return scraper.CircuitBreaker('test', failures=failures, cooldown=cooldown, max_cooldown=max_cooldown)
+
+
+def fail(breaker, times):
+    for _ in range(times):
+        probe = breaker.before_request()
+        breaker.record(False, probe)
+
+
+def wait_cooldown(breaker):
+    """cooldown 秒が過ぎたことにする"""
+    breaker.opened_at -= breaker.cooldown
+
+
+def test_opens_after_consecutive_failures():
+    breaker = make_breaker(failures=3)
+    fail(breaker, 2)
+    assert breaker.state == 'closed'
+    fail(breaker, 1)
+    assert breaker.state == 'open'
+    with pytest.raises(scraper.CircuitOpen):
+        breaker.before_request()
+    assert breaker.stats()['rejected'] == 1
+
+
+def test_success_resets_failure_count():
+    breaker = make_breaker(failures=3)
+    fail(breaker, 2)
+    breaker.record(True, breaker.before_request())
+    fail(breaker, 2)
+    assert breaker.state == 'closed'
+
+
+def test_circuit_open_is_upstream_unavailable():
+    # 遮断中の結果はキャッシュしない（UpstreamUnavailable として扱う）
+    assert issubclass(scraper.CircuitOpen, scraper.UpstreamBusy)
+    assert issubclass(scraper.UpstreamBusy, scraper.UpstreamUnavailable)
+
+
+def test_half_open_allows_single_probe():
+    breaker = make_breaker(failures=1)
+    fail(breaker, 1)
+    wait_cooldown(breaker)
+    assert breaker.before_request() is True
+    assert breaker.state == 'half_open'
+    # 試しの送信中は他のリクエストを送らない
+    with pytest.raises(scraper.CircuitOpen):
+        breaker.before_request()
+
+
+def test_probe_success_closes_and_resets_cooldown():
+    breaker = make_breaker(failures=1, cooldown=30)
+    fail(breaker, 1)
+    wait_cooldown(breaker)
+    fail(breaker, 1)
+    assert breaker.cooldown == 60
+    wait_cooldown(breaker)
+    breaker.record(True, breaker.before_request())
+    assert breaker.state == 'closed'
+    assert breaker.cooldown == 30
+    assert breaker.before_request() is False
+
+
+def test_probe_failure_doubles_cooldown_up_to_max():
+    breaker = make_breaker(failures=1, cooldown=30, max_cooldown=100)
+    fail(breaker, 1)
+    for expected in (60, 100, 100):
+        wait_cooldown(breaker)
+        fail(breaker, 1)
+        assert breaker.state == 'open'
+        assert breaker.cooldown == expected
+
+
+def test_released_probe_can_be_retried():
+    breaker = make_breaker(failures=1)
+    fail(breaker, 1)
+    wait_cooldown(breaker)
+    probe = breaker.before_request()
+    # 送信待ちがあふれた場合などは結果を判定せずに枠だけ返す
+    breaker.release_probe(probe)
+    assert breaker.state == 'half_open'
+    assert breaker.before_request() is True
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""optimize_builds の互換性の判定と、組める構成がない入力"""
+import scraper
+
+BASE = {
+    'cpu': [{'name': 'cpu', 'price': 30000, 'socket': 'AM5', 'tdp': '65W'}],
+    'motherboard': [{'name': 'board', 'price': 20000, 'socket': 'AM5', 'formFactor': 'ATX'}],
+    'memory': [{'name': 'memory', 'price': 10000}],
+    'gpu': [{'name': 'gpu', 'price': 50000, 'power': '200W'}],
+    'storage': [{'name': 'storage', 'price': 8000}],
+    'psu': [{'name': 'psu', 'price': 9000, 'wattage': '650W'}],
+    'case': [{'name': 'case', 'price': 7000, 'formFactor': 'ATX'}],
+}
+BASE_TOTAL = 134000
+
+
+def optimize(budget=200000, top_k=5, **overrides):
+    candidates = dict(BASE, **overrides)
+    tables = {category: scraper.CandidateTable(category, rows) for category, rows in candidates.items()}
+    return scraper.optimize_builds(tables, budget, top_k)
+
+
+def totals(result):
+    return [build['total'] for build in result['builds']]
+
+
+def test_finds_compatible_build():
+    result = optimize()
+    assert totals(result) == [BASE_TOTAL]
+    assert result['builds'][0]['parts']['cpu']['name'] == 'cpu'
+    assert result['truncated'] is False
+
+
+def test_budget_below_cheapest_build():
+    result = optimize(budget=BASE_TOTAL - 1)
+    assert result['builds'] == []
+    assert result['truncated'] is False
+
+
+def test_psu_too_small():
+    # 150W + 65W + 200W を 300W × 0.8 では賄えない
+    result = optimize(psu=[{'name': 'psu', 'price': 5000, 'wattage': '300W'}])
+    assert result['builds'] == []
+    assert result['truncated'] is False
+
+
+def test_only_expensive_psu_fits():
+    psus = [{'name': f'small-{i}', 'price': 3000 + i, 'wattage': '300W'} for i in range(50)]
+    psus.append({'name': 'large', 'price': 40000, 'wattage': '1000W'})
+    result = optimize(psu=psus, top_k=1)
+    assert result['builds'][0]['parts']['psu']['name'] == 'large'
+    assert result['truncated'] is False
+
+
+def test_unknown_psu_capacity_is_not_checked():
+    result = optimize(psu=[{'name': 'psu', 'price': 5000}])
+    assert totals(result) == [BASE_TOTAL - 4000]
+
+
+def test_case_too_small_for_board():
+    result = optimize(case=[{'name': 'case', 'price': 7000, 'formFactor': 'Mini-ITX'}])
+    assert result['builds'] == []
+
+
+def test_socket_mismatch():
+    result = optimize(motherboard=[{'name': 'board', 'price': 20000, 'socket': 'LGA1700', 'formFactor': 'ATX'}])
+    assert result['builds'] == []
+
+
+def test_empty_category():
+    result = optimize(gpu=[])
+    assert result == {'builds': [], 'nodes': 0, 'truncated': False}
+
+
+def test_builds_are_cheapest_first():
+    memory = [{'name': f'memory-{i}', 'price': 10000 + 1000 * i} for i in range(4)]
+    result = optimize(memory=memory, top_k=3)
+    assert totals(result) == [BASE_TOTAL, BASE_TOTAL + 1000, BASE_TOTAL + 2000]
+
+
+def test_node_limit_truncates():
+    memory = [{'name': f'memory-{i}', 'price': 10000 + i} for i in range(100)]
+    tables = {category: scraper.CandidateTable(category, rows) for category, rows in dict(BASE, memory=memory).items()}
+    result = scraper.optimize_builds(tables, 10 ** 7, 20, max_nodes=5)
+    assert result['truncated'] is True
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""PartKeyNormalizer の型番のキーと言い換えの学習"""
+import scraper
+
+I9 = 'Intel Core i9-14900K BOX'
+
+
+def make_normalizer():
+    return scraper.PartKeyNormalizer(max_aliases=10)
+
+
+def test_grammar_queries_share_key():
+    part_keys = make_normalizer()
+    assert part_keys.key('i9 14900k', 'cpu') == part_keys.key('Intel Core i9-14900K', 'cpu')
+    assert part_keys.resolve('rtx 4090', 'gpu')[2] == 'grammar'
+
+
+def test_memory_kit_and_single_module_keys_differ():
+    part_keys = make_normalizer()
+    kit = part_keys.key('DDR5-6000 32GB (16GBx2)', 'memory')
+    single = part_keys.key('DDR5-6000 32GB', 'memory')
+    assert kit != single
+    assert part_keys.key('DDR5-6000 16GB', 'memory') != kit
+
+
+def test_learns_alias_for_model_number():
+    part_keys = make_normalizer()
+    part_keys.learn('14900k', 'cpu', I9)
+    key, query, kind = part_keys.resolve('14900k', 'cpu')
+    assert kind == 'alias'
+    assert key == part_keys.key('Intel Core i9-14900K', 'cpu')
+    assert query == 'Core i9-14900K'
+    assert part_keys.stats()['learned'] == 1
+
+
+def test_does_not_learn_broad_query():
+    # 'i9' はたまたま最安だった1つの型番の言い換えにしない
+    part_keys = make_normalizer()
+    part_keys.learn('i9', 'cpu', I9)
+    assert part_keys.resolve('i9', 'cpu')[2] == 'text'
+
+
+def test_does_not_learn_words_missing_from_result():
+    part_keys = make_normalizer()
+    part_keys.learn('14900k ultra', 'cpu', I9)
+    assert part_keys.resolve('14900k ultra', 'cpu')[2] == 'text'
+
+
+def test_does_not_learn_grammar_query():
+    part_keys = make_normalizer()
+    part_keys.learn('i9 14900k', 'cpu', I9)
+    assert part_keys.stats()['aliases'] == 0
+
+
+def test_aliases_are_per_category():
+    part_keys = make_normalizer()
+    part_keys.learn('14900k', 'cpu', I9)
+    assert part_keys.resolve('14900k', 'motherboard')[2] == 'text'
+
+
+def test_alias_limit_drops_oldest():
+    part_keys = scraper.PartKeyNormalizer(max_aliases=1)
+    part_keys.learn('14900k', 'cpu', I9)
+    part_keys.learn('14700k', 'cpu', 'Intel Core i7-14700K BOX')
+    assert part_keys.resolve('14900k', 'cpu')[2] == 'text'
+    assert part_keys.resolve('14700k', 'cpu')[2] == 'alias'
+
+
+class FakeStore:
+    def __init__(self, aliases):
+        self._aliases = aliases
+        self.saved = []
+
+    def aliases(self, limit):
+        return self._aliases[:limit]
+
+    def put_alias(self, alias, category, part_key, query):
+        self.saved.append((alias, category, part_key, query))
+
+
+def test_load_skips_aliases_without_model_number():
+    key = scraper.parse_part_model(I9, 'cpu')[0]
+    store = FakeStore([('14900k', 'cpu', key, 'Core i9-14900K'), ('i9', 'cpu', key, 'Core i9-14900K')])
+    part_keys = make_normalizer()
+    part_keys.load(store, 10)
+    assert part_keys.resolve('14900k', 'cpu')[2] == 'alias'
+    assert part_keys.resolve('i9', 'cpu')[2] == 'text'
+
+
+def test_learned_alias_is_saved():
+    store = FakeStore([])
+    part_keys = make_normalizer()
+    part_keys.load(store, 10)
+    part_keys.learn('14900k', 'cpu', I9)
+    part_keys.learn('14900k', 'cpu', I9)
+    assert [alias for alias, *_ in store.saved] == ['14900k']
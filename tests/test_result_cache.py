@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""ResultCache の TTL と、一時的に取得できなかった結果をキャッシュしないこと"""
+import asyncio
+
+import pytest
+
+import scraper
+
+KEY = ('intel core i9-14900k', 'cpu')
+RESULT = {'price': '80000', 'product': 'Core i9-14900K', 'source': scraper.KAKAKU_SOURCE}
+
+
+def make_cache():
+    return scraper.ResultCache(max_entries=10, max_bytes=1 << 20, ttl=300, negative_ttl=60, stale_ttl=3600)
+
+
+def test_found_result_uses_ttl():
+    cache = make_cache()
+    cache.set(KEY, RESULT)
+    _, remaining = cache.peek(KEY)
+    assert 60 < remaining <= 300
+
+
+def test_empty_result_uses_negative_ttl():
+    cache = make_cache()
+    cache.set(KEY, {})
+    value, remaining = cache.peek(KEY)
+    assert value == {}
+    assert 0 < remaining <= 60
+    assert cache.get(KEY) == ({}, 'fresh')
+    assert cache.stats()['negative_hits'] == 1
+
+
+def test_expired_entry_is_stale_then_dropped():
+    cache = make_cache()
+    cache.set(KEY, RESULT, ttl=-1)
+    assert cache.get(KEY) == (RESULT, 'stale')
+    cache.set(KEY, RESULT, ttl=-cache.stale_ttl - 1)
+    assert cache.get(KEY) == (None, 'miss')
+
+
+@pytest.mark.parametrize('error', [
+    scraper.UpstreamBusy('queue full'),
+    scraper.CircuitOpen('open'),
+    scraper.UpstreamUnavailable('timeout'),
+])
+def test_transient_failure_is_not_cached(error):
+    cache = make_cache()
+
+    async def loader():
+        raise error
+
+    with pytest.raises(type(error)):
+        asyncio.run(cache.get_or_load_async(KEY, loader))
+    assert cache.get(KEY) == (None, 'miss')
+
+
+def test_real_empty_result_is_cached():
+    cache = make_cache()
+
+    async def loader():
+        return {}
+
+    assert asyncio.run(cache.get_or_load_async(KEY, loader)) == {}
+    assert cache.get(KEY) == ({}, 'fresh')
+
+
+def test_failed_refresh_keeps_stale_value():
+    cache = make_cache()
+    cache.set(KEY, RESULT, ttl=-1)
+
+    def loader():
+        raise scraper.CircuitOpen('open')
+
+    assert cache.refresh(KEY, loader, RESULT) is False
+    value, remaining = cache.peek(KEY)
+    assert value == RESULT
+    # 少し待ってから再取得させる
+    assert 0 < remaining <= 60
+    assert cache.stats()['refresh_failures'] == 1
+
+
+def test_empty_refresh_keeps_stale_value():
+    cache = make_cache()
+    cache.set(KEY, RESULT, ttl=-1)
+    assert cache.refresh(KEY, lambda: {}, RESULT) is False
+    assert cache.peek(KEY)[0] == RESULT
+
+
+class TestSearchKakakuOffers:
+    """search_kakaku は取得できなかった場合と「商品なし」を区別する"""
+
+    def test_shedding_raises(self, monkeypatch):
+        async def busy(*args, **kwargs):
+            raise scraper.UpstreamBusy('queue full')
+
+        monkeypatch.setattr(scraper, 'http_get_async', busy)
+        with pytest.raises(scraper.UpstreamUnavailable):
+            scraper.search_kakaku('test shedding', 'cpu')
+
+    def test_timeout_raises(self, monkeypatch):
+        async def timeout(*args, **kwargs):
+            raise asyncio.TimeoutError()
+
+        monkeypatch.setattr(scraper, 'http_get_async', timeout)
+        with pytest.raises(scraper.UpstreamUnavailable):
+            scraper.search_kakaku('test timeout', 'cpu')
+
+    def test_server_error_raises(self, monkeypatch):
+        async def server_error(url, *args, **kwargs):
+            return scraper._build_response(url, 503, {}, b'<html></html>')
+
+        monkeypatch.setattr(scraper, 'http_get_async', server_error)
+        with pytest.raises(scraper.UpstreamUnavailable):
+            scraper.search_kakaku('test server error', 'cpu')
+
+    def test_no_results_is_empty(self, monkeypatch):
+        async def empty(url, *args, **kwargs):
+            return scraper._build_response(url, 200, {}, b'<html><body></body></html>')
+
+        monkeypatch.setattr(scraper, 'http_get_async', empty)
+        assert scraper.search_kakaku('test empty', 'cpu') == {}
+
+
+def test_search_returns_503_without_caching(monkeypatch):
+    async def unavailable(*args, **kwargs):
+        raise scraper.CircuitOpen('open')
+
+    monkeypatch.setattr(scraper, 'http_get_async', unavailable)
+    response = scraper.app.test_client().post(
+        '/api/search', json={'productName': 'test unavailable 503', 'category': 'cpu'})
+    assert response.status_code == 503
+    key = (scraper.part_keys.key('test unavailable 503', 'cpu'), 'cpu')
+    assert scraper.result_cache.get(key) == (None, 'miss')